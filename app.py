@@ -1,21 +1,166 @@
 import base64
+import hmac
+import os
+import random
+import tempfile
+import time
+import uuid
 from bson.json_util import dumps
-from flask import Flask, jsonify, abort, make_response, request
+from flask import Flask, Response, jsonify, abort, make_response, request, g
 from flask_login import LoginManager, login_required, current_user
-from xdb_controller.controller import Driver, UserModel, DocumentModel
+from werkzeug.wsgi import get_input_stream, wrap_file
+from xdb_controller.controller import Driver, UserModel, DocumentModel, IngestLimitError, ServiceBusy, \
+    SegmentsUnavailable
+from xdb_controller.ingest import iter_tar
+from xdb_controller.serializer import iter_multipart
+from xdb_controller import compression
+from xdb_controller import metrics
+from xdb_controller import profiling
+from xdb_controller.backends import MemoryBackend, SQLiteBackend
 
 app = Flask(__name__)
 # DB name
 DB_NAME = 'XML_SRV_TEST'
 app.config['MONGO1_DBNAME'] = DB_NAME
+# How many document IDs every worker reserves at once (1 - no local reservation)
+app.config['DOC_ID_BLOCK_SIZE'] = 1
+# Verified credentials/memberships kept in memory (entries, seconds)
+app.config['AUTH_CACHE_SIZE'] = 4096
+app.config['AUTH_CACHE_TTL'] = 300
+# Memory for rendered XML documents (bytes)
+app.config['RENDER_CACHE_SIZE'] = 64 * 1024 * 1024
+# How new documents are stored: json (string), bson (subdocument) or raw (original compressed bytes)
+app.config['STORAGE_FORMAT'] = 'json'
+# Uploads limits: size in bytes and elements nesting depth (deeper documents get 413 response)
+app.config['MAX_DOC_SIZE'] = 256 * 1024 * 1024
+app.config['MAX_DOC_DEPTH'] = 256
+# Documents this large (bytes) and above are sent with chunked streaming response
+app.config['STREAM_THRESHOLD'] = 1024 * 1024
+# Documents written by one bulk insert during bulk upload
+app.config['BULK_CHUNK_SIZE'] = 100
+# Processes converting large documents (0 - convert in request thread),
+# size (bytes) from which documents are sent there and how many may wait for conversion.
+# Uploads are parsed there whatever their size, but XML of documents from STREAM_THRESHOLD up is streamed
+# from request thread: keep CONVERSION_THRESHOLD below STREAM_THRESHOLD, so the pool renders the rest
+app.config['CONVERSION_WORKERS'] = 0
+app.config['CONVERSION_THRESHOLD'] = 256 * 1024
+app.config['CONVERSION_QUEUE'] = None
+# Documents listing page size: default and maximum
+app.config['LIST_PAGE_SIZE'] = 100
+app.config['LIST_PAGE_MAX'] = 1000
+# Most documents one batch read may ask for
+app.config['BATCH_MAX_DOCS'] = 1000
+# Cached per document partial results of aggregation queries (entries)
+app.config['AGGREGATE_CACHE_SIZE'] = 65536
+# Keep full-text index of documents text (search endpoint answers "disabled" error otherwise).
+# Costs extra write per distinct term on every upload; documents stored before it was turned on
+# get indexed with: python migrate_docs.py --index-text
+app.config['TEXT_INDEX'] = False
+# Store identical document contents once (costs blob lookup per upload and per read)
+app.config['DEDUP'] = False
+# Every this version of updated document is kept in full, others as differences with next version
+app.config['VERSION_SNAPSHOT_INTERVAL'] = 10
+# Where data is kept: mongo (MongoDB on localhost), sqlite (files in SQLITE_PATH directory) or memory
+app.config['STORAGE_BACKEND'] = 'mongo'
+app.config['SQLITE_PATH'] = '.'
+# Most bytes request body sent with Content-Encoding may decompress to (bulk uploads included)
+app.config['MAX_DECOMPRESSED_SIZE'] = 1024 * 1024 * 1024
+# Directory of append-only segment files for large raw payloads (None - keep them in database),
+# payload size (compressed bytes) from which they go there and size of one segment file
+app.config['SEGMENTS_PATH'] = None
+app.config['SEGMENT_THRESHOLD'] = 1024 * 1024
+app.config['SEGMENT_SIZE'] = 256 * 1024 * 1024
+# Directory shared by worker processes to sum up their metrics (None - single process server)
+app.config['METRICS_DIR'] = None
+# Profiling of single requests: by header "X-Profile: <PROFILE_TOKEN>" (None - disabled; response gets
+# Server-Timing and X-Profile-File headers) or every request with PROFILE_SAMPLE_RATE probability,
+# of PROFILE_ORGS organizations only if given. Mode: sample (collapsed stacks) or cprofile (pstats),
+# X-Profile-Mode header picks it for one request.
+app.config['PROFILE_TOKEN'] = None
+app.config['PROFILE_SAMPLE_RATE'] = 0.0
+app.config['PROFILE_ORGS'] = ()
+app.config['PROFILE_MODE'] = 'sample'
+app.config['PROFILE_INTERVAL'] = 0.001
+app.config['PROFILE_DIR'] = os.path.join(tempfile.gettempdir(), 'xdb-profiles')
+# Python file overriding settings above, e.g. STORAGE_BACKEND = 'memory' for benchmarks
+app.config.from_envvar('XDB_SETTINGS', silent=True)
+
+class DecompressMiddleware:
+    '''
+    Decodes request bodies sent with Content-Encoding, so views read plain data from request stream.
+    Body of unsupported coding gets 415 response. Its Content-Length (compressed bytes) is kept
+    as environ['xdb.raw_length'], see upload_size.
+    '''
+
+    def __init__(self, wsgi_app, max_size=None):
+        self.wsgi_app = wsgi_app
+        self.max_size = max_size
+
+    def __call__(self, environ, start_response):
+        coding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if coding in ('', 'identity'):
+            return self.wsgi_app(environ, start_response)
+        if coding not in compression.DECODINGS:
+            start_response('415 Unsupported Media Type', [('Content-Type', 'application/json'),
+                                                          ('Accept-Encoding', ', '.join(compression.DECODINGS))])
+            return [dumps({'error': 'Unsupported Content-Encoding.'}).encode()]
+
+        # Compressed body is still limited by its Content-Length, decompressed one - by max_size
+        environ['wsgi.input'] = compression.DecodedStream(get_input_stream(environ), coding, max_size=self.max_size)
+        environ['wsgi.input_terminated'] = True
+        length = environ.pop('CONTENT_LENGTH', None)
+        if length and length.isdigit():
+            environ['xdb.raw_length'] = int(length)
+        del environ['HTTP_CONTENT_ENCODING']
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = DecompressMiddleware(app.wsgi_app, app.config['MAX_DECOMPRESSED_SIZE'])
+
+def upload_size():
+    # Decompressed body is at least as large as compressed one, so that is enough to pick conversion process
+    return request.content_length or request.environ.get('xdb.raw_length')
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 
 # DB connection setup
 user = UserModel('root', 'qwerty')
-driver = Driver(DB_NAME, 'organizations', user)
+if app.config['STORAGE_BACKEND'] == 'sqlite':
+    backend = SQLiteBackend(app.config['SQLITE_PATH'])
+elif app.config['STORAGE_BACKEND'] == 'memory':
+    backend = MemoryBackend()
+else:
+    backend = None
+driver = Driver(DB_NAME, 'organizations', user,
+                doc_id_block_size=app.config['DOC_ID_BLOCK_SIZE'],
+                auth_cache_size=app.config['AUTH_CACHE_SIZE'],
+                auth_cache_ttl=app.config['AUTH_CACHE_TTL'],
+                render_cache_size=app.config['RENDER_CACHE_SIZE'],
+                storage_format=app.config['STORAGE_FORMAT'],
+                max_doc_size=app.config['MAX_DOC_SIZE'],
+                max_doc_depth=app.config['MAX_DOC_DEPTH'],
+                stream_threshold=app.config['STREAM_THRESHOLD'],
+                conversion_workers=app.config['CONVERSION_WORKERS'],
+                conversion_threshold=app.config['CONVERSION_THRESHOLD'],
+                conversion_queue=app.config['CONVERSION_QUEUE'],
+                aggregate_cache_size=app.config['AGGREGATE_CACHE_SIZE'],
+                text_index=app.config['TEXT_INDEX'],
+                dedup=app.config['DEDUP'],
+                version_snapshot_interval=app.config['VERSION_SNAPSHOT_INTERVAL'],
+                backend=backend,
+                segments_path=app.config['SEGMENTS_PATH'],
+                segment_threshold=app.config['SEGMENT_THRESHOLD'],
+                segment_size=app.config['SEGMENT_SIZE'])
 driver.connect()
+if app.config['METRICS_DIR']:
+    metrics.REGISTRY.set_directory(app.config['METRICS_DIR'])
+
+REQUEST_SECONDS = metrics.Histogram('xdb_http_request_seconds', 'Time of requests handling (streamed bodies excluded).',
+                                    ['route', 'method', 'status'])
+REQUESTS_IN_FLIGHT = metrics.Gauge('xdb_http_requests_in_flight', 'Requests being handled.')
+if backend is not None:
+    # Embedded storage starts empty (MongoDB one is set up with db_init.py)
+    driver._init_users_storage()
 
 class FlaskUser(UserModel):
 
@@ -42,6 +187,104 @@ class FlaskUser(UserModel):
 def not_found(error):
     return make_response(dumps({'error': 'Not found'}), 404)
 
+@app.errorhandler(ServiceBusy)
+def service_busy(error):
+    resp = make_response(dumps({'error': str(error)}), 503)
+    resp.headers['Retry-After'] = '1'
+    return resp
+
+
+@app.errorhandler(IngestLimitError)
+def too_large(error):
+    return make_response(jsonify({'result': 0, 'error': str(error)}), 413)
+
+@app.errorhandler(SegmentsUnavailable)
+def segments_unavailable(error):
+    return make_response(jsonify({'result': 0, 'error': str(error)}), 500)
+
+@app.errorhandler(compression.DecodingError)
+def bad_coding(error):
+    return make_response(jsonify({'result': 0, 'error': str(error)}), 400)
+
+@app.before_request
+def request_started():
+    g.started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+@app.after_request
+def request_finished(resp):
+    # Route pattern, not path, so documents IDs don't make separate series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    if 'started' in g:
+        REQUEST_SECONDS.labels(route, request.method, str(resp.status_code)).observe(time.perf_counter() -
+                                                                                      g.started)
+    return resp
+
+@app.teardown_request
+def request_closed(error=None):
+    if 'started' in g:
+        REQUESTS_IN_FLIGHT.dec()
+    metrics.REGISTRY.maybe_flush()
+    # Request failed before its response was made
+    if g.get('profile') is not None and g.profile.elapsed is None:
+        finish_profile()
+
+def profile_requested():
+    # True if authorized header asks for profile, None if request is sampled for it
+    token = app.config['PROFILE_TOKEN']
+    header = request.headers.get('X-Profile')
+    if token and header and hmac.compare_digest(header.encode(), token.encode()):
+        return True
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        orgs = app.config['PROFILE_ORGS']
+        if not orgs or (request.view_args or {}).get('org_id') in orgs:
+            return None
+    return False
+
+@app.before_request
+def start_profile():
+    requested = profile_requested()
+    if requested is False:
+        return
+    mode = app.config['PROFILE_MODE']
+    if requested and request.headers.get('X-Profile-Mode') in profiling.MODES:
+        mode = request.headers['X-Profile-Mode']
+    g.profile = profiling.Profile(mode, app.config['PROFILE_INTERVAL'])
+    g.profile_reported = requested
+    g.profile.start()
+
+def finish_profile():
+    g.profile.stop()
+    org_id = (request.view_args or {}).get('org_id', 'none')
+    name = '{}-{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), org_id, uuid.uuid4().hex[:8])
+    g.profile.save(app.config['PROFILE_DIR'], name)
+    return name
+
+@app.after_request
+def report_profile(resp):
+    if g.get('profile') is not None:
+        name = finish_profile()
+        # Sampled requests of ordinary clients don't show internals
+        if g.profile_reported:
+            resp.headers['Server-Timing'] = g.profile.server_timing()
+            resp.headers['X-Profile-File'] = name
+    return resp
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Prometheus text format, all worker processes together
+    return Response(metrics.REGISTRY.exposition(), content_type=metrics.CONTENT_TYPE)
+
+def response_coding():
+    # Content coding of response preferred by client, None - send as is
+    return request.accept_encodings.best_match(compression.ENCODINGS)
+
+def set_coding(resp, coding):
+    if coding:
+        resp.headers['Content-Encoding'] = coding
+    resp.vary.add('Accept-Encoding')
+    return resp
 
 @login_manager.request_loader
 def login_basic_auth(request):
@@ -69,6 +312,21 @@ def home_page():
     user = current_user.get_id()
     return jsonify({'user': user})
 
+@app.route('/api/v1.0/stats/dedup', methods=['GET'])
+@login_required
+def dedup_stats():
+    # hits - documents which reused stored content, saved/stored - bytes, blobs - stored contents.
+    # ?org_id=... - counters of one organization, those of all organizations are for root user only
+    user = current_user.get_id()
+    org_id = request.args.get('org_id')
+    if org_id is None:
+        if not driver.user_is_root(user):
+            return make_response(jsonify({'result': 0, 'error': 'Stats of all organizations are for root only.'}),
+                                 403)
+    elif not driver.org_check_user(org_id, user):
+        abort(404)
+    return jsonify(driver.dedup_stats(org_id))
+
 @app.route('/api/v1.0/orgs/<string:org_id>', methods=['GET'])
 def get_org_info(org_id):
 
@@ -78,26 +336,177 @@ def get_org_info(org_id):
         abort(404)
     return make_response(jsonify(org))
 
+@app.route('/api/v1.0/orgs/<string:org_id>/key_rules', methods=['PUT'])
+@login_required
+def set_key_rules(org_id):
+    # Body: JSON list of {"name": "ref", "path": "//Ref"} rules
+    if not driver.org_check_user(org_id, current_user.get_id()):
+        abort(404)
+    rules = request.get_json(silent=True)
+    if not isinstance(rules, list):
+        return jsonify({'result': 0, 'error': 'No rules list received.'})
+    return jsonify(driver.org_set_key_rules(org_id, rules))
+
 @app.route('/api/v1.0/docs/<string:org_id>/<int:doc_id>', methods=['GET'])
 @login_required
 def get_doc(org_id, doc_id):
 
     user = current_user.get_id()
-    doc = driver.doc_find_one(user, org_id, doc_id)
+    # Metadata is enough to answer conditional request
+    doc = driver.doc_find_one(user, org_id, doc_id, with_data=False)
 
     if not doc:
         abort(404)
 
+    encoding = doc.get('encoding') or 'utf-8'
+    coding = response_coding()
+    # ?version=N - one of previous versions, rebuilt from history
+    version = request.args.get('version', type=int)
+    if version is not None and version != doc.get('version', 1):
+        etag = driver.doc_version_etag(org_id, doc, version, coding=coding)
+        if request.if_none_match.contains(etag):
+            resp = make_response('', 304)
+        else:
+            xml = driver.doc_render_version(user, org_id, doc_id, version, doc=doc)
+            if xml is None:
+                abort(404)
+            resp = make_response(compression.compress(xml, coding) if coding else xml)
+            resp.headers['Content-Type'] = 'text/xml; charset={}'.format(encoding)
+        resp.set_etag(etag)
+        return set_coding(resp, coding)
+
+    # Every content coding is separate representation with own ETag
+    etag = driver.doc_etag(org_id, doc, method='xml', coding=coding)
+    not_modified = request.if_none_match.contains(etag)
+    # Stored gzip payload kept in segment file is sent straight from it (sendfile if server supports it)
+    payload = driver.doc_payload_file(org_id, doc) if coding == 'gzip' and not not_modified else None
+
+    if not_modified:
+        resp = make_response('', 304)
+    elif payload is not None:
+        resp = Response(wrap_file(request.environ, payload), direct_passthrough=True,
+                        content_type='text/xml; charset={}'.format(encoding))
+        resp.content_length = payload.length
+    elif driver.doc_is_streamed(doc):
+        chunks = driver.doc_iter_one(user, org_id, doc_id, doc=doc, coding=coding)
+        if chunks is None:
+            abort(404)
+        resp = Response(chunks, content_type='text/xml; charset={}'.format(encoding))
+    else:
+        xml = driver.doc_render_one(user, org_id, doc_id, method='xml', doc=doc, coding=coding)
+        if xml is None:
+            abort(404)
+        resp = make_response(xml)
+        resp.headers['Content-Type'] = 'text/xml; charset={}'.format(encoding)
+
+    resp.set_etag(etag)
+    return set_coding(resp, coding)
+
+@app.route('/api/v1.0/docs/<string:org_id>', methods=['GET'])
+@login_required
+def list_docs(org_id):
+    # ?order_by=doc_id|last_modified&desc=1&limit=N&after=<"next" of previous page>
+    order_by = request.args.get('order_by', 'doc_id')
+    if order_by not in Driver.LIST_ORDERS:
+        return jsonify({'result': 0, 'error': 'order_by should be one of %s.' % ', '.join(Driver.LIST_ORDERS)})
+    limit = request.args.get('limit', app.config['LIST_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['LIST_PAGE_MAX']))
+    descending = request.args.get('desc', '0') not in ('0', 'false', '')
+
+    user = current_user.get_id()
+    result = driver.doc_list(user, org_id, order_by=order_by, after=request.args.get('after'),
+                             limit=limit, descending=descending)
+    if not result['result'] and 'error' not in result:
+        abort(404)
+    return make_response(dumps(result), 200, {'Content-Type': 'application/json'})
+
+def parse_doc_ids(value, max_count):
+    # "1,5,10-20" -> sorted list of IDs; raises ValueError if malformed or too long
+    doc_ids = set()
+    for item in value.split(','):
+        first, sep, last = item.strip().partition('-')
+        first = int(first)
+        last = int(last) if sep else first
+        if first < 1 or last < first or len(doc_ids) + last - first + 1 > max_count:
+            raise ValueError(item)
+        doc_ids.update(range(first, last + 1))
+    return sorted(doc_ids)
+
+@app.route('/api/v1.0/docs/<string:org_id>/batch', methods=['GET'])
+@login_required
+def get_docs(org_id):
+    # ?ids=1,5,10-20; documents are sent as parts of multipart/mixed response in doc_id order,
+    # the last part (application/json) lists IDs which were not found
     try:
-        encoding = doc['encoding']
-    except:
-        encoding = 'utf-8'
+        doc_ids = parse_doc_ids(request.args.get('ids', ''), app.config['BATCH_MAX_DOCS'])
+    except ValueError:
+        return jsonify({'result': 0, 'error': 'ids should be comma separated list of IDs or ID ranges, '
+                                              'no more than %d documents.' % app.config['BATCH_MAX_DOCS']})
 
-    xml = DocumentModel.json_to_xml(doc['data'], method='xml', encoding=encoding)
+    user = current_user.get_id()
+    docs = driver.doc_iter_many(user, org_id, doc_ids)
+    if docs is None:
+        abort(404)
 
-    resp = make_response(xml)
-    resp.headers['Content-Type'] = 'text/xml; charset={}'.format(doc['encoding'])
-    return resp
+    def parts():
+        found = set()
+        for doc, chunks in docs:
+            found.add(doc['doc_id'])
+            yield [('Content-Type', 'text/xml; charset={}'.format(doc.get('encoding') or 'utf-8')),
+                   ('Content-ID', '<{}>'.format(doc['doc_id'])),
+                   ('ETag', '"{}"'.format(driver.doc_etag(org_id, doc)))], chunks
+        missing = [doc_id for doc_id in doc_ids if doc_id not in found]
+        yield [('Content-Type', 'application/json')], [dumps({'missing': missing}).encode()]
+
+    boundary = uuid.uuid4().hex
+    coding = response_coding()
+    body = iter_multipart(parts(), boundary)
+    resp = Response(compression.iter_compress(body, coding) if coding else body,
+                    content_type='multipart/mixed; boundary={}'.format(boundary))
+    return set_coding(resp, coding)
+
+@app.route('/api/v1.0/docs/<string:org_id>/aggregate', methods=['GET'])
+@login_required
+def aggregate_docs(org_id):
+    # ?path=Message/Body/DocumentObject.ПоступлениеТоваров/Товары/Row/Сумма&aggregate=sum&group_by=Номенклатура
+    path = request.args.get('path')
+    if not path:
+        return jsonify({'result': 0, 'error': 'No path given.'})
+
+    user = current_user.get_id()
+    result = driver.doc_aggregate(user, org_id, path, aggregate=request.args.get('aggregate', 'sum'),
+                                  group_by=request.args.get('group_by'))
+    if not result['result'] and 'error' not in result:
+        abort(404)
+    return jsonify(result)
+
+@app.route('/api/v1.0/docs/<string:org_id>/search', methods=['GET'])
+@login_required
+def search_docs(org_id):
+    # ?q=Роздріб "ціна закупки" OR Description&limit=N
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', app.config['LIST_PAGE_SIZE'], type=int),
+                       app.config['LIST_PAGE_MAX']))
+
+    user = current_user.get_id()
+    result = driver.doc_search(user, org_id, query, limit=limit)
+    if not result['result'] and 'error' not in result:
+        abort(404)
+    return jsonify(result)
+
+@app.route('/api/v1.0/docs/<string:org_id>/lookup', methods=['GET'])
+@login_required
+def lookup_docs(org_id):
+    # ?name=ref&value=<GUID> - IDs of documents with business key of this value
+    name, value = request.args.get('name'), request.args.get('value')
+    if not name or value is None:
+        return jsonify({'result': 0, 'error': 'Both name and value should be given.'})
+
+    user = current_user.get_id()
+    result = driver.doc_lookup(user, org_id, name, value)
+    if not result['result']:
+        abort(404)
+    return jsonify(result)
 
 @app.route('/api/v1.0/docs/<string:org_id>', methods=['POST'])
 @login_required
@@ -105,14 +514,44 @@ def add_doc(org_id):
     result = {'result': 0}
     if request.content_type == 'application/xml':
         if request.accept_charsets:
-            raw_data = request.data
-            data = raw_data.decode(request.headers['Accept-Charset'])
+            charset = request.headers['Accept-Charset']
             user = current_user.get_id()
-            result = driver.doc_create_one(user, org_id, data)
+            # Body is parsed while being read, never held in memory as a whole
+            result = driver.doc_create_stream(user, org_id, request.stream, encoding=charset, size=upload_size())
     else:
         result = {'result': 0, 'error': 'No XML data received.'}
     return jsonify(result)
 
+@app.route('/api/v1.0/docs/<string:org_id>/<int:doc_id>', methods=['PUT'])
+@login_required
+def update_doc(org_id, doc_id):
+    # Replaces document content, previous content stays available as ?version=N
+    if request.content_type != 'application/xml':
+        return jsonify({'result': 0, 'error': 'No XML data received.'})
+    charset = request.headers.get('Accept-Charset', 'utf-8')
+    user = current_user.get_id()
+    result = driver.doc_update_stream(user, org_id, doc_id, request.stream, encoding=charset, size=upload_size())
+    if result.get('conflict'):
+        return make_response(jsonify(result), 409)
+    return jsonify(result)
+
+@app.route('/api/v1.0/docs/<string:org_id>/bulk', methods=['POST'])
+@login_required
+def add_docs(org_id):
+    # Documents come either as files of multipart form or as tar archive (gzip/bz2 compression allowed)
+    if request.mimetype == 'multipart/form-data':
+        items = ((upload.filename or field, upload.stream) for field, upload in request.files.items(multi=True))
+    elif request.mimetype in ('application/x-tar', 'application/gzip', 'application/x-gzip'):
+        items = iter_tar(request.stream)
+    else:
+        return jsonify({'result': 0, 'error': 'No multipart or tar data received.'})
+
+    charset = request.headers.get('Accept-Charset', 'utf-8')
+    user = current_user.get_id()
+    result = driver.doc_create_batch(user, org_id, items, encoding=charset,
+                                     chunk_size=app.config['BULK_CHUNK_SIZE'])
+    return jsonify(result)
+
 @app.route('/api/v1.0/docs/<string:org_id>/<int:doc_id>', methods=['DELETE'])
 @login_required
 def delete_doc(org_id, doc_id):
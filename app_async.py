@@ -0,0 +1,221 @@
+'''
+Asyncio variant of app.py served by aiohttp: database calls don't hold a thread per request,
+so slow clients and large documents don't block other requests.
+Run: python app_async.py (needs aiohttp and motor)
+'''
+import asyncio
+import base64
+import binascii
+from bson.json_util import dumps
+from aiohttp import web
+from xdb_controller.controller import UserModel, IngestLimitError
+from xdb_controller.aio import AsyncDriver
+from xdb_controller.segments import SegmentsUnavailable
+
+DB_NAME = 'XML_SRV_TEST'
+# Same meaning as in app.py
+CONFIG = {
+    'DOC_ID_BLOCK_SIZE': 1,
+    'AUTH_CACHE_SIZE': 4096,
+    'AUTH_CACHE_TTL': 300,
+    'RENDER_CACHE_SIZE': 64 * 1024 * 1024,
+    'STORAGE_FORMAT': 'json',
+    'MAX_DOC_SIZE': 256 * 1024 * 1024,
+    'MAX_DOC_DEPTH': 256,
+    'STREAM_THRESHOLD': 1024 * 1024,
+    # Documents this large (bytes) are parsed/rendered in executor threads, not in event loop
+    'CONVERSION_THRESHOLD': 256 * 1024,
+    'TEXT_INDEX': False,
+    'DEDUP': False,
+    'VERSION_SNAPSHOT_INTERVAL': 10,
+    'AGGREGATE_CACHE_SIZE': 65536,
+    'SEGMENTS_PATH': None,
+}
+
+
+def json_response(data, status=200):
+    return web.Response(text=dumps(data), status=status, content_type='application/json')
+
+
+def basic_auth(request):
+    api_key = request.headers.get('Authorization')
+    if not api_key:
+        return None
+    api_key = api_key.replace('Basic ', '', 1)
+    try:
+        login, password = base64.b64decode(api_key).decode('utf-8').split(':')
+        return UserModel(login, password)
+    except (ValueError, TypeError, AssertionError, binascii.Error):
+        return None
+
+
+async def authorize(request, org_id):
+    # Returns error response or None if user is allowed to access organization documents
+    user = basic_auth(request)
+    if user is None:
+        return json_response({'error': 'Unauthorized'}, 401)
+    valid, member = await request.app['driver'].authorize(user, org_id)
+    if not valid:
+        return json_response({'error': 'Unauthorized'}, 401)
+    if not member:
+        return json_response({'error': 'Not found'}, 404)
+    return None
+
+
+async def get_org_info(request):
+    org = await request.app['driver'].org_get_info(request.match_info['org_id'])
+    if not org:
+        return json_response({'error': 'Not found'}, 404)
+    return json_response(org)
+
+
+async def get_doc(request):
+    driver = request.app['driver']
+    org_id, doc_id = request.match_info['org_id'], int(request.match_info['doc_id'])
+
+    # Credentials check and metadata fetch are independent, so both go at once
+    denied, doc = await asyncio.gather(authorize(request, org_id),
+                                       driver.doc_find_one(org_id, doc_id, with_data=False))
+    if denied:
+        return denied
+    if not doc:
+        return json_response({'error': 'Not found'}, 404)
+
+    encoding = doc.get('encoding') or 'utf-8'
+    etag = driver.doc_etag(org_id, doc, method='xml')
+    headers = {'ETag': '"{}"'.format(etag)}
+
+    if etag in (tag.value for tag in request.if_none_match or ()):
+        return web.Response(status=304, headers=headers)
+
+    if driver.doc_is_streamed(doc):
+        chunks = await driver.doc_iter_one(org_id, doc)
+        if chunks is None:
+            return json_response({'error': 'Not found'}, 404)
+        resp = web.StreamResponse(headers=headers)
+        resp.content_type = 'text/xml'
+        resp.charset = encoding
+        resp.enable_chunked_encoding()
+        await resp.prepare(request)
+        async for chunk in chunks:
+            await resp.write(chunk)
+        await resp.write_eof()
+        return resp
+
+    xml = await driver.doc_render_one(org_id, doc, method='xml')
+    if xml is None:
+        return json_response({'error': 'Not found'}, 404)
+    return web.Response(body=xml, headers=headers, content_type='text/xml', charset=encoding)
+
+
+async def add_doc(request):
+    org_id = request.match_info['org_id']
+    denied = await authorize(request, org_id)
+    if denied:
+        return denied
+
+    if request.content_type != 'application/xml':
+        return json_response({'result': 0, 'error': 'No XML data received.'})
+    charset = request.headers.get('Accept-Charset')
+    if not charset:
+        return json_response({'result': 0})
+
+    # Body is parsed while being read, never held in memory as a whole
+    try:
+        result = await request.app['driver'].doc_create_stream(org_id, request.content, encoding=charset,
+                                                                size=request.content_length)
+    except IngestLimitError as err:
+        return json_response({'result': 0, 'error': str(err)}, 413)
+    return json_response(result)
+
+
+async def update_doc(request):
+    # Replaces document content, previous content is kept in history
+    org_id, doc_id = request.match_info['org_id'], int(request.match_info['doc_id'])
+    denied = await authorize(request, org_id)
+    if denied:
+        return denied
+
+    if request.content_type != 'application/xml':
+        return json_response({'result': 0, 'error': 'No XML data received.'})
+    charset = request.headers.get('Accept-Charset', 'utf-8')
+    try:
+        result = await request.app['driver'].doc_update_stream(org_id, doc_id, request.content, encoding=charset,
+                                                                size=request.content_length)
+    except IngestLimitError as err:
+        return json_response({'result': 0, 'error': str(err)}, 413)
+    if result.get('conflict'):
+        return json_response(result, 409)
+    return json_response(result)
+
+
+async def aggregate_docs(request):
+    # Same query arguments as in app.py
+    org_id = request.match_info['org_id']
+    denied = await authorize(request, org_id)
+    if denied:
+        return denied
+
+    path = request.query.get('path')
+    if not path:
+        return json_response({'result': 0, 'error': 'No path given.'})
+    result = await request.app['driver'].doc_aggregate(org_id, path, aggregate=request.query.get('aggregate', 'sum'),
+                                                       group_by=request.query.get('group_by'))
+    return json_response(result)
+
+
+async def delete_doc(request):
+    org_id, doc_id = request.match_info['org_id'], int(request.match_info['doc_id'])
+    denied = await authorize(request, org_id)
+    if denied:
+        return denied
+
+    result = await request.app['driver'].doc_remove_one(org_id, doc_id)
+    if result['result']:
+        return json_response(result)
+    return json_response({'result': 0, 'error': 'No document with ID %s found.' % doc_id})
+
+
+@web.middleware
+async def segments_error(request, handler):
+    # Payload kept in segment files can't be read without them
+    try:
+        return await handler(request)
+    except SegmentsUnavailable as err:
+        return json_response({'result': 0, 'error': str(err)}, 500)
+
+
+def make_app(driver):
+    app = web.Application(client_max_size=CONFIG['MAX_DOC_SIZE'], middlewares=[segments_error])
+    app['driver'] = driver
+
+    async def init_driver(app):
+        await app['driver'].init()
+    app.on_startup.append(init_driver)
+
+    app.router.add_get('/api/v1.0/orgs/{org_id}', get_org_info)
+    app.router.add_get(r'/api/v1.0/docs/{org_id}/{doc_id:\d+}', get_doc)
+    app.router.add_put(r'/api/v1.0/docs/{org_id}/{doc_id:\d+}', update_doc)
+    app.router.add_delete(r'/api/v1.0/docs/{org_id}/{doc_id:\d+}', delete_doc)
+    app.router.add_get('/api/v1.0/docs/{org_id}/aggregate', aggregate_docs)
+    app.router.add_post('/api/v1.0/docs/{org_id}', add_doc)
+    return app
+
+
+if __name__ == '__main__':
+    driver = AsyncDriver.connect_motor(DB_NAME,
+                                       doc_id_block_size=CONFIG['DOC_ID_BLOCK_SIZE'],
+                                       auth_cache_size=CONFIG['AUTH_CACHE_SIZE'],
+                                       auth_cache_ttl=CONFIG['AUTH_CACHE_TTL'],
+                                       render_cache_size=CONFIG['RENDER_CACHE_SIZE'],
+                                       storage_format=CONFIG['STORAGE_FORMAT'],
+                                       max_doc_size=CONFIG['MAX_DOC_SIZE'],
+                                       max_doc_depth=CONFIG['MAX_DOC_DEPTH'],
+                                       stream_threshold=CONFIG['STREAM_THRESHOLD'],
+                                       conversion_threshold=CONFIG['CONVERSION_THRESHOLD'],
+                                       text_index=CONFIG['TEXT_INDEX'],
+                                       dedup=CONFIG['DEDUP'],
+                                       version_snapshot_interval=CONFIG['VERSION_SNAPSHOT_INTERVAL'],
+                                       aggregate_cache_size=CONFIG['AGGREGATE_CACHE_SIZE'],
+                                       segments_path=CONFIG['SEGMENTS_PATH'])
+    web.run_app(make_app(driver), port=5000)
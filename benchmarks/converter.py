@@ -0,0 +1,82 @@
+'''
+Round-trip check and speed comparison of xdb_controller.converter against xmljson badgerfish.
+
+Usage: python -m benchmarks.converter [--copies N] [--repeat N]
+Requires lxml and xmljson.
+'''
+import argparse
+import os
+import timeit
+from copy import deepcopy
+
+from lxml import etree
+from xmljson import badgerfish as bf
+
+from xdb_controller import converter
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test4.xml')
+
+
+def load_sample(copies=1):
+    # Body of the sample message repeated "copies" times
+    with open(SAMPLE, 'rb') as file:
+        root = etree.fromstring(file.read())
+    body = root[1]
+    objects = list(body)
+    for _ in range(copies - 1):
+        for element in objects:
+            body.append(deepcopy(element))
+    return root
+
+
+def canonical(root):
+    # Formatting whitespace is not a part of document content
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.tostring(etree.fromstring(etree.tostring(root, encoding='utf-8'), parser), method='c14n')
+
+
+def check_round_trip(root):
+    restored = converter.etree(converter.data(root))
+    assert canonical(restored) == canonical(root), 'document changed after round trip'
+
+    # Prefixes are kept as well
+    original_tags = [element.tag for element in root.iter()]
+    restored_tags = [element.tag for element in restored.iter()]
+    assert original_tags == restored_tags
+    assert root.nsmap == restored.nsmap
+
+
+def xmljson_etree(tree):
+    # The way xmljson trees were turned back to XML: root built by hand, the rest by bf.etree
+    root_name, body = next(iter(tree.items()))
+    return bf.etree(body, root=etree.Element(root_name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--copies', type=int, default=200, help='sample body repetitions')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions (best is taken)')
+    options = parser.parse_args()
+
+    check_round_trip(load_sample())
+    print('Round trip of {}: OK'.format(os.path.basename(SAMPLE)))
+
+    root = load_sample(options.copies)
+    size = len(etree.tostring(root, encoding='utf-8'))
+    print('Document: {} elements, {} bytes'.format(sum(1 for _ in root.iter()), size))
+
+    bf_tree = bf.data(root)
+    tree = converter.data(root)
+    cases = [
+        ('XML -> badgerfish', lambda: bf.data(root), lambda: converter.data(root)),
+        ('badgerfish -> XML', lambda: xmljson_etree(bf_tree), lambda: converter.etree(tree)),
+    ]
+    for title, old, new in cases:
+        old_time = min(timeit.repeat(old, number=1, repeat=options.repeat))
+        new_time = min(timeit.repeat(new, number=1, repeat=options.repeat))
+        print('{:<20} xmljson {:8.2f} ms   converter {:8.2f} ms   x{:.1f}'.format(
+            title, old_time * 1000, new_time * 1000, old_time / new_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+'''
+Synthetic 1C exchange messages built from test4.xml.
+
+Body objects of the sample are repeated (with fresh UUIDs, numbers and codes) until message reaches
+asked size. Table parts (Товары rows, register Records) get `rows` rows each, every row can carry
+extra nesting `depth` levels deep. Same arguments and seed give the same bytes.
+
+Usage: python -m benchmarks.messages 32M --rows 50 --depth 4 -o message.xml
+'''
+import argparse
+import copy
+from io import BytesIO
+import os
+import random
+import re
+import sys
+import uuid
+import xml.etree.ElementTree as ET
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test4.xml')
+BODY_START = b'<v8msg:Body>'
+BODY_END = b'</v8msg:Body>'
+# Children of these elements are table part rows
+TABLES = {'Товары': 'Row', 'Records': 'Record'}
+UUID = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+EMPTY_UUID = '00000000-0000-0000-0000-000000000000'
+SIZE = re.compile(r'^(\d+)([KMG]?)B?$', re.IGNORECASE)
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    # "64K", "32M", "1G" or number of bytes
+    found = SIZE.match(text.strip())
+    if not found:
+        raise ValueError('Bad size "%s"' % text)
+    return int(found.group(1)) * UNITS[found.group(2).upper()]
+
+
+def load_sample():
+    # (message start up to Body, Body objects, message end)
+    with open(SAMPLE, 'rb') as file:
+        data = file.read()
+    head = data[:data.index(BODY_START) + len(BODY_START)] + b'\n'
+    tail = b'  ' + data[data.index(BODY_END):]
+    objects = list(ET.fromstring(data)[1])
+    return head, objects, tail
+
+
+def _randomize(element, rng):
+    # New values of the same kind: UUIDs, numbers, codes
+    for item in element.iter():
+        text = (item.text or '').strip()
+        if not text or len(item):
+            continue
+        if UUID.match(text) and text != EMPTY_UUID:
+            item.text = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        elif text.isdigit():
+            item.text = str(rng.randint(1, 10 ** min(len(text), 9) - 1)).zfill(len(text) if text[0] == '0' else 0)
+
+
+def _nested(depth, rng):
+    # Additional properties of row nested depth levels deep
+    root = element = ET.Element('ДополнительныеРеквизиты')
+    for level in range(depth):
+        element = ET.SubElement(element, 'Row')
+        ET.SubElement(element, 'Свойство').text = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        ET.SubElement(element, 'Значение').text = str(rng.randint(1, 10 ** 6))
+    return root
+
+
+def build_object(template, rows, depth, rng):
+    element = copy.deepcopy(template)
+    for table in element.iter():
+        row_tag = TABLES.get(table.tag)
+        if row_tag is None:
+            continue
+        samples = [row for row in table if row.tag == row_tag]
+        if not samples:
+            continue
+        for row in samples:
+            table.remove(row)
+        for index in range(rows):
+            row = copy.deepcopy(samples[index % len(samples)])
+            if depth:
+                row.append(_nested(depth, rng))
+            table.append(row)
+    _randomize(element, rng)
+    return element
+
+
+def write_message(file, size, rows=2, depth=0, seed=0):
+    '''
+    Writes message of at least size bytes into binary file, returns bytes written
+    '''
+    rng = random.Random(seed)
+    head, objects, tail = load_sample()
+    written = file.write(head)
+    index = 0
+    while written + len(tail) < size or index == 0:
+        element = build_object(objects[index % len(objects)], rows, depth, rng)
+        ET.indent(element, space='  ', level=2)
+        written += file.write(b'    ' + ET.tostring(element, encoding='utf-8', xml_declaration=False) + b'\n')
+        index += 1
+    written += file.write(tail)
+    return written
+
+
+def message(size, rows=2, depth=0, seed=0):
+    output = BytesIO()
+    write_message(output, size, rows, depth, seed)
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('size', help='message size, e.g. 64K, 32M')
+    parser.add_argument('--rows', type=int, default=2, help='rows of every table part')
+    parser.add_argument('--depth', type=int, default=0, help='extra nesting levels of table rows')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='file to write (stdout by default)')
+    options = parser.parse_args()
+
+    if options.output:
+        with open(options.output, 'wb') as file:
+            write_message(file, parse_size(options.size), options.rows, options.depth, options.seed)
+    else:
+        write_message(sys.stdout.buffer, parse_size(options.size), options.rows, options.depth, options.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+'''
+Benchmark suite: converter, Driver methods and HTTP routes on synthetic 1C messages.
+
+Every (group, message size) case runs in a fresh process, so peak RSS belongs to that case alone.
+Driver and HTTP groups use embedded storage backend (memory or sqlite), no MongoDB is needed.
+Results (throughput, p50/p99 latency, peak RSS) are saved as JSON; --baseline compares them
+with earlier run and exits with status 1 if some case got slower than --tolerance allows.
+
+Usage: python -m benchmarks.suite [--sizes 16K,1M,16M] [--groups converter,driver,http]
+                                  [--rows 20] [--depth 2] [-o results.json] [--baseline old.json]
+'''
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from .messages import parse_size, write_message
+
+GROUPS = ('converter', 'driver', 'http')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, share):
+    # Nearest rank of sorted values
+    return values[max(0, math.ceil(share * len(values)) - 1)]
+
+
+def peak_rss():
+    # Bytes; Linux reports kilobytes, macOS bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Timer:
+    '''
+    Runs function at least min_runs and at most max_runs times, stopping after budget seconds
+    '''
+
+    def __init__(self, min_runs=3, max_runs=50, budget=5.0):
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.budget = budget
+
+    def run(self, func, max_runs=None):
+        # max_runs - lower limit for this function only, e.g. number of documents to remove
+        max_runs = min(self.max_runs, max_runs or self.max_runs)
+        times = []
+        started = time.perf_counter()
+        while len(times) < max_runs and (len(times) < self.min_runs or time.perf_counter() - started < self.budget):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return times
+
+
+def summary(case, times, size):
+    times = sorted(times)
+    total = sum(times)
+    return {'case': case,
+            'runs': len(times),
+            'p50_ms': percentile(times, .5) * 1000,
+            'p99_ms': percentile(times, .99) * 1000,
+            'mean_ms': total / len(times) * 1000,
+            'ops_s': len(times) / total if total else None,
+            'mb_s': size * len(times) / total / 1024 ** 2 if total else None}
+
+
+def bench_converter(data, timer):
+    from xdb_controller.controller import DocumentModel
+
+    stored = DocumentModel.xml_to_json(data)
+    return [summary('xml_to_json', timer.run(lambda: DocumentModel.xml_to_json(data)), len(data)),
+            summary('json_to_xml', timer.run(lambda: DocumentModel.json_to_xml(stored)), len(data))]
+
+
+def bench_driver(data, timer, options):
+    from xdb_controller.controller import Driver, UserModel
+    from xdb_controller.backends import MemoryBackend, SQLiteBackend
+
+    root = UserModel('root', 'qwerty')
+    if options.backend == 'sqlite':
+        backend = SQLiteBackend(tempfile.mkdtemp(prefix='xdb-bench-'))
+    else:
+        backend = MemoryBackend()
+    driver = Driver('XDB_BENCH', 'organizations', root, backend=backend, storage_format=options.storage_format,
+                    text_index=options.text_index, dedup=options.dedup, stream_threshold=None)
+    driver.connect()
+    driver._init_users_storage()
+    org_id = driver.org_create_one('Bench')['Bench']
+    user = str(root)
+
+    doc_ids = []
+
+    def create():
+        doc_ids.append(driver.doc_create_stream(user, org_id, BytesIO(data), size=len(data))['doc_id'])
+
+    def render():
+        # Rendered document cache would turn it into a lookup
+        driver.render_cache.clear()
+        driver.doc_render_one(user, org_id, doc_ids[0])
+
+    def iterate():
+        for chunk in driver.doc_iter_one(user, org_id, doc_ids[0]):
+            pass
+
+    results = [summary('doc_create_stream', timer.run(create), len(data)),
+               summary('doc_find_one', timer.run(lambda: driver.doc_find_one(user, org_id, doc_ids[0])), len(data)),
+               summary('doc_render_one', timer.run(render), len(data)),
+               summary('doc_iter_one', timer.run(iterate), len(data))]
+
+    removed = iter(doc_ids)
+    results.append(summary('doc_remove_one', timer.run(lambda: driver.doc_remove_one(org_id, next(removed)),
+                                                       len(doc_ids)), len(data)))
+    return results
+
+
+def bench_http(data, timer, options):
+    import base64
+
+    # App reads overriding settings when imported
+    fd, settings = tempfile.mkstemp(suffix='.py')
+    with os.fdopen(fd, 'w') as file:
+        file.write('STORAGE_BACKEND = %r\n' % options.backend)
+        file.write('SQLITE_PATH = %r\n' % tempfile.mkdtemp(prefix='xdb-bench-'))
+        file.write('STORAGE_FORMAT = %r\n' % options.storage_format)
+        file.write('MAX_DOC_SIZE = %d\n' % max(len(data) * 2, 256 * 1024 * 1024))
+    os.environ['XDB_SETTINGS'] = settings
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app as server
+
+    org_id = server.driver.org_create_one('Bench')['Bench']
+    client = server.app.test_client()
+    auth = {'Authorization': 'Basic ' + base64.b64encode(b'root:qwerty').decode()}
+    url = '/api/v1.0/docs/' + org_id
+    doc_ids = []
+
+    def check(resp):
+        assert resp.status_code == 200, resp.status_code
+        return resp
+
+    def post():
+        headers = dict(auth, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+        resp = check(client.post(url, data=data, headers=headers))
+        doc_ids.append(resp.get_json()['doc_id'])
+
+    def get(coding=None, cached=False):
+        # Cold case renders the document, cached one is served from the rendered document cache
+        if not cached:
+            server.driver.render_cache.clear()
+        headers = dict(auth, **{'Accept-Encoding': coding or 'identity'})
+        resp = check(client.get('%s/%d' % (url, doc_ids[0]), headers=headers))
+        # Streamed response body is produced while read
+        return resp.get_data()
+
+    results = [summary('POST /docs/<org_id>', timer.run(post), len(data)),
+               summary('GET /docs/<org_id>/<doc_id>', timer.run(get), len(data)),
+               summary('GET /docs/<org_id>/<doc_id> gzip', timer.run(lambda: get('gzip')), len(data))]
+    # Untimed request fills the cache
+    get()
+    results.append(summary('GET /docs/<org_id>/<doc_id> cached', timer.run(lambda: get(cached=True)), len(data)))
+    removed = iter(doc_ids)
+    results.append(summary('DELETE /docs/<org_id>/<doc_id>',
+                           timer.run(lambda: check(client.delete('%s/%d' % (url, next(removed)), headers=auth)),
+                                     len(doc_ids)), len(data)))
+    os.remove(settings)
+    return results
+
+
+def run_case(group, path, options):
+    # Runs in its own process
+    with open(path, 'rb') as file:
+        data = file.read()
+    timer = Timer(options.min_runs, options.max_runs, options.budget)
+    if group == 'converter':
+        results = bench_converter(data, timer)
+    elif group == 'driver':
+        results = bench_driver(data, timer, options)
+    else:
+        results = bench_http(data, timer, options)
+    return results, peak_rss()
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpus': os.cpu_count(),
+            'commit': commit}
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Prints changes against baseline results, returns number of regressions
+    '''
+    before = {(item['group'], item['size'], item['case']): item for item in baseline['results']}
+    regressions = 0
+    for item in results:
+        old = before.get((item['group'], item['size'], item['case']))
+        if old is None:
+            continue
+        change = item['p50_ms'] / old['p50_ms'] - 1 if old['p50_ms'] else 0
+        slower = change > tolerance
+        regressions += slower
+        print('{:<10} {:>6} {:<36} p50 {:9.2f} -> {:9.2f} ms {:+7.1%}{}'.format(
+            item['group'], item['size'], item['case'], old['p50_ms'], item['p50_ms'], change,
+            '  REGRESSION' if slower else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default='16K,256K,4M', help='comma separated message sizes, up to hundreds of MB')
+    parser.add_argument('--groups', default=','.join(GROUPS), help='comma separated: %s' % ', '.join(GROUPS))
+    parser.add_argument('--rows', type=int, default=20, help='rows of every table part')
+    parser.add_argument('--depth', type=int, default=2, help='extra nesting levels of table rows')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory',
+                        help='storage of driver and http groups')
+    parser.add_argument('--storage-format', choices=['json', 'bson', 'raw'], default='json')
+    parser.add_argument('--text-index', action='store_true')
+    parser.add_argument('--dedup', action='store_true')
+    parser.add_argument('--min-runs', type=int, default=3)
+    parser.add_argument('--max-runs', type=int, default=50)
+    parser.add_argument('--budget', type=float, default=5.0, help='seconds per measured operation')
+    parser.add_argument('-o', '--output', default='benchmark-%s.json' % datetime.now().strftime('%Y%m%d-%H%M%S'))
+    parser.add_argument('--baseline', help='results of earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed p50 slowdown share')
+    options = parser.parse_args()
+
+    groups = [group.strip() for group in options.groups.split(',') if group.strip()]
+    for group in groups:
+        if group not in GROUPS:
+            parser.error('Unknown group "%s"' % group)
+
+    output = {'started': datetime.now().isoformat(timespec='seconds'),
+              'environment': environment(),
+              'options': vars(options),
+              'results': []}
+    directory = tempfile.mkdtemp(prefix='xdb-bench-')
+    # Fresh interpreter per case: nothing is inherited, peak RSS is the case's own
+    context = multiprocessing.get_context('spawn')
+    for label in options.sizes.split(','):
+        path = os.path.join(directory, '%s.xml' % label)
+        with open(path, 'wb') as file:
+            size = write_message(file, parse_size(label), options.rows, options.depth, options.seed)
+        print('Message {}: {} bytes'.format(label, size))
+
+        for group in groups:
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                results, rss = executor.submit(run_case, group, path, options).result()
+            for item in results:
+                item.update(group=group, size=label, bytes=size, rows=options.rows, depth=options.depth,
+                            peak_rss_mb=rss / 1024 ** 2)
+                output['results'].append(item)
+                print('  {:<10} {:<36} {:4d} runs  p50 {:9.2f} ms  p99 {:9.2f} ms  {:8.2f} MB/s  '
+                      'RSS {:7.1f} MB'.format(group, item['case'], item['runs'], item['p50_ms'], item['p99_ms'],
+                                              item['mb_s'] or 0, item['peak_rss_mb']))
+        os.remove(path)
+    os.rmdir(directory)
+
+    with open(options.output, 'w') as file:
+        json.dump(output, file, indent=2)
+    print('Results saved to {}'.format(options.output))
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            regressions = compare(output['results'], json.load(file), options.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
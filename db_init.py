@@ -1,7 +1,7 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING
 from hashlib import sha256
 from datetime import datetime
-from xmljson import badgerfish as bf
+from xdb_controller import converter
 from bson.json_util import dumps
 from xml.etree.ElementTree import fromstring
 
@@ -15,6 +15,7 @@ if __name__ == '__main__':
     db = get_db()
     users_col = db['users']
     organizations = db['organizations']
+    documents = db['documents']
 
     # User collection initialization
     login = 'root'
@@ -38,17 +39,16 @@ if __name__ == '__main__':
         xml_data = file.read()
 
     # First test doc
-    json_data = dumps(bf.data(fromstring(xml_data)))
+    json_data = dumps(converter.data(fromstring(xml_data)))
     document = {
+        'org_id': org_id,
         'doc_id': 1,
         'last_modified': datetime.now(),
         'data': json_data
     }
 
-    result = organizations.update_one({'org_id': org_id}, {
-        '$push': {
-                "docs" : document
-        }
-    })
+    documents.create_index([('org_id', ASCENDING), ('doc_id', ASCENDING)], unique=True)
+    documents.insert_one(document)
+    result = organizations.update_one({'org_id': org_id}, {'$inc': {'doc_count': 1}})
 
     print('DB init done.')
\ No newline at end of file
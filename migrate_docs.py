@@ -0,0 +1,52 @@
+import argparse
+from xdb_controller.controller import Driver, UserModel
+
+DB_NAME = 'XML_SRV_TEST'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move documents embedded into organizations '
+                                                 'into separate documents collection.')
+    parser.add_argument('--db', default=DB_NAME, help='database name')
+    parser.add_argument('--batch-size', type=int, default=500, help='documents moved per one round')
+    parser.add_argument('--storage-format', choices=['json', 'bson'],
+                        help='also rewrite stored documents into given storage format')
+    parser.add_argument('--materialize', action='store_true',
+                        help='build structure of documents stored in raw format')
+    parser.add_argument('--extract-keys', action='store_true',
+                        help='rebuild business keys of organizations having extraction rules')
+    parser.add_argument('--index-text', action='store_true', help='rebuild full-text index of all documents')
+    parser.add_argument('--segments-path', help='directory of segment files with large raw payloads')
+    parser.add_argument('--compact-segments', action='store_true',
+                        help='reclaim space of removed payloads in segment files (needs --segments-path)')
+    options = parser.parse_args()
+
+    driver = Driver(options.db, 'organizations', UserModel('root', 'qwerty'), segments_path=options.segments_path)
+    driver.connect()
+
+    result = driver.docs_migrate(batch_size=options.batch_size)
+    print('Migration done. Documents moved: {}'.format(result['moved']))
+
+    if options.storage_format:
+        result = driver.docs_convert_format(options.storage_format, batch_size=options.batch_size)
+        print('Conversion done. Documents converted: {}'.format(result['converted']))
+
+    if options.materialize:
+        result = driver.docs_materialize(batch_size=options.batch_size)
+        print('Materialization done. Documents processed: {}'.format(result['materialized']))
+
+    if options.extract_keys:
+        result = driver.docs_extract_keys(batch_size=options.batch_size)
+        print('Keys extraction done. Documents processed: {}'.format(result['processed']))
+
+    if options.index_text:
+        result = driver.docs_index_text(batch_size=options.batch_size)
+        print('Text indexing done. Documents processed: {}'.format(result['processed']))
+
+    if options.compact_segments:
+        result = driver.segments_compact()
+        if result['result']:
+            print('Compaction done. Segments compacted: {}, payloads moved: {}, bytes reclaimed: {}'.format(
+                result['segments'], result['moved'], result['reclaimed']))
+        else:
+            print(result['error'])
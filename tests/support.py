@@ -0,0 +1,55 @@
+'''
+Driver and app set up on embedded in-memory storage, no MongoDB is needed
+'''
+import base64
+import os
+import sys
+import tempfile
+
+from xdb_controller.controller import Driver, UserModel
+from xdb_controller.backends import MemoryBackend
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(ROOT, 'test4.xml')
+AUTH = {'Authorization': 'Basic ' + base64.b64encode(b'root:qwerty').decode()}
+
+
+def sample():
+    with open(SAMPLE, 'rb') as file:
+        return file.read()
+
+
+def make_driver(**kwargs):
+    '''
+    Returns connected Driver with empty storage, root user and organization, and its ID
+    '''
+    root = UserModel('root', 'qwerty')
+    kwargs.setdefault('backend', MemoryBackend())
+    driver = Driver('XDB_TEST', 'organizations', root, **kwargs)
+    driver.connect()
+    driver._init_users_storage()
+    return driver, create_org(driver, 'Test')
+
+
+def create_org(driver, name):
+    # Fresh users list, default one is shared by all OrganizationModel instances
+    return driver.org_create_one(name, users=[])[name]
+
+
+def load_app():
+    '''
+    Imports app.py (once per process) configured for embedded in-memory storage
+    '''
+    if 'app' not in sys.modules:
+        fd, settings = tempfile.mkstemp(suffix='.py')
+        with os.fdopen(fd, 'w') as file:
+            file.write('STORAGE_BACKEND = "memory"\n')
+        os.environ['XDB_SETTINGS'] = settings
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+        try:
+            import app
+        finally:
+            os.remove(settings)
+            del os.environ['XDB_SETTINGS']
+    return sys.modules['app']
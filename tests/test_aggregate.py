@@ -0,0 +1,100 @@
+from io import BytesIO
+import unittest
+
+from xdb_controller import analytics
+from xdb_controller.paths import parse_path
+
+from .support import AUTH, create_org, load_app, make_driver, sample
+
+ROWS = 'Message/Body/DocumentObject.ПоступлениеТоваров/Товары/Row/Сумма'
+
+
+@unittest.skipIf(analytics.np is None, 'NumPy is not installed')
+class AnalyticsTest(unittest.TestCase):
+
+    def test_extract(self):
+        tree = {'doc': {'Row': [{'Sum': {'$': '1.5'}, 'Kind': {'$': 'a'}},
+                                {'Sum': {'$': 'x'}, 'Kind': {'$': 'b'}},
+                                {'Sum': {'$': '2'}}]}}
+        self.assertEqual(analytics.extract(tree, parse_path('doc/Row/Sum'), parse_path('Kind', relative=True)),
+                         (['1.5', 'x', '2'], ['a', 'b', '']))
+        values, keys = analytics.extract(tree, parse_path('//Sum'))
+        self.assertEqual((sorted(values), keys), (['1.5', '2', 'x'], ['', '', '']))
+
+    def test_non_numeric(self):
+        numbers = analytics.to_floats(['1', None, 'x', '1e3'])
+        self.assertEqual(numbers[0], 1.0)
+        self.assertEqual(numbers[3], 1000.0)
+        self.assertTrue(analytics.np.isnan(numbers[1]) and analytics.np.isnan(numbers[2]))
+
+    def test_partials_merge(self):
+        values, keys = ['1', '2', 'x', '4', '8'], ['a', 'b', 'a', 'a', 'c']
+        whole = analytics.merge([analytics.partial(values, keys)])
+        split = analytics.merge([analytics.partial(values[:2], keys[:2]), analytics.partial(values[2:], keys[2:])])
+        for aggregate in analytics.AGGREGATES:
+            self.assertEqual(analytics.finish(whole, aggregate), analytics.finish(split, aggregate))
+        self.assertEqual(whole['keys'].tolist(), ['a', 'b', 'c'])
+        self.assertEqual(analytics.finish(whole, 'sum'), [5.0, 2.0, 8.0])
+        self.assertEqual(analytics.finish(whole, 'count'), [3, 1, 1])
+        self.assertEqual(analytics.finish(whole, 'mean'), [2.5, 2.0, 8.0])
+        self.assertEqual(analytics.finish(whole, 'min'), [1.0, 2.0, 8.0])
+        # Group without numeric values has no value
+        self.assertEqual(analytics.finish(analytics.merge([analytics.partial(['x'], [''])]), 'max'), [None])
+        self.assertEqual(analytics.finish(analytics.merge([]), 'sum'), [])
+
+
+@unittest.skipIf(analytics.np is None, 'NumPy is not installed')
+class DriverAggregateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver()
+        self.user = 'root'
+        self.doc_ids = [self.driver.doc_create_one(self.user, self.org_id, sample())['doc_id'] for _ in range(2)]
+
+    def aggregate(self, path=ROWS, **kwargs):
+        return self.driver.doc_aggregate(self.user, self.org_id, path, **kwargs)
+
+    def test_values(self):
+        self.assertEqual(self.aggregate(), {'result': 1, 'docs': 2, 'read': 2, 'value': 200.0})
+        self.assertEqual(self.aggregate('//Цена', aggregate='mean')['value'], 57.5)
+        self.assertEqual(self.aggregate('//Description', aggregate='count')['value'], 6)
+        self.assertEqual(self.aggregate('//Description', aggregate='max')['value'], 2.0)
+        groups = self.aggregate(group_by='Номенклатура')['groups']
+        self.assertEqual(groups, {'26b6a15b-6870-11e6-a5b0-2c56dc76eb6b': 100.0,
+                                  'ac2affd1-6aa9-11e6-a5b0-2c56dc76eb6b': 100.0})
+
+    def test_cached_per_document(self):
+        self.assertEqual(self.aggregate()['read'], 2)
+        self.assertEqual(self.aggregate()['read'], 0)
+        # Other path is other query
+        self.assertEqual(self.aggregate('//Цена')['read'], 2)
+
+        doc_id = self.driver.doc_create_one(self.user, self.org_id, '<Message><Body/></Message>')['doc_id']
+        self.assertEqual(self.aggregate(), {'result': 1, 'docs': 3, 'read': 1, 'value': 200.0})
+        self.driver.doc_update_stream(self.user, self.org_id, self.doc_ids[0], BytesIO(b'<Message/>'))
+        self.assertEqual(self.aggregate(), {'result': 1, 'docs': 3, 'read': 1, 'value': 100.0})
+        self.driver.doc_remove_one(self.org_id, doc_id)
+        self.assertEqual(self.aggregate(), {'result': 1, 'docs': 2, 'read': 0, 'value': 100.0})
+
+    def test_errors(self):
+        self.assertEqual(self.aggregate(aggregate='median')['result'], 0)
+        self.assertEqual(self.aggregate('a//b')['result'], 0)
+        self.assertEqual(self.aggregate('a/@b/c')['result'], 0)
+
+
+@unittest.skipIf(analytics.np is None, 'NumPy is not installed')
+class AggregateEndpointTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        cls.url = '/api/v1.0/docs/%s/aggregate' % create_org(cls.app.driver, 'Aggregate')
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+        cls.client.post(cls.url.rsplit('/', 1)[0], data=sample(), headers=headers)
+
+    def test_query(self):
+        resp = self.client.get(self.url, query_string={'path': ROWS, 'aggregate': 'max'}, headers=AUTH)
+        self.assertEqual(resp.get_json()['value'], 50.0)
+        resp = self.client.get(self.url, headers=AUTH)
+        self.assertEqual(resp.get_json(), {'result': 0, 'error': 'No path given.'})
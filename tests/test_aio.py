@@ -0,0 +1,233 @@
+import asyncio
+from io import BytesIO
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+try:
+    from aiohttp.test_utils import TestClient, TestServer
+except ImportError:
+    TestClient = None
+
+from xdb_controller import serializer
+from xdb_controller.aio import AsyncDriver, AsyncDatabase
+from xdb_controller.backends import MemoryBackend
+from xdb_controller.controller import DocumentModel, UserModel
+from xdb_controller.converter import data
+from xdb_controller.segments import SegmentStore
+
+from .support import AUTH, ROOT, make_driver, sample
+
+FIRST = '<Doc><Row><Sum>10</Sum><Kind>a</Kind></Row><Row><Sum>5</Sum><Kind>b</Kind></Row></Doc>'
+SECOND = '<Doc><Row><Sum>7</Sum><Kind>a</Kind></Row></Doc>'
+
+
+def stream(data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data.encode() if isinstance(data, str) else data)
+    reader.feed_eof()
+    return reader
+
+
+class AsyncDriverTest(unittest.IsolatedAsyncioTestCase):
+    '''
+    AsyncDriver and Driver sharing one in-memory database
+    '''
+
+    async def asyncSetUp(self):
+        self.sync, self.org_id = make_driver(dedup=True, text_index=True)
+        self.driver = AsyncDriver(AsyncDatabase(self.sync.db), dedup=True, text_index=True, stream_threshold=None)
+        await self.driver.init()
+
+    async def create(self, data):
+        result = await self.driver.doc_create_stream(self.org_id, stream(data), size=len(data))
+        self.assertEqual(result['result'], 1)
+        return result['doc_id']
+
+    async def test_dedup_shared_with_driver(self):
+        doc_id = self.sync.doc_create_stream('root', self.org_id, BytesIO(sample()))['doc_id']
+        async_id = await self.create(sample())
+        self.assertNotEqual(doc_id, async_id)
+
+        stats = self.sync.dedup_stats()
+        self.assertEqual((stats['hits'], stats['blobs']), (1, 1))
+        self.assertEqual(self.sync.doc_find_one('root', self.org_id, async_id)['data'],
+                         self.sync.doc_find_one('root', self.org_id, doc_id)['data'])
+
+        self.assertEqual((await self.driver.doc_remove_one(self.org_id, async_id))['result'], 1)
+        self.assertEqual(self.sync.dedup_stats()['blobs'], 1)
+        self.assertEqual(self.sync.dedup_stats()['saved'], 0)
+        self.sync.doc_remove_one(self.org_id, doc_id)
+        self.assertEqual(self.sync.dedup_stats()['blobs'], 0)
+
+    async def test_failed_insert_releases_blob(self):
+        await self.create(FIRST)
+        # Next ID is taken already, so insert fails on unique index
+        self.sync.db['organizations'].update_one({'org_id': self.org_id}, {'$inc': {'doc_count': -1}})
+        with self.assertRaises(Exception):
+            await self.driver.doc_create_stream(self.org_id, stream(SECOND))
+        self.assertEqual(self.sync.dedup_stats()['blobs'], 1)
+
+    async def test_text_index_readable_by_driver(self):
+        doc_id = await self.create(sample())
+        self.assertEqual(self.sync.doc_search('root', self.org_id, 'Роздріб')['doc_ids'], [doc_id])
+        await self.driver.doc_remove_one(self.org_id, doc_id)
+        self.assertEqual(self.sync.doc_search('root', self.org_id, 'Роздріб')['doc_ids'], [])
+
+    async def test_update_keeps_history(self):
+        doc_id = await self.create(FIRST)
+        result = await self.driver.doc_update_stream(self.org_id, doc_id, stream(SECOND))
+        self.assertEqual(result, {'result': 1, 'doc_id': doc_id, 'version': 2})
+
+        doc = await self.driver.doc_find_one(self.org_id, doc_id)
+        self.assertEqual(DocumentModel.json_to_xml(await self.driver.doc_tree(self.org_id, doc), prettify=False),
+                         DocumentModel.json_to_xml(DocumentModel.xml_to_json(SECOND), prettify=False))
+        self.assertEqual(DocumentModel.json_to_xml(self.sync.doc_version_tree('root', self.org_id, doc_id, 1),
+                                                   prettify=False),
+                         DocumentModel.json_to_xml(DocumentModel.xml_to_json(FIRST), prettify=False))
+        # Old content is released, only the new one is kept
+        self.assertEqual(self.sync.dedup_stats()['blobs'], 1)
+
+    async def test_update_conflict(self):
+        doc_id = await self.create(FIRST)
+        # History of version 1 already saved by concurrent update
+        self.sync.db['doc_versions'].insert_one({'org_id': self.org_id, 'doc_id': doc_id, 'version': 1})
+        result = await self.driver.doc_update_stream(self.org_id, doc_id, stream(SECOND))
+        self.assertTrue(result['conflict'])
+        doc = await self.driver.doc_find_one(self.org_id, doc_id)
+        self.assertNotIn('version', doc)
+        self.assertEqual(self.sync.dedup_stats()['blobs'], 1)
+
+    async def test_raw_tree_not_saved_over_update(self):
+        self.driver.dedup = False
+        self.driver.storage_format = 'raw'
+        doc_id = await self.create(FIRST)
+        doc = await self.driver.doc_find_one(self.org_id, doc_id)
+        await self.driver.doc_update_stream(self.org_id, doc_id, stream(SECOND))
+        await self.driver.doc_tree(self.org_id, doc)
+        self.assertNotIn('data', await self.driver.doc_find_one(self.org_id, doc_id))
+
+    async def test_segments_written_off_loop(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.driver.segments = SegmentStore(path, fsync=False)
+        self.driver.segment_threshold = 0
+        self.driver.storage_format = 'raw'
+        threads = []
+
+        def append(data):
+            threads.append(threading.current_thread())
+            return original(data)
+        original = self.driver.segments.append
+
+        with mock.patch.object(self.driver.segments, 'append', append):
+            doc_id = await self.create(sample())
+            await self.driver.doc_update_stream(self.org_id, doc_id, stream(FIRST))
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+        doc = await self.driver.doc_find_one(self.org_id, doc_id)
+        self.assertIn('extent', doc)
+        self.assertEqual(DocumentModel.json_to_xml(await self.driver.doc_tree(self.org_id, doc), prettify=False),
+                         DocumentModel.json_to_xml(DocumentModel.xml_to_json(FIRST), prettify=False))
+
+    async def test_aggregate_cached(self):
+        first = await self.create(FIRST)
+        await self.create(SECOND)
+        result = await self.driver.doc_aggregate(self.org_id, 'Doc/Row/Sum', group_by='Kind')
+        self.assertEqual((result['groups'], result['read']), ({'a': 17.0, 'b': 5.0}, 2))
+
+        result = await self.driver.doc_aggregate(self.org_id, 'Doc/Row/Sum')
+        self.assertEqual((result['value'], result['read']), (22.0, 2))
+        result = await self.driver.doc_aggregate(self.org_id, 'Doc/Row/Sum')
+        self.assertEqual((result['value'], result['read']), (22.0, 0))
+
+        await self.driver.doc_update_stream(self.org_id, first, stream(SECOND))
+        result = await self.driver.doc_aggregate(self.org_id, 'Doc/Row/Sum')
+        self.assertEqual((result['value'], result['read']), (14.0, 1))
+        self.assertEqual(result['value'], self.sync.doc_aggregate('root', self.org_id, 'Doc/Row/Sum')['value'])
+
+        result = await self.driver.doc_aggregate(self.org_id, 'Doc/Row/Sum', aggregate='median')
+        self.assertEqual(result['result'], 0)
+
+    async def test_auth_cached(self):
+        user = UserModel('root', 'qwerty')
+        self.assertEqual(await self.driver.user_check_password(user), True)
+        self.assertEqual(await self.driver.user_check_password(UserModel('root', 'wrong')), False)
+        self.sync.db['users'].delete_many({})
+        self.assertEqual(await self.driver.user_check_password(user), True)
+
+        self.sync.db['organizations'].update_one({'org_id': self.org_id}, {'$push': {'users': 'root'}})
+        self.assertEqual(await self.driver.authorize(user, self.org_id), (True, True))
+        self.assertEqual(await self.driver.org_check_user('none', 'root'), False)
+
+    async def test_doc_id_block(self):
+        driver = AsyncDriver(AsyncDatabase(self.sync.db), doc_id_block_size=10)
+        self.assertEqual([await driver.doc_ids.allocate(self.org_id) for _ in range(3)], [1, 2, 3])
+        self.assertEqual(self.sync.org_get_info(self.org_id)['doc_count'], 10)
+        # Driver goes on after the block
+        self.assertEqual(self.sync.doc_ids.allocate(self.org_id), 11)
+        self.assertIsNone(await driver.doc_ids.allocate('none'))
+
+
+@unittest.skipIf(TestClient is None, 'aiohttp is not installed')
+class AsyncAppTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+        import app_async
+
+        db = MemoryBackend()('XDB_TEST')
+        db['users'].insert_one(UserModel('root', 'qwerty').to_dict())
+        db['organizations'].insert_one({'org_id': 'org', 'users': ['root'], 'doc_count': 0})
+        self.driver = AsyncDriver(AsyncDatabase(db), stream_threshold=1)
+        self.client = TestClient(TestServer(app_async.make_app(self.driver)))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def post(self, data):
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+        resp = await self.client.post('/api/v1.0/docs/org', data=data, headers=headers)
+        return await resp.json()
+
+    async def test_streamed_document_built_off_loop(self):
+        doc_id = (await self.post(sample()))['doc_id']
+        threads = []
+
+        def iter_xml(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return original(*args, **kwargs)
+        original = serializer.iter_xml
+
+        with mock.patch.object(serializer, 'iter_xml', iter_xml):
+            resp = await self.client.get('/api/v1.0/docs/org/%d' % doc_id, headers=AUTH)
+            body = await resp.read()
+        self.assertEqual(resp.headers.get('Transfer-Encoding'), 'chunked')
+        self.assertIn('ПоступлениеТоваров'.encode(), body)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+        doc = await self.driver.doc_find_one('org', doc_id)
+        rendered = await self.driver.doc_render_one('org', doc)
+        self.assertEqual(data(DocumentModel.parse(body)), data(DocumentModel.parse(rendered)))
+
+    async def test_update_and_aggregate(self):
+        doc_id = (await self.post(FIRST))['doc_id']
+        headers = dict(AUTH, **{'Content-Type': 'application/xml'})
+        url = '/api/v1.0/docs/org/%d' % doc_id
+        resp = await self.client.put(url, data=SECOND, headers=headers)
+        self.assertEqual((resp.status, (await resp.json())['version']), (200, 2))
+
+        await self.driver.versions.insert_one({'org_id': 'org', 'doc_id': doc_id, 'version': 2})
+        resp = await self.client.put(url, data=FIRST, headers=headers)
+        self.assertEqual(resp.status, 409)
+
+        resp = await self.client.get('/api/v1.0/docs/org/aggregate', params={'path': 'Doc/Row/Sum'}, headers=AUTH)
+        self.assertEqual((await resp.json())['value'], 7.0)
+        resp = await self.client.get('/api/v1.0/docs/other/aggregate', params={'path': 'Doc/Row/Sum'}, headers=AUTH)
+        self.assertEqual(resp.status, 404)
+        resp = await self.client.put(url, data=SECOND, headers={'Content-Type': 'application/xml'})
+        self.assertEqual(resp.status, 401)
@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+
+from xdb_controller.allocator import DocIdAllocator
+from xdb_controller.backends import MemoryBackend
+
+
+class DocIdAllocatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.orgs = MemoryBackend()('XDB_TEST')['organizations']
+        self.orgs.insert_one({'org_id': 'org', 'doc_count': 0})
+
+    def doc_count(self):
+        return self.orgs.find_one({'org_id': 'org'})['doc_count']
+
+    def test_one_by_one(self):
+        allocator = DocIdAllocator(self.orgs)
+        self.assertEqual([allocator.allocate('org') for _ in range(3)], [1, 2, 3])
+        self.assertEqual(allocator.allocate('org', 5), 4)
+        self.assertEqual(self.doc_count(), 8)
+
+    def test_unknown_organization(self):
+        self.assertIsNone(DocIdAllocator(self.orgs).allocate('none'))
+        self.assertIsNone(DocIdAllocator(self.orgs, block_size=10).allocate('none'))
+
+    def test_block(self):
+        allocator = DocIdAllocator(self.orgs, block_size=10)
+        self.assertEqual([allocator.allocate('org') for _ in range(3)], [1, 2, 3])
+        self.assertEqual(self.doc_count(), 10)
+        self.assertEqual(allocator.allocate('org', 7), 4)
+        # Range which doesn't fit into rest of the block starts new block
+        self.assertEqual(allocator.allocate('org', 8), 11)
+        self.assertEqual(self.doc_count(), 20)
+        self.assertEqual(allocator.allocate('org', 2), 19)
+
+        # Other process gets IDs after all reserved ones
+        self.assertEqual(DocIdAllocator(self.orgs, block_size=10).allocate('org'), 21)
+
+    def test_discard(self):
+        allocator = DocIdAllocator(self.orgs, block_size=10)
+        allocator.allocate('org')
+        allocator.discard('org')
+        self.assertEqual(allocator.allocate('org'), 11)
+        allocator.discard()
+        self.assertEqual(allocator.allocate('org'), 21)
+
+    def test_concurrent(self):
+        allocators = [DocIdAllocator(self.orgs), DocIdAllocator(self.orgs, block_size=7)]
+
+        def allocate(index):
+            return [allocators[index % 2].allocate('org') for _ in range(50)]
+
+        with ThreadPoolExecutor(8) as executor:
+            doc_ids = [doc_id for chunk in executor.map(allocate, range(8)) for doc_id in chunk]
+        self.assertEqual(len(set(doc_ids)), 400)
+        self.assertLessEqual(max(doc_ids), self.doc_count())
+
+    def test_invalid_block_size(self):
+        with self.assertRaises(AssertionError):
+            DocIdAllocator(self.orgs, block_size=0)
@@ -0,0 +1,187 @@
+from datetime import datetime
+import shutil
+import tempfile
+import threading
+import unittest
+
+from bson.codec_options import CodecOptions
+from bson.son import SON
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, InsertOne, UpdateOne, DeleteMany
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+
+from xdb_controller.backends import MemoryBackend, SQLiteBackend
+from xdb_controller.controller import Driver, UserModel
+
+from .support import make_driver, sample
+
+
+class CollectionTests:
+    '''
+    Behaviour expected from collections of every backend, run against pymongo semantics
+    '''
+
+    def backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.db = self.backend()('test')
+        self.coll = self.db['docs']
+        self.coll.create_index([('org_id', ASCENDING), ('doc_id', ASCENDING)], unique=True)
+        self.coll.insert_many([{'org_id': org_id, 'doc_id': doc_id, 'size': doc_id * 10, 'tags': ['a', str(doc_id)],
+                                'meta': {'kind': 'x' if doc_id % 2 else 'y'}}
+                               for org_id in ('o1', 'o2') for doc_id in range(1, 6)])
+
+    def doc_ids(self, query, **kwargs):
+        return [doc['doc_id'] for doc in self.coll.find(dict(query, org_id='o1'), **kwargs)]
+
+    def test_query_operators(self):
+        self.assertEqual(self.doc_ids({'doc_id': 3}), [3])
+        self.assertEqual(self.doc_ids({'doc_id': {'$gt': 1, '$lte': 3}}), [2, 3])
+        self.assertEqual(self.doc_ids({'doc_id': {'$in': [5, 1, 9]}}), [1, 5])
+        self.assertEqual(self.doc_ids({'doc_id': {'$nin': [1, 2]}, 'size': {'$ne': 40}}), [3, 5])
+        self.assertEqual(self.doc_ids({'tags': '2'}), [2])
+        self.assertEqual(self.doc_ids({'meta.kind': 'y'}), [2, 4])
+        self.assertEqual(self.doc_ids({'$or': [{'doc_id': 1}, {'meta.kind': 'y'}]}), [1, 2, 4])
+        self.assertEqual(self.doc_ids({'missing': {'$exists': False}, 'size': {'$exists': True}}), [1, 2, 3, 4, 5])
+        with self.assertRaises(ValueError):
+            self.doc_ids({'doc_id': {'$regex': '1'}})
+
+    def test_cursor(self):
+        self.assertEqual(self.doc_ids({}, sort=[('doc_id', DESCENDING)], skip=1, limit=2), [4, 3])
+        cursor = self.coll.find({'org_id': 'o1'}).sort('meta.kind', ASCENDING).skip(1).limit(3).batch_size(2)
+        self.assertEqual([doc['doc_id'] for doc in cursor], [3, 5, 2])
+        self.assertEqual(self.coll.count_documents({'org_id': 'o2', 'doc_id': {'$gte': 2}}), 4)
+
+    def test_projection(self):
+        doc = self.coll.find_one({'org_id': 'o1', 'doc_id': 2}, {'doc_id': 1, 'tags': {'$slice': 1}, '_id': 0})
+        self.assertEqual(doc, {'doc_id': 2, 'tags': ['a']})
+        doc = self.coll.find_one({'org_id': 'o1', 'doc_id': 2}, {'tags': 0, 'meta': 0, '_id': 0})
+        self.assertEqual(doc, {'org_id': 'o1', 'doc_id': 2, 'size': 20})
+        son = self.db.get_collection('docs', codec_options=CodecOptions(document_class=SON)).find_one({})
+        self.assertIsInstance(son, SON)
+
+    def test_updates(self):
+        query = {'org_id': 'o1', 'doc_id': 1}
+        result = self.coll.update_one(query, {'$set': {'meta.kind': 'z'}, '$inc': {'size': 5},
+                                              '$push': {'tags': {'$each': ['b', 'c']}}, '$unset': {'missing': ''}})
+        self.assertEqual((result.matched_count, result.modified_count), (1, 1))
+        self.coll.update_one(query, {'$pull': {'tags': 'b'}, '$addToSet': {'tags': 'a'}})
+        doc = self.coll.find_one(query, {'_id': 0})
+        self.assertEqual((doc['meta'], doc['size'], doc['tags']), ({'kind': 'z'}, 15, ['a', '1', 'c']))
+
+        self.assertEqual(self.coll.update_many({'doc_id': {'$gt': 3}}, {'$set': {'old': True}}).modified_count, 4)
+        result = self.coll.update_one({'org_id': 'o3', 'doc_id': 1}, {'$setOnInsert': {'size': 0}}, upsert=True)
+        self.assertIsNotNone(result.upserted_id)
+        self.assertEqual(self.coll.find_one({'org_id': 'o3'}, {'_id': 0}), {'org_id': 'o3', 'doc_id': 1, 'size': 0})
+
+    def test_find_and_modify(self):
+        # Counter pattern of ID allocation
+        counters = self.db['counters']
+        for expected in (1, 2):
+            doc = counters.find_one_and_update({'_id': 'o1'}, {'$inc': {'seq': 1}}, upsert=True,
+                                               return_document=ReturnDocument.AFTER)
+            self.assertEqual(doc['seq'], expected)
+        before = counters.find_one_and_update({'_id': 'o1'}, {'$inc': {'seq': 5}})
+        self.assertEqual(before['seq'], 2)
+        self.assertEqual(counters.find_one_and_delete({'_id': 'o1'})['seq'], 7)
+        self.assertIsNone(counters.find_one({'_id': 'o1'}))
+
+    def test_unique_index(self):
+        with self.assertRaises(DuplicateKeyError):
+            self.coll.insert_one({'org_id': 'o1', 'doc_id': 1})
+        # Unordered insert keeps the rest
+        with self.assertRaises(BulkWriteError) as error:
+            self.coll.insert_many([{'org_id': 'o1', 'doc_id': 6}, {'org_id': 'o1', 'doc_id': 2},
+                                   {'org_id': 'o1', 'doc_id': 7}], ordered=False)
+        self.assertEqual(error.exception.details['nInserted'], 2)
+        self.assertEqual([item['index'] for item in error.exception.details['writeErrors']], [1])
+        with self.assertRaises(DuplicateKeyError):
+            self.coll.update_one({'org_id': 'o1', 'doc_id': 7}, {'$set': {'doc_id': 6}})
+        with self.assertRaises(DuplicateKeyError):
+            self.coll.create_index('size', unique=True)
+        self.assertEqual(self.coll.count_documents({'org_id': 'o1'}), 7)
+
+    def test_bulk_write(self):
+        result = self.coll.bulk_write([InsertOne({'org_id': 'o3', 'doc_id': 1}),
+                                       UpdateOne({'org_id': 'o1', 'doc_id': 1}, {'$set': {'size': 0}}),
+                                       DeleteMany({'org_id': 'o2'})])
+        self.assertEqual((result.inserted_count, result.modified_count, result.deleted_count), (1, 1, 5))
+        with self.assertRaises(BulkWriteError):
+            self.coll.bulk_write([InsertOne({'org_id': 'o3', 'doc_id': 2}), InsertOne({'org_id': 'o3', 'doc_id': 2})])
+        self.assertEqual(self.coll.count_documents({'org_id': 'o3'}), 2)
+
+    def test_deletes(self):
+        self.assertEqual(self.coll.delete_one({'org_id': 'o1'}).deleted_count, 1)
+        self.assertEqual(self.coll.delete_many({'doc_id': {'$lt': 3}}).deleted_count, 3)
+        self.assertEqual(self.coll.count_documents({}), 6)
+
+    def test_stored_values(self):
+        # Records are copies: changing given or found document doesn't change stored one
+        doc = {'org_id': 'o3', 'doc_id': 1, 'created': datetime(2020, 1, 2, 3, 4, 5, 678901), 'data': b'\x00'}
+        self.coll.insert_one(doc)
+        doc['data'] = b'changed'
+        found = self.coll.find_one({'org_id': 'o3'})
+        self.assertEqual((found['created'], found['data']), (datetime(2020, 1, 2, 3, 4, 5, 678000), b'\x00'))
+        found['data'] = b'changed'
+        self.assertEqual(self.coll.find_one({'org_id': 'o3'})['data'], b'\x00')
+
+    def test_concurrent_inserts(self):
+        def insert(org_id):
+            for doc_id in range(50):
+                self.coll.insert_one({'org_id': org_id, 'doc_id': doc_id})
+
+        threads = [threading.Thread(target=insert, args=('t%d' % index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.coll.count_documents({'org_id': {'$in': ['t0', 't1', 't2', 't3']}}), 200)
+
+
+class MemoryBackendTest(CollectionTests, unittest.TestCase):
+
+    def backend(self):
+        return MemoryBackend()
+
+    def test_compound_index(self):
+        # Whole (org_id, doc_id) key is hashed, the longest prefix query gives is used
+        self.assertEqual(len(self.coll._candidates({'org_id': 'o1', 'doc_id': 3})), 1)
+        self.assertEqual(len(self.coll._candidates({'org_id': {'$in': ['o1', 'o2']}, 'doc_id': {'$in': [1, 2]}})), 4)
+        self.assertEqual(len(self.coll._candidates({'org_id': 'o1', 'size': 30})), 5)
+        self.assertIsNone(self.coll._candidates({'doc_id': 3}))
+        self.coll.update_one({'org_id': 'o1', 'doc_id': 3}, {'$set': {'doc_id': 30}})
+        self.assertEqual(self.doc_ids({'doc_id': {'$in': [3, 30]}}), [30])
+        self.assertEqual(self.coll._candidates({'org_id': 'o1', 'doc_id': 3}), set())
+
+
+class SQLiteBackendTest(CollectionTests, unittest.TestCase):
+
+    def backend(self):
+        return SQLiteBackend(self.path)
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        super().setUp()
+
+    def test_persistence(self):
+        coll = self.backend()('test')['docs']
+        self.assertEqual(coll.count_documents({'org_id': 'o1', 'doc_id': {'$gte': 4}}), 2)
+        with self.assertRaises(DuplicateKeyError):
+            coll.insert_one({'org_id': 'o1', 'doc_id': 1})
+
+    def test_rollback(self):
+        with self.assertRaises(ZeroDivisionError):
+            with self.db.transaction():
+                self.coll.delete_many({})
+                1 / 0
+        self.assertEqual(self.coll.count_documents({}), 10)
+
+    def test_driver(self):
+        driver, org_id = make_driver(backend=SQLiteBackend(self.path))
+        doc_id = driver.doc_create_one('root', org_id, sample())['doc_id']
+        xml = driver.doc_render_one('root', org_id, doc_id)
+        # Driver of other process sees the same storage
+        driver = Driver('XDB_TEST', 'organizations', UserModel('root', 'qwerty'), backend=SQLiteBackend(self.path))
+        driver.connect()
+        self.assertEqual(driver.doc_render_one('root', org_id, doc_id), xml)
@@ -0,0 +1,75 @@
+from email.parser import BytesParser
+import json
+import unittest
+from unittest import mock
+
+from xdb_controller import serializer
+
+from .support import AUTH, create_org, load_app, make_driver, sample
+
+
+class BatchReadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver(stream_threshold=None)
+        self.user = 'root'
+        for index in range(4):
+            self.driver.doc_create_one(self.user, self.org_id, '<doc>%d</doc>' % index)
+
+    def test_one_query(self):
+        find = self.driver.docs_coll.find
+        with mock.patch.object(self.driver.docs_coll, 'find', side_effect=find) as finds:
+            docs = list(self.driver.doc_find_many(self.user, self.org_id, [4, 2, 9, 1], batch_size=2))
+        # One query for raw documents (fetched without trees) and one for the rest, whatever number of IDs
+        self.assertEqual(finds.call_count, 2)
+        self.assertEqual([doc['doc_id'] for doc in docs], [1, 2, 4])
+        self.assertIn('data', docs[0])
+
+    def test_iter_many(self):
+        docs = list(self.driver.doc_iter_many(self.user, self.org_id, [3, 1]))
+        self.assertEqual([doc['doc_id'] for doc, chunks in docs], [1, 3])
+        self.assertIn(b'<doc>2</doc>', b''.join(docs[1][1]))
+
+    def test_multipart(self):
+        parts = [([('Content-ID', '<1>')], [b'<a/>']), ([('Content-ID', '<2>')], iter([b'<b>', b'</b>']))]
+        body = b''.join(serializer.iter_multipart(parts, 'xyz'))
+        self.assertEqual(body, b'--xyz\r\nContent-ID: <1>\r\n\r\n<a/>\r\n'
+                               b'--xyz\r\nContent-ID: <2>\r\n\r\n<b></b>\r\n--xyz--\r\n')
+
+
+class BatchEndpointTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        cls.url = '/api/v1.0/docs/' + create_org(cls.app.driver, 'Batch')
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+        for data in (sample(), b'<doc>2</doc>', b'<doc>3</doc>'):
+            cls.client.post(cls.url, data=data, headers=headers)
+
+    def get(self, ids):
+        resp = self.client.get(self.url + '/batch', query_string={'ids': ids}, headers=AUTH)
+        message = BytesParser().parsebytes(b'Content-Type: ' + resp.headers['Content-Type'].encode() + b'\r\n\r\n' +
+                                           resp.get_data())
+        return resp, message.get_payload()
+
+    def test_parts(self):
+        resp, parts = self.get('1,3-5')
+        self.assertTrue(resp.content_type.startswith('multipart/mixed'))
+        self.assertEqual([part['Content-ID'] for part in parts[:-1]], ['<1>', '<3>'])
+        self.assertTrue(all(part['ETag'] for part in parts[:-1]))
+        self.assertIn('ПоступлениеТоваров'.encode(), parts[0].get_payload(decode=True))
+        self.assertIn(b'<doc>3</doc>', parts[1].get_payload(decode=True))
+        self.assertEqual(parts[1]['Content-Type'], 'text/xml; charset=utf-8')
+        self.assertEqual(json.loads(parts[-1].get_payload()), {'missing': [4, 5]})
+
+    def test_wrong_ids(self):
+        for ids in ('', 'x', '0', '5-1', '1-100000'):
+            resp = self.client.get(self.url + '/batch', query_string={'ids': ids}, headers=AUTH)
+            self.assertEqual(resp.get_json()['result'], 0, ids)
+
+    def test_parse_doc_ids(self):
+        self.assertEqual(self.app.parse_doc_ids('5, 1,2-4,3', 10), [1, 2, 3, 4, 5])
+        with self.assertRaises(ValueError):
+            self.app.parse_doc_ids('1-11', 10)
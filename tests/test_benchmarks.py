@@ -0,0 +1,98 @@
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
+import multiprocessing
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from benchmarks import messages, suite
+
+
+class MessagesTest(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual([messages.parse_size(text) for text in ('100', '64K', '32mb', ' 1G ')],
+                         [100, 64 * 1024, 32 * 1024 ** 2, 1024 ** 3])
+        for text in ('', 'K', '1T', '-1'):
+            with self.assertRaises(ValueError):
+                messages.parse_size(text)
+
+    def test_deterministic(self):
+        data = messages.message(64 * 1024, rows=3, depth=2, seed=1)
+        self.assertEqual(messages.message(64 * 1024, rows=3, depth=2, seed=1), data)
+        self.assertNotEqual(messages.message(64 * 1024, rows=3, depth=2, seed=2), data)
+
+    def test_size_and_shape(self):
+        output = BytesIO()
+        written = messages.write_message(output, 64 * 1024, rows=3, depth=2)
+        data = output.getvalue()
+        self.assertEqual(written, len(data))
+        self.assertGreaterEqual(written, 64 * 1024)
+        self.assertLess(written, 72 * 1024)
+
+        root = ET.fromstring(data)
+        rows = [table for table in root.iter('Товары')]
+        self.assertTrue(rows)
+        self.assertTrue(all(len(table.findall('Row')) == 3 for table in rows))
+        self.assertEqual(len(rows[0].find('Row').findall('ДополнительныеРеквизиты/Row/Row')), 1)
+        refs = [ref.text for ref in root.iter('Ref')]
+        self.assertEqual(len(refs), len(set(refs)))
+
+    def test_small(self):
+        # At least one object, however small size is asked
+        root = ET.fromstring(messages.message(1))
+        self.assertEqual(len(root[1]), 1)
+
+
+class SuiteTest(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual((suite.percentile(values, .5), suite.percentile(values, .99)), (50, 99))
+        self.assertEqual(suite.percentile([7], .99), 7)
+
+    def test_summary(self):
+        result = suite.summary('case', [.003, .001, .002, .002], 1024 ** 2)
+        self.assertEqual((result['runs'], result['p50_ms'], result['p99_ms']), (4, 2, 3))
+        self.assertAlmostEqual(result['mean_ms'], 2)
+        self.assertAlmostEqual(result['ops_s'], 500)
+        self.assertAlmostEqual(result['mb_s'], 500)
+        self.assertIsNone(suite.summary('case', [0], 1)['ops_s'])
+
+    def test_timer(self):
+        calls = []
+        self.assertEqual(len(suite.Timer(min_runs=2, max_runs=5, budget=0).run(lambda: calls.append(1))), 2)
+        self.assertEqual(len(suite.Timer(min_runs=2, max_runs=5, budget=60).run(lambda: None)), 5)
+        self.assertEqual(len(suite.Timer(min_runs=2, max_runs=5, budget=60).run(lambda: None, max_runs=3)), 3)
+
+    def test_compare(self):
+        def item(case, p50):
+            return {'group': 'driver', 'size': '16K', 'case': case, 'p50_ms': p50}
+
+        baseline = {'results': [item('fast', 10), item('slow', 10), item('zero', 0)]}
+        results = [item('fast', 10.5), item('slow', 12), item('zero', 1), item('new', 5)]
+        output = StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(suite.compare(results, baseline, .1), 1)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn('REGRESSION', lines[1])
+        self.assertNotIn('REGRESSION', lines[0] + lines[2])
+
+    def test_run_case(self):
+        fd, path = tempfile.mkstemp(suffix='.xml')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as file:
+            messages.write_message(file, 16 * 1024)
+        options = Namespace(min_runs=1, max_runs=2, budget=0, backend='memory', storage_format='json',
+                            text_index=False, dedup=False)
+        # Case runs in fresh process the way suite runs it
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results, rss = executor.submit(suite.run_case, 'driver', path, options).result()
+        self.assertEqual([result['case'] for result in results],
+                         ['doc_create_stream', 'doc_find_one', 'doc_render_one', 'doc_iter_one', 'doc_remove_one'])
+        self.assertTrue(all(result['runs'] == 1 for result in results))
+        self.assertGreater(rss, 0)
@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+
+from xdb_controller import serializer
+from xdb_controller.controller import DocumentModel
+
+from .support import make_driver, sample
+
+
+class EscapeKeysTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        tree = {'CatalogObject.Name': {'@xmlns': {'$': 'urn:x'}, '$': 'text', 'Row': [{'$': '1'}, {'a.b': {}}]}}
+        escaped = DocumentModel.escape_keys(tree)
+        self.assertEqual(list(escaped), ['CatalogObject．Name'])
+        self.assertEqual(escaped['CatalogObject．Name']['@xmlns'], {'＄': 'urn:x'})
+        self.assertEqual(escaped['CatalogObject．Name']['Row'][1], {'a．b': {}})
+        self.assertEqual(DocumentModel.escape_keys(escaped, reverse=True), tree)
+
+    def test_rendered_escaped(self):
+        # Stored tree is serialized as is, without copy with restored keys
+        tree = {'v8:Message': {'@xmlns': {'$': 'urn:x', 'v8': 'urn:v8'}, '@a.b': '1',
+                               'Object.Name': [{'$': 'text'}, {'v8:Row': {}}]}}
+        escaped = DocumentModel.escape_keys(tree)
+        expected = DocumentModel.json_to_xml(tree)
+        self.assertEqual(DocumentModel.json_to_xml(escaped, escaped=True), expected)
+        self.assertEqual(b''.join(serializer.iter_xml(escaped, escaped=True)),
+                         b''.join(serializer.iter_xml(tree)))
+        self.assertIn('<Object.Name>text</Object.Name>', expected)
+
+
+class BSONStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver(storage_format='bson', stream_threshold=None)
+        self.user = 'root'
+
+    def test_stored_as_subdocument(self):
+        doc_id = self.driver.doc_create_one(self.user, self.org_id, sample())['doc_id']
+        record = self.driver.docs_coll.find_one({'org_id': self.org_id, 'doc_id': doc_id})
+        self.assertEqual(record['format'], 'bson')
+        self.assertIsInstance(record['data'], dict)
+        self.assertIn('v8msg:Message', record['data'])
+        body = record['data']['v8msg:Message']['v8msg:Body']
+        self.assertEqual(body['CatalogObject．ТипыЦенНоменклатуры']['Code'], {'＄': '000000001'})
+
+    def test_rendered_as_json_format(self):
+        json_driver, org_id = make_driver(stream_threshold=None)
+        json_id = json_driver.doc_create_one(self.user, org_id, sample())['doc_id']
+        doc_id = self.driver.doc_create_one(self.user, self.org_id, sample())['doc_id']
+        with mock.patch.object(DocumentModel, 'escape_keys', side_effect=AssertionError):
+            self.assertEqual(self.driver.doc_render_one(self.user, self.org_id, doc_id),
+                             json_driver.doc_render_one(self.user, org_id, json_id))
+            self.assertEqual(b''.join(self.driver.doc_iter_one(self.user, self.org_id, doc_id)),
+                             b''.join(json_driver.doc_iter_one(self.user, org_id, json_id)))
+
+    def test_convert_format(self):
+        json_driver, org_id = make_driver(stream_threshold=None)
+        doc_ids = [json_driver.doc_create_one(self.user, org_id, sample())['doc_id'] for _ in range(3)]
+        expected = json_driver.doc_render_one(self.user, org_id, doc_ids[0])
+
+        self.assertEqual(json_driver.docs_convert_format('bson', batch_size=2), {'result': 1, 'converted': 3})
+        records = list(json_driver.docs_coll.find({'org_id': org_id}))
+        self.assertEqual({record['format'] for record in records}, {'bson'})
+        json_driver.render_cache.clear()
+        self.assertEqual(json_driver.doc_render_one(self.user, org_id, doc_ids[0]), expected)
+        # Already converted documents are skipped
+        self.assertEqual(json_driver.docs_convert_format('bson'), {'result': 1, 'converted': 0})
+
+        self.assertEqual(json_driver.docs_convert_format('json'), {'result': 1, 'converted': 3})
+        record = json_driver.docs_coll.find_one({'org_id': org_id, 'doc_id': doc_ids[0]})
+        self.assertIsInstance(record['data'], str)
+        json_driver.render_cache.clear()
+        self.assertEqual(json_driver.doc_render_one(self.user, org_id, doc_ids[0]), expected)
@@ -0,0 +1,116 @@
+from io import BytesIO
+import tarfile
+import unittest
+from unittest import mock
+
+from xdb_controller.ingest import iter_tar
+
+from .support import AUTH, create_org, load_app, make_driver, sample
+
+
+def tar(files, mode='w:gz'):
+    output = BytesIO()
+    with tarfile.open(fileobj=output, mode=mode) as archive:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, BytesIO(data))
+    return output.getvalue()
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver()
+        self.user = 'root'
+
+    def test_chunked_inserts(self):
+        items = [('%d.xml' % index, BytesIO(b'<doc>%d</doc>' % index)) for index in range(5)]
+        items.insert(2, ('bad.xml', BytesIO(b'<doc>')))
+        insert_many = self.driver.docs_coll.insert_many
+        with mock.patch.object(self.driver.docs_coll, 'insert_many', side_effect=insert_many) as inserts:
+            result = self.driver.doc_create_batch(self.user, self.org_id, items, chunk_size=2)
+        self.assertEqual(inserts.call_count, 3)
+
+        self.assertEqual(result['result'], 1)
+        self.assertEqual((result['doc_first_id'], result['doc_last_id']), (1, 5))
+        self.assertEqual([doc['index'] for doc in result['docs']], [0, 1, 3, 4, 5])
+        self.assertEqual(result['docs'][2], {'index': 3, 'name': '2.xml', 'doc_id': 3})
+        self.assertEqual(result['errors'], [{'index': 2, 'name': 'bad.xml',
+                                             'error': 'Document data corrupted. Unable to parse.'}])
+        self.assertIn(b'<doc>4</doc>', self.driver.doc_render_one(self.user, self.org_id, 5))
+
+    def test_limit_error_reported(self):
+        driver, org_id = make_driver(max_doc_size=100)
+        result = driver.doc_create_batch(self.user, org_id, [('big.xml', BytesIO(sample())),
+                                                             ('small.xml', BytesIO(b'<doc/>'))])
+        self.assertEqual([doc['name'] for doc in result['docs']], ['small.xml'])
+        self.assertEqual(result['errors'][0]['name'], 'big.xml')
+
+    def test_nothing_saved(self):
+        result = self.driver.doc_create_batch(self.user, self.org_id, [('bad.xml', BytesIO(b'<'))])
+        self.assertEqual(result['result'], 0)
+        self.assertEqual(len(result['errors']), 1)
+
+    def test_create_many(self):
+        result = self.driver.doc_create_many(self.org_id, [{'data': '<doc>1</doc>'}, {'data': '<doc>2</doc>'}])
+        self.assertEqual(result, {'result': 1, 'doc_first_id': 1, 'doc_last_id': 2})
+        self.assertEqual(self.driver.doc_create_many(self.org_id, []), {'result': 0})
+
+    def test_insert_failed(self):
+        # ID allocated to the second document is taken already
+        self.driver.docs_coll.insert_one({'org_id': self.org_id, 'doc_id': 2})
+        items = [('%d.xml' % index, BytesIO(b'<doc>%d</doc>' % index)) for index in range(3)]
+        result = self.driver.doc_create_batch(self.user, self.org_id, items)
+        self.assertEqual(result['docs'], [{'index': 0, 'name': '0.xml', 'doc_id': 1}])
+        self.assertEqual([error['index'] for error in result['errors']], [1, 2])
+        self.assertIn(b'<doc>0</doc>', self.driver.doc_render_one(self.user, self.org_id, 1))
+
+    def test_truncated_tar(self):
+        data = tar([('a.xml', b'<a/>'), ('b.xml', sample()), ('c.xml', b'<c/>')], 'w')
+        # Cut inside the second document and not an archive at all
+        for data, names, errors in ((data[:1536], ['a.xml'], [(1, 'b.xml')]), (b'<a/>', [], [(0, None)])):
+            result = self.driver.doc_create_batch(self.user, self.org_id, iter_tar(BytesIO(data)))
+            self.assertEqual([doc['name'] for doc in result['docs']], names)
+            self.assertEqual([(error['index'], error['name']) for error in result['errors']], errors)
+
+    def test_iter_tar(self):
+        for mode in ('w', 'w:gz', 'w:bz2'):
+            data = tar([('a.xml', b'<a/>'), ('b.xml', b'<b/>')], mode)
+            self.assertEqual([(name, file.read()) for name, file in iter_tar(BytesIO(data))],
+                             [('a.xml', b'<a/>'), ('b.xml', b'<b/>')])
+
+
+class BulkUploadTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        cls.url = '/api/v1.0/docs/%s/bulk' % create_org(cls.app.driver, 'Bulk')
+
+    def test_multipart(self):
+        files = {'first': (BytesIO(sample()), 'first.xml'), 'second': (BytesIO(b'<doc/>'), 'second.xml')}
+        resp = self.client.post(self.url, data=files, headers=AUTH, content_type='multipart/form-data')
+        result = resp.get_json()
+        self.assertEqual(result['result'], 1)
+        self.assertEqual(sorted(doc['name'] for doc in result['docs']), ['first.xml', 'second.xml'])
+
+    def test_tar(self):
+        data = tar([('a.xml', sample()), ('b.xml', b'<doc'), ('c.xml', b'<doc/>')])
+        resp = self.client.post(self.url, data=data, headers=dict(AUTH, **{'Content-Type': 'application/gzip'}))
+        result = resp.get_json()
+        self.assertEqual([doc['name'] for doc in result['docs']], ['a.xml', 'c.xml'])
+        self.assertEqual([error['name'] for error in result['errors']], ['b.xml'])
+        self.assertEqual(result['doc_last_id'] - result['doc_first_id'], 1)
+
+    def test_truncated_tar(self):
+        data = tar([('a.xml', sample()), ('b.xml', sample())])
+        resp = self.client.post(self.url, data=data[:len(data) // 2],
+                                headers=dict(AUTH, **{'Content-Type': 'application/gzip'}))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()['errors'][-1]['error'], 'Archive data corrupted. Unable to read.')
+
+    def test_unsupported_type(self):
+        resp = self.client.post(self.url, data=sample(), headers=dict(AUTH, **{'Content-Type': 'application/xml'}))
+        self.assertEqual(resp.get_json()['result'], 0)
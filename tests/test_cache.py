@@ -0,0 +1,109 @@
+import unittest
+from unittest import mock
+
+from xdb_controller import cache
+from xdb_controller.cache import AuthCache, LRUCache
+from xdb_controller.controller import UserModel
+
+from .support import make_driver
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_eviction(self):
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        # "b" is least recently used now
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+        self.assertEqual(lru.stats(), {'hits': 3, 'misses': 1, 'entries': 2, 'size': 2})
+
+    def test_sizeof(self):
+        lru = LRUCache(10, sizeof=len)
+        self.assertTrue(lru.set('a', b'12345'))
+        self.assertTrue(lru.set('b', b'123456'))
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.size, 6)
+        # Too large to be cached at all
+        self.assertFalse(lru.set('c', b'x' * 11))
+        self.assertEqual(lru.get('b'), b'123456')
+
+    def test_ttl(self):
+        lru = LRUCache(10, ttl=5)
+        with mock.patch.object(cache.time, 'monotonic', return_value=100):
+            lru.set('a', 1)
+        with mock.patch.object(cache.time, 'monotonic', return_value=104):
+            self.assertEqual(lru.get('a'), 1)
+        with mock.patch.object(cache.time, 'monotonic', return_value=106):
+            self.assertIsNone(lru.get('a'))
+        self.assertEqual(len(lru), 0)
+
+    def test_discard(self):
+        lru = LRUCache(10)
+        for key in [('org', 1), ('org', 2), ('other', 1)]:
+            lru.set(key, True)
+        lru.discard(('org', 1))
+        lru.discard(('none', 1))
+        lru.discard_where(lambda key: key[0] == 'other')
+        self.assertEqual(len(lru), 1)
+        lru.clear()
+        self.assertEqual((len(lru), lru.size), (0, 0))
+
+
+class AuthCacheTest(unittest.TestCase):
+
+    def test_password(self):
+        auth = AuthCache()
+        user = UserModel('user', 'secret')
+        self.assertFalse(auth.password_valid(user))
+        auth.password_verified(user)
+        self.assertTrue(auth.password_valid(user))
+        self.assertFalse(auth.password_valid(UserModel('user', 'other')))
+        # Password itself is never kept
+        self.assertNotIn(b'secret', auth.get(('password', 'user')))
+
+    def test_forget_user(self):
+        auth = AuthCache()
+        user = UserModel('user', 'secret')
+        auth.password_verified(user)
+        auth.member_verified('user', 'org')
+        auth.member_verified('user', 'other')
+        auth.member_verified('another', 'org')
+        auth.forget_member('user', 'other')
+        self.assertFalse(auth.is_member('user', 'other'))
+        self.assertTrue(auth.is_member('user', 'org'))
+
+        auth.forget_user('user')
+        self.assertFalse(auth.password_valid(user))
+        self.assertFalse(auth.is_member('user', 'org'))
+        self.assertTrue(auth.is_member('another', 'org'))
+
+
+class DriverAuthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver()
+        self.user = UserModel('user', 'secret')
+        self.driver.db_user_add(self.user)
+
+    def test_password_cached(self):
+        self.assertTrue(self.driver.db_user_check_password(self.user))
+        with mock.patch.object(self.driver.db['users'], 'find_one') as find_one:
+            self.assertTrue(self.driver.db_user_check_password(self.user))
+            find_one.assert_not_called()
+        self.assertFalse(self.driver.db_user_check_password(UserModel('user', 'wrong')))
+
+    def test_removed_user(self):
+        self.assertTrue(self.driver.db_user_check_password(self.user))
+        self.driver.db_user_remove(self.user)
+        self.assertFalse(self.driver.db_user_check_password(self.user))
+
+    def test_membership(self):
+        self.assertFalse(self.driver.org_check_user(self.org_id, self.user))
+        self.assertEqual(self.driver.org_add_user(self.org_id, self.user), {'result': 1})
+        self.assertTrue(self.driver.org_check_user(self.org_id, 'user'))
+        self.assertEqual(self.driver.org_remove_user(self.org_id, self.user), {'result': 1})
+        self.assertFalse(self.driver.org_check_user(self.org_id, 'user'))
@@ -0,0 +1,56 @@
+import unittest
+
+from pymongo.errors import DuplicateKeyError
+
+from .support import make_driver, sample
+
+XML = '<doc><n>1</n></doc>'
+
+
+class DocumentsCollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver()
+        self.user = 'root'
+
+    def test_document_record(self):
+        doc_id = self.driver.doc_create_one(self.user, self.org_id, sample())['doc_id']
+        record = self.driver.docs_coll.find_one({'org_id': self.org_id, 'doc_id': doc_id})
+        self.assertIsNotNone(record)
+        # Organization record keeps no documents
+        org = self.driver.db['organizations'].find_one({'org_id': self.org_id})
+        self.assertEqual(org.get('docs', []), [])
+        self.assertNotIn('docs', self.driver.org_get_info(self.org_id))
+
+        doc = self.driver.doc_find_one(self.user, self.org_id, doc_id)
+        self.assertEqual(doc['doc_id'], doc_id)
+        self.assertNotIn('org_id', doc)
+        self.assertNotIn('data', self.driver.doc_find_one(self.user, self.org_id, doc_id, with_data=False))
+
+    def test_unique_document_id(self):
+        doc_id = self.driver.doc_create_one(self.user, self.org_id, XML)['doc_id']
+        with self.assertRaises(DuplicateKeyError):
+            self.driver.docs_coll.insert_one({'org_id': self.org_id, 'doc_id': doc_id})
+
+    def test_remove(self):
+        doc_id = self.driver.doc_create_one(self.user, self.org_id, XML)['doc_id']
+        self.assertEqual(self.driver.doc_remove_one(self.org_id, doc_id), {'result': 1, 'doc_id': doc_id})
+        self.assertIsNone(self.driver.doc_find_one(self.user, self.org_id, doc_id))
+        self.assertEqual(self.driver.doc_remove_one(self.org_id, doc_id), {'result': 0})
+
+    def test_migrate_embedded_documents(self):
+        orgs = self.driver.db['organizations']
+        embedded = [{'doc_id': doc_id, 'data': '{"doc": {"n": {"$": "%d"}}}' % doc_id, 'encoding': 'utf-8'}
+                    for doc_id in range(1, 6)]
+        orgs.update_one({'org_id': self.org_id}, {'$set': {'docs': embedded, 'doc_count': 5}})
+
+        self.assertEqual(self.driver.docs_migrate(batch_size=2), {'result': 1, 'moved': 5})
+        self.assertEqual(orgs.find_one({'org_id': self.org_id})['docs'], [])
+        self.assertEqual(self.driver.docs_coll.count_documents({'org_id': self.org_id}), 5)
+        xml = self.driver.doc_render_one(self.user, self.org_id, 3)
+        self.assertIn(b'<n>3</n>', xml)
+
+        # Nothing left to move, so running again changes nothing
+        self.assertEqual(self.driver.docs_migrate(), {'result': 1, 'moved': 0})
+        # New documents go after migrated ones
+        self.assertEqual(self.driver.doc_create_one(self.user, self.org_id, XML)['doc_id'], 6)
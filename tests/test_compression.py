@@ -0,0 +1,86 @@
+from io import BytesIO
+import gzip
+import unittest
+import zlib
+
+from xdb_controller import compression
+from xdb_controller.ingest import IngestLimitError
+
+from .support import AUTH, create_org, load_app, sample
+
+
+class CompressionTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        data = sample()
+        for coding in compression.ENCODINGS:
+            with self.subTest(coding=coding):
+                compressed = b''.join(compression.iter_compress([data[:1000], b'', data[1000:]], coding))
+                self.assertEqual(compressed and compression.DecodedStream(BytesIO(compressed), coding).read(), data)
+                stream = compression.DecodedStream(BytesIO(compression.compress(data, coding)), coding, chunk_size=100)
+                self.assertEqual(b''.join(iter(lambda: stream.read(333), b'')), data)
+
+    def test_deflate(self):
+        data = sample()
+        self.assertEqual(compression.DecodedStream(BytesIO(zlib.compress(data)), 'deflate').read(), data)
+
+    def test_size_limit(self):
+        bomb = gzip.compress(b'\0' * 10 ** 6)
+        stream = compression.DecodedStream(BytesIO(bomb), 'gzip', max_size=10 ** 5, chunk_size=1000)
+        with self.assertRaises(IngestLimitError):
+            stream.read()
+        self.assertLessEqual(stream.size, 10 ** 5 + 1000)
+
+    def test_corrupted(self):
+        with self.assertRaises(compression.DecodingError):
+            compression.DecodedStream(BytesIO(b'\x1f\x8b' + b'x' * 100), 'gzip').read()
+
+
+class CompressedUploadTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        cls.url = '/api/v1.0/docs/' + create_org(cls.app.driver, 'Compression')
+
+    def post(self, body, coding):
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8',
+                                'Content-Encoding': coding})
+        return self.client.post(self.url, data=body, headers=headers)
+
+    def test_upload(self):
+        resp = self.post(gzip.compress(sample()), 'gzip')
+        doc_id = resp.get_json()['doc_id']
+        resp = self.client.get('%s/%d' % (self.url, doc_id), headers=dict(AUTH, **{'Accept-Encoding': 'gzip'}))
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('ПоступлениеТоваров'.encode(), gzip.decompress(resp.get_data()))
+
+    def test_unsupported_coding(self):
+        resp = self.post(sample(), 'compress')
+        self.assertEqual(resp.status_code, 415)
+
+    def test_corrupted_body(self):
+        resp = self.post(b'\x1f\x8b' + b'x' * 100, 'gzip')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.get_json()['result'], 0)
+
+    def test_decompression_limit(self):
+        middleware = self.app.app.wsgi_app
+        self.addCleanup(setattr, middleware, 'max_size', middleware.max_size)
+        middleware.max_size = 1000
+        resp = self.post(gzip.compress(sample()), 'gzip')
+        self.assertEqual(resp.status_code, 413)
+        self.assertEqual(resp.get_json()['result'], 0)
+
+    def test_raw_length(self):
+        # Compressed body length stands for unknown decompressed one
+        environs = []
+        middleware = self.app.DecompressMiddleware(lambda environ, start_response: environs.append(environ) or [])
+        body = gzip.compress(sample())
+        middleware({'HTTP_CONTENT_ENCODING': 'gzip', 'CONTENT_LENGTH': str(len(body)), 'wsgi.input': BytesIO(body)},
+                   None)
+        self.assertNotIn('CONTENT_LENGTH', environs[0])
+        self.assertEqual(environs[0]['xdb.raw_length'], len(body))
+        with self.app.app.test_request_context(environ_overrides={'xdb.raw_length': len(body)}):
+            self.assertEqual(self.app.upload_size(), len(body))
@@ -0,0 +1,144 @@
+from io import BytesIO
+import json
+import unittest
+
+from lxml import etree
+
+from xdb_controller import converter, serializer
+from xdb_controller.controller import DocumentModel
+
+from .support import sample
+
+MESSAGES = 'http://v8.1c.ru/messages'
+DATA = 'http://v8.1c.ru/8.1/data/enterprise/current-config'
+XSI = 'http://www.w3.org/2001/XMLSchema-instance'
+CORE = 'http://v8.1c.ru/8.1/data/core'
+
+
+def nested_sample():
+    # test4.xml with namespaces declared below the root, default namespace and prefixed attributes
+    xml = sample()
+    xml = xml.replace(b'<v8msg:Body>',
+                      ('<v8msg:Body xmlns="%s" xmlns:xsi="%s">' % (DATA, XSI)).encode(), 1)
+    xml = xml.replace('<Комментарий/>'.encode(), '<Комментарий xsi:nil="true" xml:lang="uk"/>'.encode(), 1)
+    xml = xml.replace(b'<Records>', ('<Records xmlns:v8="%s" v8:kind="prices">' % CORE).encode())
+    return xml
+
+
+def canonical(xml):
+    # Canonical XML without formatting whitespace: same for documents equal up to serialization
+    root = etree.fromstring(xml, etree.XMLParser(remove_blank_text=True))
+    return etree.tostring(root, method='c14n')
+
+
+def render(tree):
+    return DocumentModel.json_to_xml(tree).encode('utf-8')
+
+
+def stream(tree, chunk_size=256):
+    chunks = list(serializer.iter_xml(tree, chunk_size=chunk_size))
+    return b''.join(chunks), len(chunks)
+
+
+class ConverterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = json.loads(DocumentModel.xml_to_json(sample()))
+
+    def test_sample_round_trip(self):
+        self.assertEqual(canonical(render(self.tree)), canonical(sample()))
+        # Stored JSON string is rendered the same way
+        self.assertEqual(canonical(render(DocumentModel.xml_to_json(sample()))), canonical(sample()))
+
+    def test_sample_streamed(self):
+        xml, chunks = stream(self.tree)
+        self.assertGreater(chunks, 1)
+        self.assertEqual(canonical(xml), canonical(sample()))
+        self.assertEqual(canonical(xml), canonical(render(self.tree)))
+
+    def test_prefixes_kept(self):
+        message = self.tree['v8msg:Message']
+        self.assertEqual(message['@xmlns'], {'v8msg': MESSAGES})
+        self.assertEqual(message['v8msg:Header']['v8msg:MessageNo'], {'$': '83'})
+        self.assertIn(b'<v8msg:Header>', render(self.tree))
+        self.assertIn(b'<v8msg:Header>', stream(self.tree)[0])
+
+    def test_leading_zeros(self):
+        body = self.tree['v8msg:Message']['v8msg:Body']
+        self.assertEqual(body['CatalogObject.ТипыЦенНоменклатуры']['Code'], {'$': '000000001'})
+        self.assertEqual(body['DocumentObject.ПоступлениеТоваров']['Number'], {'$': '00000000001'})
+        self.assertEqual(body['DocumentObject.ПоступлениеТоваров']['Posted'], {'$': 'true'})
+        for xml in (render(self.tree), stream(self.tree)[0]):
+            self.assertIn(b'<Code>000000001</Code>', xml)
+            self.assertIn(b'<Number>00000000001</Number>', xml)
+
+    def test_repeated_siblings(self):
+        body = self.tree['v8msg:Message']['v8msg:Body']
+        rows = body['DocumentObject.ПоступлениеТоваров']['Товары']['Row']
+        self.assertEqual(len(rows), 2)
+        record_sets = body['InformationRegisterRecordSet.ЦеныНоменклатуры']
+        self.assertEqual([item['Records']['Record']['Цена']['$'] for item in record_sets], ['100', '120'])
+
+        # Order of siblings survives both serializers
+        for xml in (render(self.tree), stream(self.tree)[0]):
+            root = etree.fromstring(xml)
+            self.assertEqual([record.findtext('Цена') for record in root.iter('Record')], ['100', '120'])
+
+    def test_nested_namespaces(self):
+        xml = nested_sample()
+        tree = json.loads(DocumentModel.xml_to_json(xml))
+        message = tree['v8msg:Message']
+        body = message['v8msg:Body']
+        # Declared where XML declares them, not moved to the root
+        self.assertEqual(message['@xmlns'], {'v8msg': MESSAGES})
+        self.assertEqual(body['@xmlns'], {'$': DATA, 'xsi': XSI})
+        records = body['InformationRegisterRecordSet.ЦеныНоменклатуры'][0]['Records']
+        self.assertEqual(records['@xmlns'], {'v8': CORE})
+
+        self.assertEqual(canonical(render(tree)), canonical(xml))
+        self.assertEqual(canonical(stream(tree)[0]), canonical(xml))
+
+    def test_streamed_ingest(self):
+        # Tree built while upload is read is the same as of whole document
+        for xml in (sample(), nested_sample()):
+            doc = DocumentModel.from_stream(BytesIO(xml))
+            self.assertEqual(json.loads(doc.data), json.loads(DocumentModel.xml_to_json(xml)))
+
+    def test_prefixed_attributes(self):
+        tree = json.loads(DocumentModel.xml_to_json(nested_sample()))
+        body = tree['v8msg:Message']['v8msg:Body']
+        comment = body['DocumentObject.ПоступлениеТоваров']['Комментарий']
+        self.assertEqual(comment, {'@xsi:nil': 'true', '@xml:lang': 'uk'})
+        records = body['InformationRegisterRecordSet.ЦеныНоменклатуры'][1]['Records']
+        self.assertEqual(records['@v8:kind'], 'prices')
+
+        for xml in (render(tree), stream(tree)[0]):
+            root = etree.fromstring(xml)
+            comment = next(root.iter('{%s}Комментарий' % DATA))
+            self.assertEqual(comment.get('{%s}nil' % XSI), 'true')
+            self.assertEqual(comment.get('{http://www.w3.org/XML/1998/namespace}lang'), 'uk')
+            self.assertEqual(comment.prefix, None)
+            self.assertIn(b'xsi:nil="true"', xml)
+
+    def test_undeclared_prefix(self):
+        with self.assertRaises(ValueError):
+            converter.etree({'a:root': {'$': '1'}})
+        with self.assertRaises(ValueError):
+            stream({'root': {'@a:attr': '1'}})
+
+    def test_legacy_clark_tree(self):
+        # As xmljson stored documents: Clark notation tags, scalar values coerced
+        legacy = {'{%s}Message' % MESSAGES: {
+            '{%s}Header' % MESSAGES: {'{%s}MessageNo' % MESSAGES: {'$': 83}},
+            'Body': {'Code': {'$': 1}, 'Posted': {'$': True}, 'Comment': {'$': None},
+                     'Row': [{'$': 1.5}, {'$': 'x', '@{%s}nil' % XSI: False}]}}}
+        for xml in (render(legacy), stream(legacy)[0]):
+            root = etree.fromstring(xml)
+            self.assertEqual(root.tag, '{%s}Message' % MESSAGES)
+            self.assertEqual(root.find('{%s}Header/{%s}MessageNo' % (MESSAGES, MESSAGES)).text, '83')
+            self.assertEqual([item.text for item in root.find('Body')], ['1', 'true', None, '1.5', 'x'])
+            self.assertEqual(root.find('Body')[4].get('{%s}nil' % XSI), 'false')
+
+        # Parsed again it becomes prefixed tree
+        tree = json.loads(DocumentModel.xml_to_json(render(legacy)))
+        self.assertEqual(list(tree), ['ns0:Message'])
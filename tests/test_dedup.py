@@ -0,0 +1,116 @@
+import base64
+from io import BytesIO
+import shutil
+import tempfile
+import unittest
+
+from pymongo.errors import DuplicateKeyError
+
+from xdb_controller.backends import MemoryBackend
+from xdb_controller.controller import Driver, UserModel
+from xdb_controller.segments import SegmentsUnavailable
+
+from .support import AUTH, create_org, load_app, make_driver, sample
+
+
+class DedupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver(dedup=True)
+
+    def create(self, xml):
+        return self.driver.doc_create_stream('root', self.org_id, BytesIO(xml))
+
+    def test_identical_content_stored_once(self):
+        first = self.create(sample())['doc_id']
+        # Same tree, other formatting
+        second = self.create(sample().replace(b'\n', b'\r\n'))['doc_id']
+        self.assertEqual(self.driver.blobs_coll.count_documents({}), 1)
+        stats = self.driver.dedup_stats()
+        self.assertEqual((stats['hits'], stats['blobs']), (1, 1))
+        self.assertEqual(stats['saved'], stats['stored'])
+        self.assertEqual(self.driver.doc_render_one('root', self.org_id, first),
+                         self.driver.doc_render_one('root', self.org_id, second))
+
+    def test_released_references(self):
+        doc_ids = [self.create(sample())['doc_id'] for index in range(3)]
+        stored = self.driver.dedup_stats()['stored']
+        self.assertEqual(self.driver.dedup_stats()['saved'], 2 * stored)
+
+        self.driver.doc_remove_one(self.org_id, doc_ids[0])
+        self.assertEqual(self.driver.dedup_stats()['saved'], stored)
+        self.driver.doc_remove_one(self.org_id, doc_ids[1])
+        self.assertEqual(self.driver.dedup_stats()['saved'], 0)
+        self.driver.doc_remove_one(self.org_id, doc_ids[2])
+        stats = self.driver.dedup_stats()
+        self.assertEqual((stats['blobs'], stats['stored'], stats['saved']), (0, 0, 0))
+        self.assertEqual(self.driver.blobs_coll.count_documents({}), 0)
+
+    def test_failed_insert_drops_reference(self):
+        self.create(sample())
+        # Record taking the next ID makes insert fail
+        self.driver.docs_coll.insert_one({'org_id': self.org_id, 'doc_id': 2})
+        with self.assertRaises(DuplicateKeyError):
+            self.create(sample())
+        blob = self.driver.blobs_coll.find_one({})
+        self.assertEqual(blob['refs'], 1)
+        self.assertEqual(self.driver.dedup_stats()['saved'], 0)
+
+    def test_failed_batch_insert_drops_references(self):
+        self.driver.docs_coll.insert_one({'org_id': self.org_id, 'doc_id': 2})
+        items = [('%d.xml' % index, BytesIO(b'<a>%d</a>' % index)) for index in range(3)]
+        result = self.driver.doc_create_batch('root', self.org_id, items)
+        self.assertEqual(([doc['doc_id'] for doc in result['docs']], len(result['errors'])), ([1], 2))
+        # Only the record saved before the failed one keeps its blob
+        self.assertEqual([blob['refs'] for blob in self.driver.blobs_coll.find({})], [1])
+
+
+    def test_shared_within_organization(self):
+        self.create(sample())
+        self.create(sample())
+        other_id = create_org(self.driver, 'Other')
+        self.driver.doc_create_stream('root', other_id, BytesIO(sample()))
+        # Other organization gets its own copy and counters
+        self.assertEqual(self.driver.blobs_coll.count_documents({}), 2)
+        self.assertEqual([self.driver.dedup_stats(org_id)['hits'] for org_id in (self.org_id, other_id)], [1, 0])
+        self.assertEqual(self.driver.dedup_stats()['blobs'], 2)
+
+
+class DedupEndpointTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        driver = cls.app.driver
+        cls.org_id, cls.other_id = create_org(driver, 'Dedup'), create_org(driver, 'Dedup other')
+        driver.db_user_add(('dedup', 'secret'))
+        driver.org_add_user(cls.org_id, ('dedup', 'secret'))
+        cls.auth = {'Authorization': 'Basic ' + base64.b64encode(b'dedup:secret').decode()}
+
+    def test_scoped(self):
+        url = '/api/v1.0/stats/dedup'
+        self.assertEqual(self.client.get(url, headers=self.auth).status_code, 403)
+        self.assertEqual(self.client.get(url, headers=AUTH).get_json()['hits'], self.app.driver.dedup_stats()['hits'])
+        resp = self.client.get(url, query_string={'org_id': self.org_id}, headers=self.auth)
+        self.assertEqual(resp.get_json(), {'hits': 0, 'saved': 0, 'blobs': 0, 'stored': 0})
+        resp = self.client.get(url, query_string={'org_id': self.other_id}, headers=self.auth)
+        self.assertEqual(resp.status_code, 404)
+
+class SegmentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='xdb-test-')
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_payload_without_segment_store(self):
+        backend = MemoryBackend()
+        driver, org_id = make_driver(backend=backend, storage_format='raw', segments_path=self.path,
+                                     segment_threshold=1)
+        doc_id = driver.doc_create_stream('root', org_id, BytesIO(sample()))['doc_id']
+        self.assertIn('extent', driver.docs_coll.find_one({'doc_id': doc_id}))
+
+        other = Driver('XDB_TEST', 'organizations', UserModel('root', 'qwerty'), backend=backend)
+        other.connect()
+        with self.assertRaises(SegmentsUnavailable):
+            other.doc_find_one('root', org_id, doc_id)
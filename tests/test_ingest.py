@@ -0,0 +1,69 @@
+from io import BytesIO
+import unittest
+
+from xdb_controller.converter import data
+from xdb_controller.controller import DocumentModel
+from xdb_controller.ingest import StreamIngest, IngestLimitError
+
+from .support import AUTH, create_org, load_app, sample
+
+
+def nested(depth):
+    return b'<a>' * depth + b'</a>' * depth
+
+
+class StreamIngestTest(unittest.TestCase):
+
+    def test_tree_same_as_converter(self):
+        xml = sample()
+        ingest = StreamIngest(chunk_size=1000).read(BytesIO(xml))
+        self.assertEqual(ingest.tree, data(DocumentModel.parse(xml)))
+        self.assertEqual(ingest.size, len(xml))
+
+    def test_size_limit(self):
+        with self.assertRaises(IngestLimitError):
+            StreamIngest(max_size=100).read(BytesIO(sample()))
+
+    def test_depth_limit(self):
+        StreamIngest(max_depth=10).read(BytesIO(nested(10)))
+        with self.assertRaises(IngestLimitError):
+            StreamIngest(max_depth=10).read(BytesIO(nested(11)))
+
+    def test_depth_above_parser_limit(self):
+        # Parser alone stops at 256 levels, own limit may be higher
+        ingest = StreamIngest(max_depth=512).read(BytesIO(nested(300)))
+        self.assertIsNotNone(ingest.tree)
+        with self.assertRaises(IngestLimitError):
+            StreamIngest(max_depth=256).read(BytesIO(nested(300)))
+
+    def test_parser_depth_limit_without_own_one(self):
+        with self.assertRaises(IngestLimitError):
+            StreamIngest().read(BytesIO(nested(300)))
+
+
+class UploadLimitsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        cls.url = '/api/v1.0/docs/' + create_org(cls.app.driver, 'Limits')
+
+    def post(self, body):
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+        return self.client.post(self.url, data=body, headers=headers)
+
+    def test_too_deep_document(self):
+        for depth in (self.app.app.config['MAX_DOC_DEPTH'] + 1, 300):
+            resp = self.post(nested(depth))
+            self.assertEqual(resp.status_code, 413)
+            self.assertEqual(resp.get_json()['result'], 0)
+
+    def test_corrupted_document(self):
+        resp = self.post(b'<a><b></a>')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()['result'], 0)
+
+    def test_allowed_depth(self):
+        resp = self.post(nested(self.app.app.config['MAX_DOC_DEPTH']))
+        self.assertEqual(resp.get_json()['result'], 1)
@@ -0,0 +1,109 @@
+import json
+import unittest
+from unittest import mock
+
+from xdb_controller import paths
+
+from .support import AUTH, create_org, load_app, make_driver, sample
+
+DOC_REF = 'e6026475-6aae-11e6-a5b0-2c56dc76eb6b'
+ITEM_REF = '26b6a15b-6870-11e6-a5b0-2c56dc76eb6b'
+
+
+class PathsTest(unittest.TestCase):
+
+    tree = {'v8:Message': {'@xmlns': {'v8': 'urn:v8'},
+                           'v8:Body': {'Item': [{'Ref': {'$': '1'}, '@kind': 'a'},
+                                                {'Ref': {'$': '2'}, '@v8:kind': 'b'},
+                                                {'Ref': {'$': '1'}}],
+                                       'Doc': {'Ref': {'$': '3'}}}}}
+
+    def test_parse(self):
+        self.assertEqual(paths.parse_path('//v8:Body/Item/@v8:kind'), (True, ['Body', 'Item', '@kind']))
+        self.assertEqual(paths.parse_path('//Item', relative=True), (False, ['Item']))
+        for path in ('', '/', 'a//b', 'a/@b/c'):
+            with self.assertRaises(ValueError):
+                paths.parse_path(path)
+
+    def test_values(self):
+        self.assertEqual(paths.values(self.tree, paths.parse_path('Message/Body/Item/Ref')), ['1', '2'])
+        self.assertEqual(paths.values(self.tree, paths.parse_path('Message/Body/*/Ref')), ['1', '2', '3'])
+        self.assertEqual(sorted(paths.values(self.tree, paths.parse_path('//Ref'))), ['1', '2', '3'])
+        self.assertEqual(paths.values(self.tree, paths.parse_path('//Item/@kind')), ['a', 'b'])
+        self.assertEqual(paths.values(self.tree, paths.parse_path('Body/Ref')), [])
+        # Large table: distinct values are kept in order of first occurrence
+        tree = {'Doc': {'Row': [{'Ref': {'$': str(index % 5000)}} for index in range(20000, 0, -1)]}}
+        self.assertEqual(paths.values(tree, paths.parse_path('Doc/Row/Ref')),
+                         [str(index % 5000) for index in range(20000, 15000, -1)])
+
+
+class KeysTest(unittest.TestCase):
+
+    rules = [{'name': 'ref', 'path': '//DocumentObject.ПоступлениеТоваров/Ref'},
+             {'name': 'item', 'path': '//Товары/Row/Номенклатура'}]
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver()
+        self.user = 'root'
+
+    def lookup(self, name, value):
+        return self.driver.doc_lookup(self.user, self.org_id, name, value)['doc_ids']
+
+    def test_lookup(self):
+        self.assertEqual(self.driver.org_set_key_rules(self.org_id, self.rules), {'result': 1})
+        doc_id = self.driver.doc_create_one(self.user, self.org_id, sample())['doc_id']
+        self.driver.doc_create_one(self.user, self.org_id, '<doc/>')
+        # Lookup is answered by keys alone
+        with mock.patch.object(self.driver.docs_coll, 'find', side_effect=AssertionError), \
+                mock.patch.object(self.driver.docs_coll, 'find_one', side_effect=AssertionError):
+            self.assertEqual(self.lookup('ref', DOC_REF), [doc_id])
+            self.assertEqual(self.lookup('item', ITEM_REF), [doc_id])
+            self.assertEqual(self.lookup('ref', ITEM_REF), [])
+
+        self.driver.doc_remove_one(self.org_id, doc_id)
+        self.assertEqual(self.lookup('ref', DOC_REF), [])
+
+    def test_wrong_rules(self):
+        for rules in ([{'name': '', 'path': 'a'}], [{'name': 'a'}], [{'name': 'a', 'path': 'a//b'}], ['a']):
+            self.assertEqual(self.driver.org_set_key_rules(self.org_id, rules)['result'], 0, rules)
+        self.assertEqual(self.driver.org_set_key_rules('unknown', self.rules), {'result': 0})
+
+    def test_extract_existing(self):
+        doc_id = self.driver.doc_create_one(self.user, self.org_id, sample())['doc_id']
+        self.driver.org_set_key_rules(self.org_id, self.rules)
+        self.assertEqual(self.lookup('ref', DOC_REF), [])
+
+        self.assertEqual(self.driver.docs_extract_keys(), {'result': 1, 'processed': 1})
+        self.assertEqual(self.lookup('ref', DOC_REF), [doc_id])
+        # Rebuild replaces keys of changed rules
+        self.driver.org_set_key_rules(self.org_id, self.rules[1:])
+        self.driver.docs_extract_keys()
+        self.assertEqual(self.lookup('ref', DOC_REF), [])
+        self.assertEqual(self.lookup('item', ITEM_REF), [doc_id])
+
+
+class KeysEndpointTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        cls.org_id = create_org(cls.app.driver, 'Keys')
+
+    def test_lookup(self):
+        resp = self.client.put('/api/v1.0/orgs/%s/key_rules' % self.org_id, headers=AUTH,
+                               data=json.dumps(KeysTest.rules), content_type='application/json')
+        self.assertEqual(resp.get_json(), {'result': 1})
+        url = '/api/v1.0/docs/' + self.org_id
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+        doc_id = self.client.post(url, data=sample(), headers=headers).get_json()['doc_id']
+
+        resp = self.client.get(url + '/lookup', query_string={'name': 'ref', 'value': DOC_REF}, headers=AUTH)
+        self.assertEqual(resp.get_json(), {'result': 1, 'doc_ids': [doc_id]})
+        resp = self.client.get(url + '/lookup', query_string={'name': 'ref'}, headers=AUTH)
+        self.assertEqual(resp.get_json()['result'], 0)
+
+    def test_no_rules(self):
+        resp = self.client.put('/api/v1.0/orgs/%s/key_rules' % self.org_id, headers=AUTH, data='{}',
+                               content_type='application/json')
+        self.assertEqual(resp.get_json()['result'], 0)
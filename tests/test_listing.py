@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+import json
+import unittest
+
+from .support import AUTH, create_org, load_app, make_driver
+
+
+class ListingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver()
+        self.user = 'root'
+        for index in range(5):
+            self.driver.doc_create_one(self.user, self.org_id, '<doc>%d</doc>' % index)
+
+    def pages(self, **kwargs):
+        doc_ids, after = [], None
+        while True:
+            result = self.driver.doc_list(self.user, self.org_id, after=after, limit=2, **kwargs)
+            self.assertEqual(result['result'], 1)
+            self.assertLessEqual(len(result['docs']), 2)
+            doc_ids.append([doc['doc_id'] for doc in result['docs']])
+            after = result['next']
+            if after is None:
+                return doc_ids
+
+    def test_by_id(self):
+        self.assertEqual(self.pages(), [[1, 2], [3, 4], [5]])
+        self.assertEqual(self.pages(descending=True), [[5, 4], [3, 2], [1]])
+
+    def test_by_modification_time(self):
+        # Same time of several documents is ordered by ID
+        start = datetime(2020, 1, 1)
+        for doc_id, minutes in ((1, 2), (2, 1), (3, 1), (4, 3), (5, 2)):
+            self.driver.docs_coll.update_one({'org_id': self.org_id, 'doc_id': doc_id},
+                                             {'$set': {'last_modified': start + timedelta(minutes=minutes)}})
+        self.assertEqual(self.pages(order_by='last_modified'), [[2, 3], [1, 5], [4]])
+        self.assertEqual(self.pages(order_by='last_modified', descending=True), [[4, 5], [1, 3], [2]])
+
+    def test_metadata_only(self):
+        doc = self.driver.doc_list(self.user, self.org_id, limit=1)['docs'][0]
+        self.assertLessEqual(set(doc), {'doc_id', 'last_modified', 'encoding', 'size', 'sha256'})
+
+    def test_wrong_after(self):
+        result = self.driver.doc_list(self.user, self.org_id, order_by='last_modified', after='x')
+        self.assertEqual(result, {'result': 0, 'error': 'Wrong "after" value.'})
+
+
+class ListingEndpointTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        cls.url = '/api/v1.0/docs/' + create_org(cls.app.driver, 'Listing')
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+        for index in range(3):
+            cls.client.post(cls.url, data='<doc>%d</doc>' % index, headers=headers)
+
+    def test_pages(self):
+        resp = self.client.get(self.url, query_string={'limit': 2}, headers=AUTH)
+        page = json.loads(resp.get_data())
+        self.assertEqual([doc['doc_id'] for doc in page['docs']], [1, 2])
+        resp = self.client.get(self.url, query_string={'limit': 2, 'after': page['next']}, headers=AUTH)
+        page = json.loads(resp.get_data())
+        self.assertEqual(([doc['doc_id'] for doc in page['docs']], page['next']), ([3], None))
+
+    def test_wrong_order(self):
+        resp = self.client.get(self.url, query_string={'order_by': 'size'}, headers=AUTH)
+        self.assertEqual(resp.get_json()['result'], 0)
@@ -0,0 +1,133 @@
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from xdb_controller import controller, metrics
+
+from .support import AUTH, create_org, load_app, make_driver, sample
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter_and_gauge(self):
+        counter = metrics.Counter('x_total', 'Things "done".\nTwice', ['kind'], registry=self.registry)
+        counter.labels('a').inc()
+        counter.labels('a').inc(2)
+        counter.labels('b\\"').inc()
+        gauge = metrics.Gauge('x_now', 'Things now.', registry=self.registry)
+        gauge.inc(5)
+        gauge.dec()
+        self.assertEqual(self.registry.exposition(), '# HELP x_total Things "done".\\nTwice\n'
+                                                     '# TYPE x_total counter\n'
+                                                     'x_total{kind="a"} 3\n'
+                                                     'x_total{kind="b\\\\\\""} 1\n'
+                                                     '# HELP x_now Things now.\n'
+                                                     '# TYPE x_now gauge\n'
+                                                     'x_now 4\n')
+        with self.assertRaises(AssertionError):
+            metrics.Counter('x_total', 'Again.', registry=self.registry)
+        with self.assertRaises(AssertionError):
+            counter.labels()
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('x_seconds', 'Time.', buckets=(1, .1), registry=self.registry)
+        for value in (.05, .1, .5, 3):
+            histogram.observe(value)
+        with histogram.time():
+            pass
+        lines = self.registry.exposition().splitlines()[2:]
+        self.assertEqual(lines[:3], ['x_seconds_bucket{le="0.1"} 3', 'x_seconds_bucket{le="1"} 4',
+                                     'x_seconds_bucket{le="+Inf"} 5'])
+        self.assertEqual(lines[4], 'x_seconds_count 5')
+        self.assertAlmostEqual(float(lines[3].split()[1]), 3.65, places=2)
+
+    def test_iter_timed(self):
+        seconds = metrics.Histogram('x_seconds', 'Time.', registry=self.registry)
+        size = metrics.Histogram('x_bytes', 'Size.', buckets=metrics.SIZE_BUCKETS, registry=self.registry)
+        self.assertEqual(list(metrics.iter_timed(iter([b'ab', b'c']), seconds, size)), [b'ab', b'c'])
+        self.assertEqual(size.labels().sum, 3)
+        self.assertEqual(sum(seconds.labels().counts), 1)
+
+    def test_collector(self):
+        gauge = metrics.Gauge('x_size', 'Size.', registry=self.registry)
+        self.registry.add_collector(lambda: gauge.set(7))
+        self.assertIn('x_size 7\n', self.registry.exposition())
+
+    def test_processes(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        counter = metrics.Counter('x_total', 'Done.', registry=self.registry)
+        gauge = metrics.Gauge('x_now', 'Now.', registry=self.registry)
+        histogram = metrics.Histogram('x_seconds', 'Time.', buckets=(1,), registry=self.registry)
+        self.registry.set_directory(path)
+        # Flush at exit has nothing to write
+        self.addCleanup(setattr, self.registry, 'directory', None)
+        counter.inc(2)
+        gauge.set(1)
+        histogram.observe(.5)
+
+        # Snapshot of exited process: counters and histograms stay, gauges don't
+        process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True)
+        with open(os.path.join(path, process.stdout.decode().strip() + metrics.SNAPSHOT_SUFFIX), 'w') as file:
+            json.dump({'x_total': [[[], 3]], 'x_now': [[[], 5]], 'x_seconds': [[[], [0, 1, 2.0]]],
+                       'x_unknown': [[[], 1]]}, file)
+        open(os.path.join(path, 'broken' + metrics.SNAPSHOT_SUFFIX), 'w').close()
+
+        collected = self.registry.collect()
+        self.assertEqual(collected['x_total'], [[[], 5]])
+        self.assertEqual(collected['x_now'], [[[], 1]])
+        self.assertEqual(collected['x_seconds'], [[[], [1, 1, 2.5]]])
+        self.assertNotIn('x_unknown', collected)
+
+
+
+class DriverCollectorTest(unittest.TestCase):
+
+    def cache_hits(self):
+        metrics.REGISTRY.dump()
+        return controller.CACHE_HITS.labels('render').value
+
+    def test_drivers_summed(self):
+        collectors = len(metrics.REGISTRY.collectors)
+        before = self.cache_hits()
+        drivers = [make_driver()[0] for index in range(2)]
+        for driver in drivers:
+            driver.render_cache.set('key', b'x')
+            driver.render_cache.get('key')
+        self.assertEqual(self.cache_hits(), before + 2)
+        self.assertEqual(len(metrics.REGISTRY.collectors), collectors)
+        # Dropped driver is no longer kept alive and counted
+        del drivers[0]
+        gc.collect()
+        self.assertEqual(self.cache_hits(), before + 1)
+
+class MetricsEndpointTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        cls.url = '/api/v1.0/docs/' + create_org(cls.app.driver, 'Metrics')
+
+    def test_exposition(self):
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+        doc_id = self.client.post(self.url, data=sample(), headers=headers).get_json()['doc_id']
+        self.client.get('%s/%d' % (self.url, doc_id), headers=AUTH)
+
+        resp = self.client.get('/metrics')
+        self.assertEqual(resp.content_type, metrics.CONTENT_TYPE)
+        text = resp.get_data(as_text=True)
+        self.assertIn('# TYPE xdb_http_request_seconds histogram', text)
+        self.assertIn('xdb_http_request_seconds_count{route="/api/v1.0/docs/<string:org_id>/<int:doc_id>",'
+                      'method="GET",status="200"}', text)
+        self.assertIn('xdb_conversion_seconds_count{direction="xml_to_json"}', text)
+        # Scrape itself is in flight
+        self.assertIn('xdb_http_requests_in_flight 1\n', text)
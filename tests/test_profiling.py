@@ -0,0 +1,160 @@
+from io import BytesIO
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+from xdb_controller import profiling
+from xdb_controller.controller import CommandMetrics
+from xdb_controller.ingest import IngestLimitError
+
+from .support import AUTH, create_org, load_app, make_driver, sample
+
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def load(self, path):
+        with open(path + '.json') as file:
+            return json.load(file)
+
+    def test_sample(self):
+        profile = profiling.Profile('sample', interval=0.001)
+        profile.start()
+        self.assertIs(profiling.current(), profile)
+        busy_loop(0.05)
+        profile.stop()
+        self.assertIsNone(profiling.current())
+
+        path = profile.save(self.path, 'request')
+        with open(path + '.collapsed') as file:
+            lines = file.read().splitlines()
+        self.assertTrue(any('busy_loop (test_profiling.py:' in line for line in lines))
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        self.assertEqual(self.load(path)['mode'], 'sample')
+        self.assertGreaterEqual(self.load(path)['elapsed'], 0.05)
+
+    def test_cprofile(self):
+        profile = profiling.Profile('cprofile')
+        profile.start()
+        busy_loop(0.01)
+        profile.stop()
+        path = profile.save(self.path, 'request')
+        stats = pstats.Stats(path + '.prof')
+        self.assertTrue(any(name == 'busy_loop' for filename, line, name in stats.stats))
+        self.assertFalse(os.path.exists(path + '.collapsed'))
+        with self.assertRaises(AssertionError):
+            profiling.Profile('trace')
+
+    def test_other_threads(self):
+        profile = profiling.Profile('cprofile')
+        profile.start()
+        self.addCleanup(profile.stop)
+        found = []
+        thread = threading.Thread(target=lambda: found.append(profiling.current()))
+        thread.start()
+        thread.join()
+        self.assertEqual(found, [None])
+
+    def test_server_timing(self):
+        profile = profiling.Profile('cprofile')
+        profile.start()
+        profile.add_call('doc_find_one', 0.002)
+        profile.add_call('doc_render_one', 0.010, ValueError('bad'))
+        profile.add_command('doc_render_one', 0.004)
+        profile.stop()
+        profile.elapsed = 0.0125
+        self.assertEqual(profile.server_timing(),
+                         'total;dur=12.50, doc_render_one;dur=10.00;desc="1 calls, 1 DB commands 4.00 ms", '
+                         'doc_find_one;dur=2.00;desc="1 calls, 0 DB commands 0.00 ms"')
+        self.assertEqual(profile.errors, [{'method': 'doc_render_one', 'error': 'ValueError: bad'}])
+
+
+class DriverProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver(max_doc_size=1000, stream_threshold=None)
+        self.user = 'root'
+        self.profile = profiling.Profile('cprofile')
+        self.profile.start()
+        self.addCleanup(self.profile.stop)
+
+    def test_calls(self):
+        doc_id = self.driver.doc_create_one(self.user, self.org_id, '<doc/>')['doc_id']
+        self.driver.doc_render_one(self.user, self.org_id, doc_id)
+        with self.assertRaises(IngestLimitError):
+            self.driver.doc_create_stream(self.user, self.org_id, BytesIO(sample()))
+        calls = self.profile.calls
+        self.assertEqual(calls['doc_create_one'][0], 1)
+        self.assertEqual(calls['doc_render_one'][0], 1)
+        # Nested calls are counted on their own too
+        self.assertGreaterEqual(calls['org_check_user'][0], 3)
+        self.assertEqual([error['method'] for error in self.profile.errors], ['doc_create_stream'])
+
+    def test_db_commands(self):
+        # Command sent outside of Driver methods
+        event = types.SimpleNamespace(command_name='find', duration_micros=1500)
+        CommandMetrics().succeeded(event)
+        self.assertEqual(self.profile.calls['none'][2:], [1, 0.0015])
+
+
+class ProfileEndpointTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        cls.url = '/api/v1.0/docs/' + create_org(cls.app.driver, 'Profile')
+
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        config = self.app.app.config
+        for name, value in (('PROFILE_TOKEN', 'secret'), ('PROFILE_DIR', path)):
+            self.addCleanup(config.__setitem__, name, config[name])
+            config[name] = value
+        self.path = path
+
+    def post(self, **headers):
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'}, **headers)
+        return self.client.post(self.url, data=sample(), headers=headers)
+
+    def test_requested(self):
+        resp = self.post(**{'X-Profile': 'secret'})
+        self.assertTrue(resp.headers['Server-Timing'].startswith('total;dur='))
+        self.assertIn('doc_create_stream;dur=', resp.headers['Server-Timing'])
+        name = resp.headers['X-Profile-File']
+        self.assertEqual(sorted(os.listdir(self.path)), [name + '.collapsed', name + '.json'])
+
+        resp = self.post(**{'X-Profile': 'secret', 'X-Profile-Mode': 'cprofile'})
+        self.assertTrue(os.path.exists(os.path.join(self.path, resp.headers['X-Profile-File'] + '.prof')))
+
+    def test_not_requested(self):
+        for headers in ({}, {'X-Profile': 'wrong'}):
+            resp = self.post(**headers)
+            self.assertNotIn('Server-Timing', resp.headers)
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_sampled(self):
+        # Sampled request is saved, but its client sees nothing
+        config = self.app.app.config
+        self.addCleanup(config.__setitem__, 'PROFILE_SAMPLE_RATE', config['PROFILE_SAMPLE_RATE'])
+        config['PROFILE_SAMPLE_RATE'] = 1.0
+        resp = self.post()
+        self.assertNotIn('X-Profile-File', resp.headers)
+        self.assertEqual(len([name for name in os.listdir(self.path) if name.endswith('.json')]), 1)
@@ -0,0 +1,86 @@
+from hashlib import sha256
+from io import BytesIO
+import gzip
+import unittest
+from unittest import mock
+
+from .support import make_driver, sample
+
+
+class RawStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver(storage_format='raw', stream_threshold=None)
+        self.user = 'root'
+        self.doc_id = self.driver.doc_create_stream(self.user, self.org_id, BytesIO(sample()))['doc_id']
+
+    def record(self):
+        return self.driver.docs_coll.find_one({'org_id': self.org_id, 'doc_id': self.doc_id})
+
+    def test_stored_bytes(self):
+        record = self.record()
+        self.assertEqual(record['format'], 'raw')
+        self.assertNotIn('data', record)
+        self.assertEqual(gzip.decompress(record['raw']), sample())
+        self.assertEqual(record['size'], len(sample()))
+        self.assertEqual(record['sha256'], sha256(sample()).hexdigest())
+
+    def test_served_unchanged(self):
+        self.assertEqual(self.driver.doc_render_one(self.user, self.org_id, self.doc_id), sample())
+        # Stored gzip container goes as is
+        packed = self.driver.doc_render_one(self.user, self.org_id, self.doc_id, coding='gzip')
+        self.assertEqual(packed, bytes(self.record()['raw']))
+        # Other output methods go through the tree
+        self.assertIn('ПоступлениеТоваров'.encode(),
+                      self.driver.doc_render_one(self.user, self.org_id, self.doc_id, method='html'))
+
+    def test_malformed_rejected(self):
+        result = self.driver.doc_create_stream(self.user, self.org_id, BytesIO(b'<doc><a></doc>'))
+        self.assertEqual(result['result'], 0)
+        self.assertEqual(self.driver.docs_coll.count_documents({'org_id': self.org_id}), 1)
+
+    def test_tree_built_on_demand(self):
+        doc = self.driver.doc_find_one(self.user, self.org_id, self.doc_id)
+        tree = self.driver.doc_tree(self.org_id, doc)
+        self.assertIn('v8msg:Message', tree)
+        # Saved next to original bytes, so built once
+        record = self.record()
+        self.assertIn('data', record)
+        self.assertEqual(gzip.decompress(record['raw']), sample())
+        doc = self.driver.doc_find_one(self.user, self.org_id, self.doc_id)
+        self.assertEqual(self.driver.doc_tree(self.org_id, doc), tree)
+
+    def test_materialize(self):
+        self.driver.doc_create_stream(self.user, self.org_id, BytesIO(b'<doc>2</doc>'))
+        self.assertEqual(self.driver.docs_materialize(batch_size=1), {'result': 1, 'materialized': 2})
+        self.assertEqual(self.driver.docs_coll.count_documents({'data': {'$exists': False}}), 0)
+        self.assertEqual(self.driver.docs_materialize(), {'result': 1, 'materialized': 0})
+        # Bytes are still served as uploaded
+        self.assertEqual(self.driver.doc_render_one(self.user, self.org_id, self.doc_id), sample())
+
+    def test_tree_not_saved_over_update(self):
+        doc = self.driver.doc_find_one(self.user, self.org_id, self.doc_id)
+        self.driver.doc_update_stream(self.user, self.org_id, self.doc_id, BytesIO(b'<doc>2</doc>'))
+        # Tree of replaced content is not saved to updated document
+        self.assertIn('v8msg:Message', self.driver.doc_tree(self.org_id, doc))
+        record = self.record()
+        self.assertEqual(gzip.decompress(record['raw']), b'<doc>2</doc>')
+        self.assertEqual(self.driver.doc_tree(self.org_id, record), {'doc': {'$': '2'}})
+
+    def test_served_without_tree(self):
+        self.driver.docs_materialize()
+        other_id = self.driver.doc_create_one(self.user, self.org_id, '<doc>2</doc>')['doc_id']
+        coll = self.driver.docs_coll
+        with mock.patch.object(coll, 'find_one', side_effect=coll.find_one) as find_one, \
+                mock.patch.object(coll, 'find', side_effect=coll.find) as find:
+            doc = self.driver.doc_find_one(self.user, self.org_id, self.doc_id, with_data=False)
+            self.assertEqual(self.driver.doc_render_one(self.user, self.org_id, self.doc_id, doc=doc), sample())
+            docs = [(doc['doc_id'], b''.join(chunks))
+                    for doc, chunks in self.driver.doc_iter_many(self.user, self.org_id, [other_id, self.doc_id])]
+        self.assertEqual(docs[0], (self.doc_id, sample()))
+        self.assertEqual(docs[1][0], other_id)
+        # Stored tree of raw document is left in database
+        self.assertEqual(find_one.call_args[0][1].get('data'), 0)
+        raw = [call[0][1] for call in find.call_args_list if call[0][0].get('format') == 'raw']
+        self.assertEqual(len(raw), 1)
+        self.assertNotIn('data', raw[0])
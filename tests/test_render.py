@@ -0,0 +1,80 @@
+from io import BytesIO
+import unittest
+
+from .support import AUTH, create_org, load_app, make_driver, sample
+
+
+class RenderCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver(stream_threshold=None)
+        self.user = 'root'
+        self.doc_id = self.driver.doc_create_one(self.user, self.org_id, sample())['doc_id']
+
+    def render(self, **kwargs):
+        doc = self.driver.doc_find_one(self.user, self.org_id, self.doc_id, with_data=False)
+        return self.driver.doc_render_one(self.user, self.org_id, self.doc_id, doc=doc, **kwargs)
+
+    def test_cached(self):
+        xml = self.render()
+        self.assertIn('ПоступлениеТоваров'.encode(), xml)
+        hits = self.driver.render_cache.hits
+        # Metadata is enough, cached bytes are returned
+        self.assertIs(self.render(), xml)
+        self.assertEqual(self.driver.render_cache.hits, hits + 1)
+        self.assertIsNot(self.render(prettify=False), xml)
+
+    def test_etag(self):
+        doc = self.driver.doc_find_one(self.user, self.org_id, self.doc_id, with_data=False)
+        etag = self.driver.doc_etag(self.org_id, doc)
+        self.assertEqual(etag, self.driver.doc_etag(self.org_id, dict(doc)))
+        others = {self.driver.doc_etag(self.org_id, doc, prettify=False),
+                  self.driver.doc_etag(self.org_id, doc, method='html'),
+                  self.driver.doc_etag(self.org_id, doc, coding='gzip')}
+        self.assertNotIn(etag, others)
+        self.assertEqual(len(others), 3)
+
+    def test_discarded(self):
+        self.render()
+        self.assertEqual(len(self.driver.render_cache), 1)
+        result = self.driver.doc_update_stream(self.user, self.org_id, self.doc_id, BytesIO(b'<doc>new</doc>'))
+        self.assertEqual(result['result'], 1)
+        self.assertEqual(len(self.driver.render_cache), 0)
+        self.assertIn(b'<doc>new</doc>', self.render())
+
+        self.driver.doc_remove_one(self.org_id, self.doc_id)
+        self.assertEqual(len(self.driver.render_cache), 0)
+
+
+class ConditionalGetTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        url = '/api/v1.0/docs/' + create_org(cls.app.driver, 'Render')
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+        doc_id = cls.client.post(url, data=sample(), headers=headers).get_json()['doc_id']
+        cls.url = '%s/%d' % (url, doc_id)
+
+    def test_not_modified(self):
+        resp = self.client.get(self.url, headers=AUTH)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp.headers['ETag']
+        self.assertTrue(etag)
+
+        resp = self.client.get(self.url, headers=dict(AUTH, **{'If-None-Match': etag}))
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.get_data(), b'')
+        self.assertEqual(resp.headers['ETag'], etag)
+
+        resp = self.client.get(self.url, headers=dict(AUTH, **{'If-None-Match': '"other"'}))
+        self.assertEqual(resp.status_code, 200)
+
+    def test_etag_per_coding(self):
+        plain = self.client.get(self.url, headers=dict(AUTH, **{'Accept-Encoding': 'identity'}))
+        packed = self.client.get(self.url, headers=dict(AUTH, **{'Accept-Encoding': 'gzip'}))
+        self.assertNotEqual(plain.headers['ETag'], packed.headers['ETag'])
+        resp = self.client.get(self.url, headers=dict(AUTH, **{'Accept-Encoding': 'gzip',
+                                                               'If-None-Match': plain.headers['ETag']}))
+        self.assertEqual(resp.status_code, 200)
@@ -0,0 +1,167 @@
+from io import BytesIO
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from xdb_controller.segments import SegmentStore, SegmentsUnavailable
+
+from .support import AUTH, create_org, load_app, make_driver, sample
+
+
+class SegmentStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.store = SegmentStore(self.path, segment_size=100, fsync=False)
+
+    def test_append_and_read(self):
+        first = self.store.append(b'a' * 60)
+        second = self.store.append(b'b' * 30)
+        # Next segment is started once the active one would grow over segment_size
+        third = self.store.append(bytearray(b'c' * 20))
+        self.assertEqual((first, second, third), ([1, 0, 60], [1, 60, 30], [2, 0, 20]))
+        self.assertEqual(self.store.segments(), {1: 90, 2: 20})
+        self.assertEqual(bytes(self.store.read(second)), b'b' * 30)
+        self.assertIsInstance(self.store.read(third), memoryview)
+        # Payload larger than segment takes one of its own
+        self.assertEqual(self.store.append(b'd' * 500), [3, 0, 500])
+
+    def test_read_grown_segment(self):
+        first = self.store.append(b'a' * 10)
+        view = self.store.read(first)
+        second = self.store.append(b'b' * 10)
+        self.assertEqual(bytes(self.store.read(second)), b'b' * 10)
+        self.assertEqual(bytes(view), b'a' * 10)
+
+    def test_open(self):
+        self.store.append(b'a' * 10)
+        extent = self.store.append(b'0123456789')
+        with self.store.open(extent) as file:
+            self.assertEqual(file.length, 10)
+            self.assertEqual(file.read(4), b'0123')
+            self.assertEqual(file.read(), b'456789')
+            self.assertEqual(file.read(), b'')
+            self.assertIsInstance(file.fileno(), int)
+
+    def test_remove(self):
+        extent = self.store.append(b'a' * 10)
+        view = self.store.read(extent)
+        self.store.remove(1)
+        self.assertEqual(self.store.segments(), {})
+        self.assertEqual(bytes(view), b'a' * 10)
+        # Foreign files are not segments
+        open(os.path.join(self.path, 'seg-1.dat'), 'w').close()
+        self.assertEqual(self.store.segments(), {})
+
+
+class SegmentsDriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.driver, self.org_id = make_driver(storage_format='raw', stream_threshold=None, segments_path=self.path,
+                                               segment_threshold=200, segment_size=3000)
+        self.driver.segments.fsync = False
+        self.user = 'root'
+
+    def create(self, data):
+        return self.driver.doc_create_stream(self.user, self.org_id, BytesIO(data))['doc_id']
+
+    def record(self, doc_id):
+        return self.driver.docs_coll.find_one({'org_id': self.org_id, 'doc_id': doc_id})
+
+    def test_offloaded(self):
+        doc_id, small_id = self.create(sample()), self.create(b'<doc/>')
+        self.assertNotIn('raw', self.record(doc_id))
+        self.assertIn('extent', self.record(doc_id))
+        self.assertNotIn('extent', self.record(small_id))
+        self.assertEqual(self.driver.doc_render_one(self.user, self.org_id, doc_id), sample())
+        self.assertEqual(self.driver.doc_render_one(self.user, self.org_id, small_id), b'<doc/>')
+
+    def test_payload_file(self):
+        doc_id, small_id = self.create(sample()), self.create(b'<doc/>')
+        doc = self.driver.doc_find_one(self.user, self.org_id, doc_id, with_data=False)
+        with self.driver.doc_payload_file(self.org_id, doc) as file:
+            self.assertEqual(gzip.decompress(file.read()), sample())
+        doc = self.driver.doc_find_one(self.user, self.org_id, small_id, with_data=False)
+        self.assertIsNone(self.driver.doc_payload_file(self.org_id, doc))
+
+    def test_dedup_blob(self):
+        self.driver.dedup = True
+        doc_ids = [self.create(sample()) for _ in range(2)]
+        blob = self.driver.blobs_coll.find_one({})
+        self.assertIn('extent', blob)
+        self.assertEqual(self.driver.segments.segments(), {1: blob['extent'][2]})
+        doc = self.driver.doc_find_one(self.user, self.org_id, doc_ids[1], with_data=False)
+        with self.driver.doc_payload_file(self.org_id, doc) as file:
+            self.assertEqual(gzip.decompress(file.read()), sample())
+
+    def test_compact(self):
+        doc_ids = [self.create(sample()) for _ in range(6)]
+        segments = self.driver.segments.segments()
+        self.assertGreater(len(segments), 1)
+        removed = [doc_id for doc_id in doc_ids if self.record(doc_id)['extent'][0] == min(segments)][1:]
+        for doc_id in removed:
+            self.driver.doc_remove_one(self.org_id, doc_id)
+
+        # Segment just written to is kept
+        self.assertEqual(self.driver.segments_compact(min_garbage=0.1)['segments'], 0)
+        result = self.driver.segments_compact(min_garbage=0.1, grace=0)
+        self.assertEqual((result['segments'], result['moved']), (1, 1))
+        self.assertNotIn(min(segments), self.driver.segments.segments())
+        for doc_id in set(doc_ids) - set(removed):
+            self.assertEqual(self.driver.doc_render_one(self.user, self.org_id, doc_id), sample())
+        # Nothing left to compact
+        self.assertEqual(self.driver.segments_compact(min_garbage=0.1, grace=0)['segments'], 0)
+
+    def test_compact_pending_payload(self):
+        # Payload appended, its record not saved yet, and the next segment is started meanwhile
+        extent = self.driver.segments.append(gzip.compress(sample()))
+        self.driver.segments.append(b'0' * 3000)
+        self.assertEqual(sorted(self.driver.segments.segments()), [1, 2])
+        self.assertEqual(self.driver.segments_compact()['segments'], 0)
+        self.assertEqual(gzip.decompress(self.driver.segments.read(extent)), sample())
+
+    def test_unavailable(self):
+        doc_id = self.create(sample())
+        self.driver.segments = None
+        with self.assertRaises(SegmentsUnavailable):
+            self.driver.doc_render_one(self.user, self.org_id, doc_id)
+        self.assertEqual(self.driver.segments_compact()['result'], 0)
+
+
+class SegmentsEndpointTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        cls.url = '/api/v1.0/docs/' + create_org(cls.app.driver, 'Segments')
+
+    def setUp(self):
+        driver = self.app.driver
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        for name, value in (('storage_format', 'raw'), ('segments', SegmentStore(path, fsync=False)),
+                            ('segment_threshold', 0)):
+            self.addCleanup(setattr, driver, name, getattr(driver, name))
+            setattr(driver, name, value)
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+        self.doc_url = '%s/%d' % (self.url, self.client.post(self.url, data=sample(), headers=headers)
+                                  .get_json()['doc_id'])
+
+    def test_sent_from_segment(self):
+        resp = self.client.get(self.doc_url, headers=dict(AUTH, **{'Accept-Encoding': 'gzip'}))
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.content_length, len(resp.get_data()))
+        self.assertEqual(gzip.decompress(resp.get_data()), sample())
+        self.assertEqual(self.client.get(self.doc_url, headers=AUTH).get_data(), sample())
+
+    def test_unavailable(self):
+        self.app.driver.segments = None
+        resp = self.client.get(self.doc_url, headers=AUTH)
+        self.assertEqual(resp.status_code, 500)
+        self.assertEqual(resp.get_json()['result'], 0)
@@ -0,0 +1,95 @@
+import gzip
+import json
+import unittest
+
+from lxml import etree
+
+from xdb_controller import serializer
+from xdb_controller.converter import data
+from xdb_controller.controller import DocumentModel
+
+from .support import AUTH, create_org, load_app, make_driver, sample
+
+
+class SerializerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = json.loads(DocumentModel.xml_to_json(sample()))
+
+    def test_chunks(self):
+        chunks = list(serializer.iter_xml(self.tree, chunk_size=256))
+        self.assertGreater(len(chunks), 4)
+        # Chunk is taken as soon as it is large enough, nothing else is held
+        self.assertLess(max(len(chunk) for chunk in chunks[:-1]), 512)
+        self.assertEqual(data(DocumentModel.parse(b''.join(chunks))), data(DocumentModel.parse(sample())))
+
+    def test_encoding(self):
+        xml = b''.join(serializer.iter_xml(self.tree, encoding='windows-1251', prettify=False))
+        self.assertTrue(xml.startswith(b"<?xml version='1.0' encoding='windows-1251'?>"))
+        self.assertIn('ПоступлениеТоваров'.encode('windows-1251'), xml)
+        self.assertNotIn(b'\n', xml.split(b'?>', 1)[1].strip())
+
+    def test_gunzip(self):
+        chunks = list(serializer.iter_gunzip(gzip.compress(sample()), chunk_size=100))
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        self.assertEqual(b''.join(chunks), sample())
+
+    def test_slices(self):
+        chunks = list(serializer.iter_slices(memoryview(sample()), chunk_size=1000))
+        self.assertEqual([len(chunk) for chunk in chunks[:-1]], [1000] * (len(chunks) - 1))
+        self.assertEqual(b''.join(chunks), sample())
+
+
+class DriverIterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver(stream_threshold=1000)
+        self.user = 'root'
+        self.doc_id = self.driver.doc_create_one(self.user, self.org_id, sample())['doc_id']
+
+    def test_streamed_by_size(self):
+        doc = self.driver.doc_find_one(self.user, self.org_id, self.doc_id, with_data=False)
+        self.assertTrue(self.driver.doc_is_streamed(doc))
+        self.assertFalse(self.driver.doc_is_streamed(doc, method='html'))
+        self.assertFalse(self.driver.doc_is_streamed(dict(doc, size=999)))
+
+    def test_iter(self):
+        chunks = list(self.driver.doc_iter_one(self.user, self.org_id, self.doc_id, chunk_size=512))
+        self.assertGreater(len(chunks), 1)
+        rendered = self.driver.doc_render_one(self.user, self.org_id, self.doc_id)
+        self.assertEqual(data(DocumentModel.parse(b''.join(chunks))), data(DocumentModel.parse(rendered)))
+
+        packed = b''.join(self.driver.doc_iter_one(self.user, self.org_id, self.doc_id, coding='gzip'))
+        self.assertEqual(gzip.decompress(packed), b''.join(chunks))
+
+    def test_missing(self):
+        self.assertIsNone(self.driver.doc_iter_one(self.user, self.org_id, self.doc_id + 1))
+
+
+class StreamedResponseTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        url = '/api/v1.0/docs/' + create_org(cls.app.driver, 'Streaming')
+        headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+        doc_id = cls.client.post(url, data=sample(), headers=headers).get_json()['doc_id']
+        cls.url = '%s/%d' % (url, doc_id)
+
+    def get(self, threshold):
+        driver = self.app.driver
+        self.addCleanup(setattr, driver, 'stream_threshold', driver.stream_threshold)
+        driver.stream_threshold = threshold
+        return self.client.get(self.url, headers=AUTH)
+
+    def test_streamed(self):
+        resp = self.get(1)
+        # Length isn't known before the whole body is made
+        self.assertNotIn('Content-Length', resp.headers)
+        self.assertTrue(resp.headers['ETag'])
+        etree.fromstring(resp.get_data())
+
+    def test_small_rendered_at_once(self):
+        resp = self.get(10 ** 9)
+        self.assertEqual(resp.headers['Content-Length'], str(len(resp.get_data())))
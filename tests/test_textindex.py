@@ -0,0 +1,69 @@
+from io import BytesIO
+import unittest
+
+from xdb_controller import textindex
+
+from .support import make_driver
+
+
+class TextIndexTest(unittest.TestCase):
+
+    def test_tokenize(self):
+        self.assertEqual(textindex.tokenize('Роздріб, ЦЕНА-закупки 2016'), ['роздріб', 'цена', 'закупки', '2016'])
+        self.assertEqual(textindex.tokenize('x' * 65 + ' y'), ['y'])
+
+    def test_positions_encoding(self):
+        positions = [0, 1, 5, 127, 128, 300, 70000]
+        self.assertEqual(textindex.decode(textindex.encode(positions)), positions)
+
+    def test_postings(self):
+        tree = {'a': {'@code': 'Aa', 'b': [{'$': 'aa bb'}, {'$': 'cc'}], '@xmlns': {'$': 'urn:x'}}}
+        # Phrase never spans two text nodes
+        self.assertEqual(textindex.postings(tree), {'aa': [0, 2], 'bb': [3], 'cc': [5]})
+
+    def test_parse_query(self):
+        self.assertEqual(textindex.parse_query('a "B c" OR d'), [[['a'], ['b', 'c']], [['d']]])
+        with self.assertRaises(ValueError):
+            textindex.parse_query('"" OR ,')
+
+    def test_phrase_matches(self):
+        self.assertTrue(textindex.phrase_matches([[1, 7], [8], [9]]))
+        self.assertFalse(textindex.phrase_matches([[1, 7], [3], [9]]))
+
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver(text_index=True)
+        self.user = 'root'
+        self.ids = [self.create(b'<doc><name>Fresh milk</name><note>white bread</note></doc>'),
+                    self.create(b'<doc><name>Bread</name><code>000000001</code></doc>')]
+
+    def create(self, xml):
+        return self.driver.doc_create_stream(self.user, self.org_id, BytesIO(xml))['doc_id']
+
+    def search(self, query):
+        return self.driver.doc_search(self.user, self.org_id, query)['doc_ids']
+
+    def test_queries(self):
+        self.assertEqual(self.search('bread'), self.ids)
+        self.assertEqual(self.search('BREAD milk'), self.ids[:1])
+        self.assertEqual(self.search('"fresh milk"'), self.ids[:1])
+        self.assertEqual(self.search('"milk fresh"'), [])
+        # Phrase never spans two elements
+        self.assertEqual(self.search('"milk white"'), [])
+        self.assertEqual(self.search('000000001 OR milk'), self.ids)
+
+    def test_removed_document(self):
+        self.driver.doc_remove_one(self.org_id, self.ids[0])
+        self.assertEqual(self.search('bread'), self.ids[1:])
+
+    def test_rebuild(self):
+        self.assertEqual(self.driver.docs_index_text()['processed'], 2)
+        self.assertEqual(self.search('bread'), self.ids)
+
+    def test_disabled(self):
+        driver, org_id = make_driver()
+        result = driver.doc_search(self.user, org_id, 'bread')
+        self.assertEqual(result['result'], 0)
+        self.assertIn('disabled', result['error'])
@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from io import BytesIO
+import unittest
+
+from xdb_controller import delta
+
+from .support import AUTH, create_org, load_app, make_driver, sample
+
+
+class DeltaTest(unittest.TestCase):
+
+    def check(self, old, new):
+        changes = delta.diff(old, new)
+        self.assertTrue(delta.same(delta.apply(old, changes), new), changes)
+        return changes
+
+    def test_unchanged(self):
+        tree = {'a': {'$': '1'}, 'b': [{'$': '1'}, {'$': '2'}]}
+        self.assertIsNone(delta.diff(tree, {'a': {'$': '1'}, 'b': [{'$': '1'}, {'$': '2'}]}))
+        self.assertIs(delta.apply(tree, None), tree)
+
+    def test_dict(self):
+        old = OrderedDict([('a', {'$': '1'}), ('b', {'$': '2'}), ('c', {'$': '3'})])
+        self.assertEqual(self.check(old, OrderedDict([('a', {'$': '1'}), ('c', {'$': '4'}), ('d', {'$': '5'})])),
+                         ['d', {'b': ['x'], 'c': ['d', {'$': ['r', '4']}, None], 'd': ['r', {'$': '5'}]}, None])
+        # Element order is part of the document
+        changes = self.check(old, OrderedDict([('c', {'$': '3'}), ('a', {'$': '1'}), ('b', {'$': '2'})]))
+        self.assertEqual(changes, ['d', {}, ['c', 'a', 'b']])
+        self.assertIsInstance(delta.apply(old, changes), OrderedDict)
+
+    def test_list(self):
+        old = [{'$': str(index)} for index in range(10)]
+        changed = old[:4] + [{'$': 'x'}] + old[5:]
+        self.assertEqual(self.check(old, changed), ['i', [[4, ['d', {'$': ['r', 'x']}, None]]]])
+        self.assertEqual(self.check(old, old[:3] + old[4:]), ['s', 3, 4, []])
+        self.assertEqual(self.check(old, old[:2] + [{'$': 'y'}] + old[2:]), ['s', 2, 2, [{'$': 'y'}]])
+        self.check(old, {'$': '0'})
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            delta.apply({}, ['z'])
+
+
+class VersionsTest(unittest.TestCase):
+
+    contents = [b'<doc><a>%d</a><b>same</b>%s</doc>' % (index, b'<c/>' * index) for index in range(1, 8)]
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver(version_snapshot_interval=3)
+        self.user = 'root'
+        self.doc_id = self.driver.doc_create_one(self.user, self.org_id, self.contents[0])['doc_id']
+        for data in self.contents[1:]:
+            result = self.driver.doc_update_stream(self.user, self.org_id, self.doc_id, BytesIO(data))
+            self.assertEqual(result['result'], 1)
+        self.assertEqual(result['version'], len(self.contents))
+
+    def tree(self, data):
+        doc_id = self.driver.doc_create_one(self.user, self.org_id, data)['doc_id']
+        return self.driver.doc_tree(self.org_id, self.driver.doc_find_one(self.user, self.org_id, doc_id))
+
+    def test_every_version(self):
+        for version, data in enumerate(self.contents, 1):
+            tree = self.driver.doc_version_tree(self.user, self.org_id, self.doc_id, version)
+            self.assertTrue(delta.same(tree, self.tree(data)), version)
+        for version in (0, len(self.contents) + 1):
+            self.assertIsNone(self.driver.doc_version_tree(self.user, self.org_id, self.doc_id, version))
+
+    def test_history_records(self):
+        history = list(self.driver.versions_coll.find({'org_id': self.org_id, 'doc_id': self.doc_id}))
+        self.assertEqual(sorted(record['version'] for record in history), list(range(1, len(self.contents))))
+        self.assertEqual(sorted(record['version'] for record in history if 'snapshot' in record), [3, 6])
+
+    def test_missing_history(self):
+        self.driver.versions_coll.delete_one({'org_id': self.org_id, 'doc_id': self.doc_id, 'version': 5})
+        self.assertIsNone(self.driver.doc_version_tree(self.user, self.org_id, self.doc_id, 4))
+        # Snapshot above broken chain is enough
+        self.assertIsNotNone(self.driver.doc_version_tree(self.user, self.org_id, self.doc_id, 2))
+
+    def test_render(self):
+        xml = self.driver.doc_render_version(self.user, self.org_id, self.doc_id, 2)
+        self.assertIn(b'<a>2</a>', xml)
+        self.assertIsNone(self.driver.doc_render_version(self.user, self.org_id, self.doc_id, 100))
+
+    def test_conflict(self):
+        # History of current version already written by concurrent update
+        version = len(self.contents)
+        self.driver.versions_coll.insert_one({'org_id': self.org_id, 'doc_id': self.doc_id, 'version': version})
+        result = self.driver.doc_update_stream(self.user, self.org_id, self.doc_id, BytesIO(b'<doc/>'))
+        self.assertEqual(result, {'result': 0, 'error': 'Document was changed meanwhile.', 'conflict': True})
+        self.assertIn(b'<a>7</a>', self.driver.doc_render_one(self.user, self.org_id, self.doc_id))
+
+    def test_unknown_document(self):
+        result = self.driver.doc_update_stream(self.user, self.org_id, 100, BytesIO(b'<doc/>'))
+        self.assertEqual(result['result'], 0)
+        result = self.driver.doc_update_stream(self.user, self.org_id, self.doc_id, BytesIO(b'<doc>'))
+        self.assertEqual(result['result'], 0)
+
+
+class VersionsEndpointTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+        cls.client = cls.app.app.test_client()
+        cls.url = '/api/v1.0/docs/' + create_org(cls.app.driver, 'Versions')
+        cls.headers = dict(AUTH, **{'Content-Type': 'application/xml', 'Accept-Charset': 'utf-8'})
+
+    def test_update(self):
+        doc_id = self.client.post(self.url, data=sample(), headers=self.headers).get_json()['doc_id']
+        url = '%s/%d' % (self.url, doc_id)
+        resp = self.client.put(url, data=b'<doc>new</doc>', headers=self.headers)
+        self.assertEqual(resp.get_json(), {'result': 1, 'doc_id': doc_id, 'version': 2})
+
+        self.assertIn(b'<doc>new</doc>', self.client.get(url, headers=AUTH).get_data())
+        resp = self.client.get(url, query_string={'version': 1}, headers=AUTH)
+        self.assertIn('ПоступлениеТоваров'.encode(), resp.get_data())
+        headers = dict(AUTH, **{'If-None-Match': resp.get_etag()[0]})
+        resp = self.client.get(url, query_string={'version': 1}, headers=headers)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(self.client.get(url, query_string={'version': 5}, headers=AUTH).status_code, 404)
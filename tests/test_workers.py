@@ -0,0 +1,110 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from xdb_controller import workers
+from xdb_controller.ingest import IngestLimitError
+from xdb_controller.workers import ConversionService, ConversionError, ServiceBusy
+
+from .support import make_driver, sample
+
+
+def crash_once(path):
+    # Pool process dies the first time, as if killed for memory
+    if not os.path.exists(path):
+        open(path, 'w').close()
+        os._exit(1)
+    return os.getpid()
+
+
+class ConversionServiceTest(unittest.TestCase):
+
+    def test_inline(self):
+        service = ConversionService(threshold=100)
+        self.assertFalse(service.enabled)
+        self.assertFalse(service.offloaded(10 ** 9))
+        self.assertEqual(service.run(10 ** 9, threading.get_ident), threading.get_ident())
+
+        service = ConversionService(max_workers=2, threshold=100)
+        self.assertFalse(service.offloaded(99))
+        self.assertFalse(service.offloaded(None))
+        self.assertTrue(service.offloaded(100))
+        self.assertEqual(service.run(99, os.getpid), os.getpid())
+
+    def test_busy(self):
+        service = ConversionService(max_workers=1, threshold=0, max_pending=1)
+        started, release = threading.Event(), threading.Event()
+
+        def convert():
+            started.set()
+            return release.wait(10)
+
+        # Threads stand in for processes, so the slot is held as long as test wants
+        with ThreadPoolExecutor(2) as executor, \
+                mock.patch.object(service, '_ConversionService__get_executor', return_value=executor):
+            pending = executor.submit(service.run, 1, convert)
+            started.wait(10)
+            with self.assertRaises(ServiceBusy):
+                service.run(1, abs, -1)
+            release.set()
+            self.assertTrue(pending.result())
+            self.assertEqual(service.run(1, abs, -1), 1)
+
+    def test_process_pool(self):
+        service = ConversionService(max_workers=1, threshold=0)
+        self.addCleanup(service.shutdown)
+        self.assertNotEqual(service.run(1, os.getpid), os.getpid())
+
+        doc = service.run(len(sample()), workers.build_document, sample(), 'utf-8', 'json')
+        self.assertIn('v8msg:Message', doc.data)
+        xml = service.run(len(doc.data), workers.render_document, doc.data, 'json', 'xml', 'utf-8', False)
+        self.assertIn('ПоступлениеТоваров'.encode(), xml)
+        # Parser errors come back as ConversionError
+        with self.assertRaises(ConversionError):
+            service.run(1, workers.build_document, '<doc>', 'utf-8', 'json')
+
+    def test_broken_pool(self):
+        service = ConversionService(max_workers=1, threshold=0)
+        self.addCleanup(service.shutdown)
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(path)
+        self.addCleanup(os.remove, path)
+        pid = service.run(1, crash_once, path)
+        self.assertNotEqual(pid, os.getpid())
+        self.assertEqual(service.run(1, crash_once, path), pid)
+
+    def test_spool(self):
+        path = workers.spool(BytesIO(sample()), max_size=len(sample()))
+        self.addCleanup(os.remove, path)
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), sample())
+
+        with mock.patch.object(workers.os, 'remove', side_effect=os.remove) as remove:
+            with self.assertRaises(IngestLimitError):
+                workers.spool(BytesIO(sample()), max_size=100, chunk_size=64)
+        self.assertFalse(os.path.exists(remove.call_args[0][0]))
+
+
+class OffloadedDriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver, self.org_id = make_driver(conversion_workers=1, conversion_threshold=0, stream_threshold=None)
+        self.addCleanup(self.driver.conversions.shutdown)
+        self.user = 'root'
+
+    def test_create_and_render(self):
+        doc_id = self.driver.doc_create_one(self.user, self.org_id, sample())['doc_id']
+        stream_id = self.driver.doc_create_stream(self.user, self.org_id, BytesIO(sample()),
+                                                  size=len(sample()))['doc_id']
+        self.assertEqual(self.driver.doc_render_one(self.user, self.org_id, doc_id),
+                         self.driver.doc_render_one(self.user, self.org_id, stream_id))
+
+    def test_corrupted(self):
+        for result in (self.driver.doc_create_one(self.user, self.org_id, '<doc>'),
+                       self.driver.doc_create_stream(self.user, self.org_id, BytesIO(b'<doc>'), size=5)):
+            self.assertEqual(result, {'result': 0, 'error': 'Document data corrupted. Unable to parse.'})
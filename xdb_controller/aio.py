@@ -0,0 +1,416 @@
+'''
+Asyncio variant of Driver for asyncio based servers (see app_async.py).
+
+AsyncDriver works with any database giving motor-like interface (coroutine methods of collections):
+motor itself or AsyncDatabase wrapping synchronous pymongo-like database (e.g. an in-memory
+stand-in for tests) with calls run in threads. Records, IDs, caches and history are built by the same
+helpers as Driver uses (storage, allocator, cache, analytics modules), so both drivers share one database.
+'''
+import asyncio
+from functools import partial
+import gzip
+
+import pymongo.errors as db_errors
+from bson.son import SON
+from bson.codec_options import CodecOptions
+
+from .allocator import AsyncDocIdAllocator
+from .cache import LRUCache, AuthCache
+from . import analytics
+from . import serializer
+from . import paths
+from . import storage
+from .segments import SegmentStore
+from .controller import DocumentModel, UserModel, ParseError, render_key, render_etag
+
+
+class AsyncCursor:
+    '''
+    Motor-like cursor of synchronous one: results are read by to_list coroutine in executor thread
+    '''
+
+    def __init__(self, cursor, executor=None):
+        self.__cursor = cursor
+        self.__executor = executor
+
+    async def to_list(self, length=None):
+        cursor = self.__cursor if length is None else self.__cursor.limit(length)
+        return await asyncio.get_event_loop().run_in_executor(self.__executor, list, cursor)
+
+
+class AsyncCollection:
+    '''
+    Gives coroutine methods of synchronous collection, calls run in executor threads
+    '''
+
+    def __init__(self, collection, executor=None):
+        self.__collection = collection
+        self.__executor = executor
+
+    def find(self, *args, **kwargs):
+        # As in motor, find is not a coroutine; lazy cursor does no I/O until read
+        return AsyncCursor(self.__collection.find(*args, **kwargs), self.__executor)
+
+    def __getattr__(self, name):
+        method = getattr(self.__collection, name)
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.__executor, partial(method, *args, **kwargs))
+        return call
+
+
+class AsyncDatabase:
+
+    def __init__(self, db, executor=None):
+        self.__db = db
+        self.__executor = executor
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.__db[name], self.__executor)
+
+    def get_collection(self, name, **kwargs):
+        return AsyncCollection(self.__db.get_collection(name, **kwargs), self.__executor)
+
+
+class AsyncDriver:
+
+    def __init__(self, db, collection_name='organizations', docs_collection_name='documents',
+                 keys_collection_name='doc_keys', terms_collection_name='doc_terms', blobs_collection_name='blobs',
+                 versions_collection_name='doc_versions', storage_format='json',
+                 doc_id_block_size=1, text_index=False, auth_cache_size=4096, auth_cache_ttl=300,
+                 render_cache_size=64 * 1024 * 1024, max_doc_size=None, max_doc_depth=None,
+                 stream_threshold=1024 * 1024, conversion_threshold=256 * 1024, aggregate_cache_size=65536,
+                 dedup=False, version_snapshot_interval=10, segments_path=None, segment_threshold=1024 * 1024,
+                 segment_size=256 * 1024 * 1024):
+        # Same meaning of arguments as in Driver
+        assert storage_format in DocumentModel.STORAGE_FORMATS, \
+            'storage_format should be one of %s' % str(DocumentModel.STORAGE_FORMATS)
+        self.db = db
+        self.orgs = db[collection_name]
+        self.users = db['users']
+        # SON keeps stored documents keys order when decoding
+        self.docs = db.get_collection(docs_collection_name, codec_options=CodecOptions(document_class=SON))
+        self.keys = db[keys_collection_name]
+        self.terms = db[terms_collection_name]
+        self.versions = db[versions_collection_name]
+        self.blobs = db.get_collection(blobs_collection_name, codec_options=CodecOptions(document_class=SON))
+        self.blob_stats = db[blobs_collection_name + '_stats']
+        self.segments = SegmentStore(segments_path, segment_size) if segments_path else None
+        self.segment_threshold = segment_threshold
+        self.text_index = text_index
+        self.dedup = dedup
+        self.version_snapshot_interval = version_snapshot_interval
+
+        self.storage_format = storage_format
+        self.doc_ids = AsyncDocIdAllocator(self.orgs, doc_id_block_size)
+        self.max_doc_size = max_doc_size
+        self.max_doc_depth = max_doc_depth
+        self.stream_threshold = stream_threshold
+        # CPU-bound conversions of larger data go to executor threads, not to run in event loop
+        self.conversion_threshold = conversion_threshold
+
+        self.auth_cache = AuthCache(auth_cache_size, ttl=auth_cache_ttl)
+        self.render_cache = LRUCache(render_cache_size, sizeof=len)
+        self.rules_cache = LRUCache(auth_cache_size, ttl=auth_cache_ttl)
+        self.aggregate_cache = LRUCache(aggregate_cache_size)
+
+    @classmethod
+    def connect_motor(cls, db_name, host='localhost', port=27017, **kwargs):
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient('{}:{}'.format(host, port))
+        return cls(client[db_name], **kwargs)
+
+    async def init(self):
+        collections = {'docs': self.docs, 'keys': self.keys, 'terms': self.terms, 'versions': self.versions}
+        for name, keys, unique in storage.INDEXES:
+            await collections[name].create_index(keys, unique=unique)
+
+    async def user_check_password(self, user):
+        assert isinstance(user, UserModel), 'user should be created via UserModel instance'
+
+        if self.auth_cache.password_valid(user):
+            return True
+        cur = await self.users.find_one({'login': {'$eq': user.login}, 'password': {'$eq': user.password}},
+                                        {'login': 1, '_id': 0})
+        if cur:
+            self.auth_cache.password_verified(user)
+            return True
+        return False
+
+    async def org_check_user(self, org_id, login):
+        if self.auth_cache.is_member(login, org_id):
+            return True
+
+        cur = await self.orgs.find_one({'org_id': org_id, 'users': login}, {'_id': 1})
+        if cur:
+            self.auth_cache.member_verified(login, org_id)
+            return True
+        return False
+
+    async def authorize(self, user, org_id):
+        # Both lookups are independent, so they go concurrently; returns (password valid, org member)
+        return tuple(await asyncio.gather(self.user_check_password(user), self.org_check_user(org_id, user.login)))
+
+    async def org_get_info(self, org_id):
+        return await self.orgs.find_one({'org_id': org_id}, {'users': 0, 'docs': 0, '_id': 0})
+
+    async def org_key_rules(self, org_id):
+        # Same as Driver.org_key_rules
+        rules = self.rules_cache.get(org_id)
+        if rules is None:
+            org = await self.orgs.find_one({'org_id': org_id}, {'key_rules': 1, '_id': 0})
+            rules = [(rule['name'], paths.parse_path(rule['path'])) for rule in (org or {}).get('key_rules', [])]
+            self.rules_cache.set(org_id, rules)
+        return rules
+
+    async def __run(self, size, func, *args):
+        # Conversion of larger data goes to executor thread
+        if (size or 0) >= self.conversion_threshold:
+            return await asyncio.get_event_loop().run_in_executor(None, partial(func, *args))
+        return func(*args)
+
+    async def __doc_parse_stream(self, org_id, stream, encoding, size, chunk_size, keep_tree=False):
+        # Builds document from XML read from asyncio stream, the same way Driver does from file-like one
+        doc = DocumentModel(encoding=encoding, storage_format=self.storage_format,
+                            key_rules=await self.org_key_rules(org_id), text_index=self.text_index)
+        ingest = doc.stream_ingest(self.max_doc_size, self.max_doc_depth, keep_tree)
+        while True:
+            chunk = await stream.read(chunk_size)
+            if not chunk:
+                break
+            await self.__run(size, ingest.feed, chunk)
+        await self.__run(size, ingest.close)
+        await self.__run(size, doc.take_ingest, ingest, keep_tree)
+        return doc
+
+    async def doc_create_stream(self, org_id, stream, encoding='utf-8', size=None, chunk_size=64 * 1024):
+        '''
+        Parses XML read from asyncio stream (with read(n) coroutine) and saves document.
+        Raises IngestLimitError if document exceeds configured size or depth limits.
+        '''
+        try:
+            doc = await self.__doc_parse_stream(org_id, stream, encoding, size, chunk_size)
+        except ParseError:
+            return {'result': 0, 'error': 'Document data corrupted. Unable to parse.'}
+
+        doc_id = await self.doc_ids.allocate(org_id)
+        if doc_id is None:
+            return {'result': 0}
+        doc.doc_id = doc_id
+
+        record = doc.to_dict()
+        record['org_id'] = org_id
+        await self.__steps(storage.payload_store(org_id, [record], self.dedup, self.segments, self.segment_threshold))
+        try:
+            result = await self.docs.insert_one(record)
+        except db_errors.WriteError:
+            await self.__steps(storage.blobs_unref(org_id, [record]))
+            raise
+        if result.inserted_id:
+            await self.__index_insert(org_id, doc)
+            return {'result': 1, 'doc_id': doc_id}
+        await self.__steps(storage.blobs_unref(org_id, [record]))
+        return {'result': 0}
+
+    async def doc_update_stream(self, org_id, doc_id, stream, encoding='utf-8', size=None, chunk_size=64 * 1024):
+        '''
+        Same as Driver.doc_update_stream: replaces document content keeping previous version in history.
+        Returns result 0 with "conflict" if document was changed meanwhile.
+        '''
+        current = await self.doc_find_one(org_id, doc_id)
+        if not current:
+            return {'result': 0, 'error': 'No document with ID %s found.' % doc_id}
+        try:
+            doc = await self.__doc_parse_stream(org_id, stream, encoding, size, chunk_size, keep_tree=True)
+        except ParseError:
+            return {'result': 0, 'error': 'Document data corrupted. Unable to parse.'}
+
+        version = current.get('version', 1)
+        old_tree = await self.doc_tree(org_id, current)
+        history = await self.__run(max(size or 0, current.get('size') or 0), storage.history_record, org_id,
+                                   current, old_tree, doc.tree, self.version_snapshot_interval)
+        doc.doc_id = doc_id
+        record = doc.to_dict()
+        record['version'] = version + 1
+        if not await self.__steps(storage.doc_replace(org_id, current, record, history, self.dedup, self.segments,
+                                                      self.segment_threshold)):
+            return {'result': 0, 'error': 'Document was changed meanwhile.', 'conflict': True}
+
+        self.__discard_cached(org_id, doc_id)
+        await self.__index_insert(org_id, doc)
+        return {'result': 1, 'doc_id': doc_id, 'version': version + 1}
+
+    async def __index_insert(self, org_id, doc):
+        # Saves business keys and full-text postings found while parsing
+        if doc.keys:
+            await self.keys.insert_many(storage.key_records(org_id, doc.doc_id, doc.keys), ordered=False)
+        if doc.terms:
+            await self.terms.insert_many(storage.term_records(org_id, doc.doc_id, doc.terms), ordered=False)
+
+    async def doc_find_one(self, org_id, doc_id, with_data=True):
+        specified_fields = {'_id': 0, 'org_id': 0}
+        if not with_data:
+            specified_fields['data'] = 0
+            specified_fields['raw'] = 0
+        doc = await self.docs.find_one(storage.doc_filter(org_id, doc_id), specified_fields)
+        if doc and with_data:
+            await self.__attach_blobs([doc])
+        return doc
+
+    async def __attach_blobs(self, docs):
+        # Same as Driver: payloads of shared blobs and segment files are put into fetched documents
+        blob_ids = {doc['blob'] for doc in docs if storage.needs_blob(doc)}
+        blobs = {}
+        if blob_ids:
+            fields = dict.fromkeys(storage.PAYLOAD_FIELDS, 1)
+            found = await self.blobs.find({'_id': {'$in': list(blob_ids)}}, fields).to_list(None)
+            blobs = {blob['_id']: blob for blob in found}
+        for doc in docs:
+            storage.attach_payload(doc, blobs.get(doc.get('blob')), self.segments)
+        return docs
+
+    async def doc_tree(self, org_id, doc):
+        '''
+        Returns badgerfish tree of fetched document; tree of raw document is saved next to
+        original bytes, as Driver.doc_tree does
+        '''
+        if 'data' in doc:
+            return await self.__run(doc.get('size'), DocumentModel.load_data, doc['data'], doc.get('format', 'json'))
+
+        tree = await self.__run(doc.get('size'), DocumentModel.raw_to_tree, doc['raw'], doc.get('encoding'))
+        update = {'$set': {'data': DocumentModel.escape_keys(tree)}}
+        if 'blob' in doc:
+            await self.blobs.update_one({'_id': doc['blob']}, update)
+        else:
+            await self.docs.update_one(storage.version_filter(org_id, doc), update)
+        return tree
+
+    def doc_is_streamed(self, doc, method='xml'):
+        if method != 'xml' or self.stream_threshold is None or not doc.get('size'):
+            return False
+        if doc.get('format') != 'raw' and serializer.xmlfile is None:
+            return False
+        return doc['size'] >= self.stream_threshold
+
+    def doc_etag(self, org_id, doc, method='xml', prettify=True):
+        return render_etag(render_key(org_id, doc, method, prettify, self.doc_is_streamed(doc, method)))
+
+    async def doc_render_one(self, org_id, doc, method='xml', prettify=True):
+        '''
+        Returns document converted to XML and encoded with document encoding.
+        doc - already fetched document (could be metadata only).
+        '''
+        if doc.get('format') == 'raw' and method == 'xml':
+            if 'raw' not in doc:
+                doc = await self.doc_find_one(org_id, doc['doc_id'])
+                if not doc:
+                    return None
+            return await self.__run(doc.get('size'), gzip.decompress, doc['raw'])
+
+        key = render_key(org_id, doc, method, prettify, self.doc_is_streamed(doc, method))
+        rendered = self.render_cache.get(key)
+        if rendered is not None:
+            return rendered
+
+        if 'data' not in doc and 'raw' not in doc:
+            doc = await self.doc_find_one(org_id, doc['doc_id'])
+            if not doc:
+                return None
+
+        rendered = await self.__run(doc.get('size'), self.__render, doc, method, key[3], prettify)
+        self.render_cache.set(key, rendered)
+        return rendered
+
+    async def doc_iter_one(self, org_id, doc, prettify=True, chunk_size=64 * 1024):
+        # Returns async iterator of XML chunks, None if there is no such document
+        if 'data' not in doc and 'raw' not in doc:
+            doc = await self.doc_find_one(org_id, doc['doc_id'])
+            if not doc:
+                return None
+        return self.__iter_in_executor(self.__iter_chunks(doc, prettify, chunk_size))
+
+    def __iter_chunks(self, doc, prettify, chunk_size):
+        # Tree is loaded when the first chunk is asked for, so in executor thread as well
+        if doc.get('format') == 'raw':
+            yield from serializer.iter_gunzip(doc['raw'], chunk_size)
+            return
+        tree, escaped = self.__stored_tree(doc)
+        yield from serializer.iter_xml(tree, encoding=doc.get('encoding') or 'utf-8', prettify=prettify,
+                                       chunk_size=chunk_size, escaped=escaped)
+
+    async def __iter_in_executor(self, chunks):
+        # Every chunk is made in executor thread, event loop only passes them on
+        loop = asyncio.get_event_loop()
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    async def doc_aggregate(self, org_id, path, aggregate='sum', group_by=None, batch_size=100):
+        '''
+        Same as Driver.doc_aggregate, partial results of document versions are cached the same way
+        '''
+        if analytics.np is None:
+            return {'result': 0, 'error': 'Aggregation requires NumPy.'}
+        try:
+            query = analytics.Aggregation(org_id, path, aggregate, group_by, self.aggregate_cache)
+        except ValueError as err:
+            return {'result': 0, 'error': str(err)}
+
+        for doc in await self.docs.find({'org_id': org_id}, {'_id': 0, 'doc_id': 1, 'last_modified': 1}).to_list(None):
+            query.take_cached(doc)
+
+        doc_ids = list(query.missing)
+        for start in range(0, len(doc_ids), batch_size):
+            batch = await self.docs.find({'org_id': org_id, 'doc_id': {'$in': doc_ids[start:start + batch_size]}},
+                                         storage.BATCH_FIELDS).to_list(None)
+            for doc in await self.__attach_blobs(batch):
+                tree = await self.doc_tree(org_id, doc)
+                await self.__run(doc.get('size'), query.add, doc['doc_id'], tree)
+        return query.result()
+
+    async def doc_remove_one(self, org_id, doc_id):
+        removed = await self.__steps(storage.doc_remove(org_id, doc_id))
+        self.__discard_cached(org_id, doc_id)
+        if removed:
+            return {'result': 1, 'doc_id': doc_id}
+        return {'result': 0}
+
+    def __discard_cached(self, org_id, doc_id):
+        self.render_cache.discard_where(lambda key: key[0] == org_id and key[1] == doc_id)
+        self.aggregate_cache.discard_where(lambda key: key[0] == org_id and key[1] == doc_id)
+
+    async def __steps(self, steps):
+        # Same as Driver.__steps; segment files are written (and fsynced) in executor thread, not in event loop
+        result, error = None, None
+        while True:
+            try:
+                call = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                method = getattr(getattr(self, call.target), call.method)
+                if call.target == 'segments':
+                    result = await asyncio.get_event_loop().run_in_executor(
+                        None, partial(method, *call.args, **call.kwargs))
+                elif call.method == 'find':
+                    result = await method(*call.args, **call.kwargs).to_list(None)
+                else:
+                    result = await method(*call.args, **call.kwargs)
+            except Exception as err:
+                error = err
+
+    def __stored_tree(self, doc):
+        # (tree, escaped) to render, tree stored as BSON is not copied
+        if 'data' in doc:
+            return DocumentModel.stored_tree(doc['data'], doc.get('format', 'json'))
+        return DocumentModel.raw_to_tree(doc['raw'], doc.get('encoding')), False
+
+    def __render(self, doc, method, encoding, prettify):
+        tree, escaped = self.__stored_tree(doc)
+        return DocumentModel.json_to_xml(tree, method=method, encoding=encoding, prettify=prettify,
+                                         escaped=escaped).encode(encoding)
@@ -0,0 +1,91 @@
+from threading import Lock
+from pymongo import ReturnDocument
+
+
+class DocIdAllocator:
+    '''
+    Hands out document IDs of organizations.
+
+    IDs are reserved with a single atomic $inc of organization "doc_count" field,
+    so concurrent uploads never get the same ID. With block_size > 1 every process
+    reserves a whole block at once and serves IDs from it locally until the block
+    runs out. IDs left in a block of a stopped process are never used.
+    '''
+    # find_one_and_update options of reserving request
+    RESERVE_OPTIONS = {'projection': {'doc_count': 1, '_id': 0}, 'return_document': ReturnDocument.AFTER}
+
+    def __init__(self, collection, block_size=1):
+        assert block_size > 0, 'block_size should be positive, not %d' % block_size
+        self.collection = collection
+        self.block_size = block_size
+        # org_id -> [next free ID, last reserved ID]
+        self.__blocks = {}
+        self.__lock = Lock()
+
+    def reserve(self, org_id, count=1):
+        # Returns first ID of reserved contiguous range or None if no such organization
+        cur = self.collection.find_one_and_update({'org_id': org_id}, {'$inc': {'doc_count': count}},
+                                                  **self.RESERVE_OPTIONS)
+        return self._first_reserved(cur, count)
+
+    def allocate(self, org_id, count=1):
+        # Returns first ID of `count` contiguous IDs; takes them from local block if possible
+        first_id = self._take(org_id, count)
+        if first_id is not None:
+            return first_id
+        reserve = self._reserve_size(count)
+        first_id = self.reserve(org_id, reserve)
+        self._keep(org_id, first_id, count, reserve)
+        return first_id
+
+    def discard(self, org_id=None):
+        with self.__lock:
+            if org_id is None:
+                self.__blocks.clear()
+            else:
+                self.__blocks.pop(org_id, None)
+
+    @staticmethod
+    def _first_reserved(cur, count):
+        if not cur:
+            return None
+        return cur['doc_count'] - count + 1
+
+    def _take(self, org_id, count):
+        # First of `count` IDs of local block, None if block has not that many
+        with self.__lock:
+            block = self.__blocks.get(org_id)
+            if block and block[1] - block[0] + 1 >= count:
+                first_id = block[0]
+                block[0] += count
+                return first_id
+        return None
+
+    def _reserve_size(self, count):
+        return max(count, self.block_size)
+
+    def _keep(self, org_id, first_id, count, reserved):
+        # Rest of just reserved range becomes local block
+        if first_id is not None and reserved > count:
+            with self.__lock:
+                self.__blocks[org_id] = [first_id + count, first_id + reserved - 1]
+
+
+class AsyncDocIdAllocator(DocIdAllocator):
+    '''
+    Same allocator for collections with coroutine methods (see aio module)
+    '''
+
+    async def reserve(self, org_id, count=1):
+        cur = await self.collection.find_one_and_update({'org_id': org_id}, {'$inc': {'doc_count': count}},
+                                                        **self.RESERVE_OPTIONS)
+        return self._first_reserved(cur, count)
+
+    async def allocate(self, org_id, count=1):
+        first_id = self._take(org_id, count)
+        if first_id is not None:
+            return first_id
+        reserve = self._reserve_size(count)
+        first_id = await self.reserve(org_id, reserve)
+        self._keep(org_id, first_id, count, reserve)
+        return first_id
@@ -0,0 +1,146 @@
+'''
+Aggregation of numeric values found by path (see paths module) in document trees.
+
+Group key path is relative to element containing the value element or attribute
+(e.g. Номенклатура for Row/Сумма).
+
+Every document is reduced to partial result (per group: values count, numeric values count, sum, min, max)
+with NumPy; partials of many documents merge the same way, so they can be cached per document.
+'''
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .paths import parse_path, select
+
+AGGREGATES = ('sum', 'min', 'max', 'count', 'mean')
+PARTIAL_FIELDS = ('count', 'numeric', 'sum', 'min', 'max')
+
+
+def extract(tree, path, group_by=None):
+    '''
+    Returns (values, keys) lists of document tree; keys are empty strings if no grouping requested
+    '''
+    values, keys = [], []
+    for value, holder in select(tree, path):
+        values.append(value)
+        if group_by is None:
+            keys.append('')
+        else:
+            found = select(holder, group_by)
+            keys.append((found[0][0] or '') if found else '')
+    return values, keys
+
+
+def to_floats(values):
+    # Bulk conversion; only data with non numeric values goes element by element
+    strings = ['nan' if value is None else value for value in values]
+    try:
+        return np.array(strings, dtype=np.float64)
+    except ValueError:
+        return np.array([_to_float(value) for value in strings], dtype=np.float64)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def partial(values, keys):
+    '''
+    Reduces extracted values to partial result
+    '''
+    numbers = to_floats(values)
+    numeric = ~np.isnan(numbers)
+    return reduce(np.array(keys, dtype=str), np.ones(len(numbers)), numeric.astype(np.float64),
+                  np.where(numeric, numbers, 0.0), np.where(numeric, numbers, np.inf),
+                  np.where(numeric, numbers, -np.inf))
+
+
+def merge(partials):
+    partials = list(partials)
+    if not partials:
+        return reduce(np.array([], dtype=str), *(np.array([]) for field in PARTIAL_FIELDS))
+    return reduce(np.concatenate([part['keys'] for part in partials]),
+                  *(np.concatenate([part[field] for part in partials]) for field in PARTIAL_FIELDS))
+
+
+def reduce(keys, count, numeric, sums, mins, maxs):
+    groups, index = np.unique(keys, return_inverse=True)
+    size = len(groups)
+    result = {'keys': groups,
+              'count': np.bincount(index, weights=count, minlength=size),
+              'numeric': np.bincount(index, weights=numeric, minlength=size),
+              'sum': np.bincount(index, weights=sums, minlength=size),
+              'min': np.full(size, np.inf),
+              'max': np.full(size, -np.inf)}
+    np.minimum.at(result['min'], index, mins)
+    np.maximum.at(result['max'], index, maxs)
+    return result
+
+
+def finish(merged, aggregate):
+    '''
+    Returns list of aggregate values per group (None if group has no numeric values)
+    '''
+    numeric = merged['numeric']
+    if aggregate == 'count':
+        return merged['count'].astype(np.int64).tolist()
+    if aggregate == 'mean':
+        values = merged['sum'] / np.where(numeric > 0, numeric, 1)
+    else:
+        values = merged[aggregate]
+    return [value if count else None for value, count in zip(values.tolist(), numeric.tolist())]
+
+
+class Aggregation:
+    '''
+    One aggregation query over organization documents, run by driver in three steps:
+        take_cached(doc) for metadata (doc_id, last_modified) of every document,
+        add(doc_id, tree) for every document of `missing`,
+        result().
+    Partial result of every document version is kept in cache (LRUCache), so only new or changed
+    documents are read. Raises ValueError on unknown aggregate or wrong path.
+    '''
+
+    def __init__(self, org_id, path, aggregate='sum', group_by=None, cache=None):
+        if aggregate not in AGGREGATES:
+            raise ValueError('aggregate should be one of %s.' % ', '.join(AGGREGATES))
+        self.parsed_path = parse_path(path)
+        self.parsed_group_by = parse_path(group_by, relative=True) if group_by else None
+        self.org_id = org_id
+        self.path = path
+        self.aggregate = aggregate
+        self.group_by = group_by
+        self.cache = cache
+        self.partials = []
+        # doc_id -> cache key of documents to read
+        self.missing = {}
+
+    def take_cached(self, doc):
+        key = (self.org_id, doc['doc_id'], doc.get('last_modified'), self.path, self.group_by)
+        part = self.cache.get(key) if self.cache is not None else None
+        if part is None:
+            self.missing[doc['doc_id']] = key
+        else:
+            self.partials.append(part)
+
+    def add(self, doc_id, tree):
+        values, keys = extract(tree, self.parsed_path, self.parsed_group_by)
+        part = partial(values, keys)
+        if self.cache is not None:
+            self.cache.set(self.missing[doc_id], part)
+        self.partials.append(part)
+
+    def result(self):
+        merged = merge(self.partials)
+        values = finish(merged, self.aggregate)
+        output = {'result': 1, 'docs': len(self.partials), 'read': len(self.missing)}
+        if self.group_by:
+            output['groups'] = dict(zip(merged['keys'].tolist(), values))
+        else:
+            output['value'] = values[0] if values else None
+        return output
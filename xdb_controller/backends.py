@@ -0,0 +1,1030 @@
+'''
+Storage backends of Driver besides MongoDB.
+
+Backend is a callable returning database by name, the same way DBConnection does for MongoDB.
+Database gives collections by name (db[name], db.get_collection(name, codec_options=...)) and
+collections give the part of pymongo Collection API Driver uses:
+    insert_one, insert_many, find (cursor with sort/skip/limit/batch_size), find_one,
+    find_one_and_update, find_one_and_delete, update_one, update_many, replace_one,
+    delete_one, delete_many, bulk_write (InsertOne/UpdateOne/UpdateMany/ReplaceOne/DeleteOne/DeleteMany),
+    count_documents, create_index.
+Queries: equality (array fields match by element), $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $exists,
+$or, $and, dotted paths. Updates: $set, $unset, $inc, $setOnInsert, $push, $pull, $addToSet.
+Projections: inclusion or exclusion of top level fields, $slice.
+Errors and results are pymongo ones (DuplicateKeyError, BulkWriteError, UpdateResult...).
+
+MemoryBackend keeps records in process memory with hash indexes - fast and deterministic
+stand-in for tests and benchmarks. SQLiteBackend keeps records in SQLite file (one table per
+collection, records as BSON, index fields in indexed columns) for single node sites.
+'''
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from itertools import count, product
+from threading import RLock
+import os
+import sqlite3
+
+from bson import BSON, ObjectId
+from bson.codec_options import CodecOptions
+from bson.son import SON
+from pymongo import ReturnDocument, InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from pymongo.results import (InsertOneResult, InsertManyResult, UpdateResult, DeleteResult,
+                             BulkWriteResult)
+
+RANGE_OPERATORS = {'$gt': lambda a, b: a > b, '$gte': lambda a, b: a >= b,
+                   '$lt': lambda a, b: a < b, '$lte': lambda a, b: a <= b}
+
+
+# Query language
+
+def _rank(value):
+    # BSON types comparison order; values of different ranks never match range operators
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _equal(a, b):
+    if isinstance(a, bool) != isinstance(b, bool):
+        return False
+    if isinstance(a, dict) and isinstance(b, dict):
+        return list(a) == list(b) and all(_equal(value, b[key]) for key, value in a.items())
+    return a == b
+
+
+def _values(doc, path):
+    # Values found by dotted path; arrays on the way are looked through
+    current = [doc]
+    for part in path.split('.'):
+        found = []
+        for value in current:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit():
+                    if int(part) < len(value):
+                        found.append(value[int(part)])
+                else:
+                    found.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+        current = found
+    return current
+
+
+def _expand(values):
+    # Array field matches both as a whole and by its elements
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+
+def _is_operators(condition):
+    return isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition)
+
+
+def _match_condition(values, condition):
+    if not _is_operators(condition):
+        if condition is None:
+            return not values or any(value is None for value in _expand(values))
+        return any(_equal(value, condition) for value in _expand(values))
+
+    for operator, operand in condition.items():
+        if operator == '$eq':
+            matched = _match_condition(values, {'$in': [operand]})
+        elif operator == '$ne':
+            matched = not _match_condition(values, {'$in': [operand]})
+        elif operator == '$in':
+            matched = any(_match_condition(values, item) for item in operand)
+        elif operator == '$nin':
+            matched = not any(_match_condition(values, item) for item in operand)
+        elif operator == '$exists':
+            matched = bool(values) == bool(operand)
+        elif operator in RANGE_OPERATORS:
+            compare = RANGE_OPERATORS[operator]
+            matched = any(_rank(value) == _rank(operand) and compare(value, operand)
+                          for value in _expand(values) if not isinstance(value, (dict, list)))
+        else:
+            raise ValueError('Unsupported query operator %s' % operator)
+        if not matched:
+            return False
+    return True
+
+
+def match(doc, query):
+    '''
+    True if document satisfies query
+    '''
+    for key, condition in query.items():
+        if key == '$or':
+            matched = any(match(doc, branch) for branch in condition)
+        elif key == '$and':
+            matched = all(match(doc, branch) for branch in condition)
+        elif key.startswith('$'):
+            raise ValueError('Unsupported query operator %s' % key)
+        else:
+            matched = _match_condition(_values(doc, key), condition)
+        if not matched:
+            return False
+    return True
+
+
+def _sort_key(doc, sort):
+    key = []
+    for field, direction in sort:
+        values = _values(doc, field)
+        value = values[0] if values else None
+        if isinstance(value, (dict, list)):
+            value = BSON.encode({'v': value})
+        item = (_rank(value), value if value is not None else 0)
+        key.append(item if direction > 0 else _Reversed(item))
+    return key
+
+
+class _Reversed:
+    # Sort key item ordered backwards
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _sort_spec(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    return [(key, value) for key, value in key_or_list]
+
+
+def project(doc, projection, document_class=dict):
+    if projection is None:
+        return doc
+    if isinstance(projection, (list, tuple)):
+        projection = dict.fromkeys(projection, 1)
+
+    include_id = projection.get('_id', 1)
+    fields = {key: value for key, value in projection.items() if key != '_id'}
+    slices = {key: value['$slice'] for key, value in fields.items() if isinstance(value, dict)}
+    inclusion = any(value for key, value in fields.items() if key not in slices)
+
+    output = document_class()
+    for key, value in doc.items():
+        if key == '_id':
+            keep = include_id
+        elif inclusion:
+            keep = fields.get(key)
+        else:
+            keep = fields.get(key, 1)
+        if not keep:
+            continue
+        if key in slices and isinstance(value, list):
+            size = slices[key]
+            value = value[:size] if size >= 0 else value[size:]
+        output[key] = value
+    return output
+
+
+# Updates
+
+def _parent(doc, path, create):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if isinstance(doc, list) and part.isdigit():
+            doc = doc[int(part)] if int(part) < len(doc) else None
+        elif isinstance(doc, dict):
+            if part not in doc and create:
+                doc[part] = {}
+            doc = doc.get(part)
+        else:
+            doc = None
+        if doc is None:
+            return None, parts[-1]
+    return doc, parts[-1]
+
+
+def _get(doc, path):
+    parent, key = _parent(doc, path, False)
+    if isinstance(parent, dict) and key in parent:
+        return True, parent[key]
+    return False, None
+
+
+def _set(doc, path, value):
+    parent, key = _parent(doc, path, True)
+    if isinstance(parent, list) and key.isdigit():
+        parent[int(key)] = value
+    else:
+        parent[key] = value
+
+
+def apply_update(doc, update, inserting=False):
+    '''
+    Applies update operators to document in place; returns True if document was changed
+    '''
+    changed = False
+    for operator, fields in update.items():
+        for path, operand in fields.items():
+            exists, value = _get(doc, path)
+            if operator == '$set' or (operator == '$setOnInsert' and inserting):
+                if not exists or not _equal(value, operand):
+                    _set(doc, path, operand)
+                    changed = True
+            elif operator == '$setOnInsert':
+                continue
+            elif operator == '$unset':
+                if exists:
+                    parent, key = _parent(doc, path, False)
+                    del parent[key]
+                    changed = True
+            elif operator == '$inc':
+                _set(doc, path, (value if exists else 0) + operand)
+                changed = changed or operand != 0 or not exists
+            elif operator in ('$push', '$addToSet'):
+                items = operand['$each'] if _is_operators(operand) else [operand]
+                current = value if exists else []
+                if operator == '$addToSet':
+                    items = [item for index, item in enumerate(items)
+                             if not any(_equal(item, other) for other in current + items[:index])]
+                if items or not exists:
+                    _set(doc, path, current + list(items))
+                    changed = True
+            elif operator == '$pull':
+                if exists and isinstance(value, list):
+                    kept = [item for item in value if not _pull_matches(item, operand)]
+                    if len(kept) != len(value):
+                        _set(doc, path, kept)
+                        changed = True
+            else:
+                raise ValueError('Unsupported update operator %s' % operator)
+    return changed
+
+
+def _pull_matches(item, condition):
+    if isinstance(condition, dict) and not _is_operators(condition):
+        return isinstance(item, dict) and match(item, condition)
+    return _match_condition([item], condition)
+
+
+def _is_update(document):
+    return bool(document) and all(key.startswith('$') for key in document)
+
+
+def _upsert_base(query):
+    # New document of upsert starts with equality fields of query
+    doc = SON()
+    for key, condition in query.items():
+        if key.startswith('$') or '.' in key:
+            continue
+        if _is_operators(condition):
+            if '$eq' in condition:
+                doc[key] = condition['$eq']
+        else:
+            doc[key] = condition
+    return doc
+
+
+class Cursor:
+    '''
+    Lazy query result, runs when iterated
+    '''
+
+    def __init__(self, collection, query, projection):
+        self.__collection = collection
+        self.__query = query or {}
+        self.__projection = projection
+        self.__sort = None
+        self.__skip = 0
+        self.__limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        self.__sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, count):
+        self.__skip = count
+        return self
+
+    def limit(self, count):
+        self.__limit = count
+        return self
+
+    def batch_size(self, count):
+        return self
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        collection = self.__collection
+        for key, doc in collection._find(self.__query, self.__sort, self.__skip, self.__limit):
+            yield project(doc, self.__projection, collection.document_class)
+
+
+class BaseCollection:
+    '''
+    pymongo-like collection over storage primitives of a backend:
+        _find(query, sort, skip, limit) - (key, document) pairs of matched records in order
+        _insert(doc) - stores new record, raises DuplicateKeyError
+        _replace(key, doc) - rewrites record, raises DuplicateKeyError
+        _delete(keys)
+        _transaction() - context manager making a series of primitives atomic
+        _create_index(name, fields, unique)
+    Documents given to and got from primitives are never shared with callers.
+    '''
+
+    def __init__(self, name, document_class=dict):
+        self.name = name
+        self.document_class = document_class
+
+    # Reads
+
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, **kwargs):
+        cursor = Cursor(self, filter, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+        for doc in self.find(filter, projection, sort=sort, limit=1):
+            return doc
+        return None
+
+    def count_documents(self, filter, **kwargs):
+        return sum(1 for record in self._find(filter, None, kwargs.get('skip', 0), kwargs.get('limit', 0)))
+
+    def count(self, filter=None):
+        return self.count_documents(filter or {})
+
+    def estimated_document_count(self):
+        return self.count_documents({})
+
+    # Writes
+
+    def insert_one(self, document, **kwargs):
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        with self._transaction():
+            self._insert(document)
+        return InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        inserted, errors = [], []
+        with self._transaction():
+            for index, document in enumerate(documents):
+                if '_id' not in document:
+                    document['_id'] = ObjectId()
+                try:
+                    self._insert(document)
+                except DuplicateKeyError as err:
+                    errors.append({'index': index, 'code': 11000, 'errmsg': str(err), 'op': document})
+                    if ordered:
+                        break
+                    continue
+                inserted.append(document['_id'])
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'writeConcernErrors': [], 'nInserted': len(inserted),
+                                  'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []})
+        return InsertManyResult(inserted, True)
+
+    def update_one(self, filter, update, upsert=False, sort=None, **kwargs):
+        with self._transaction():
+            raw = self._update(filter, update, upsert, multi=False, sort=sort)
+        return UpdateResult(raw, True)
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        with self._transaction():
+            raw = self._update(filter, update, upsert, multi=True)
+        return UpdateResult(raw, True)
+
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        with self._transaction():
+            raw = self._update(filter, replacement, upsert, multi=False)
+        return UpdateResult(raw, True)
+
+    def delete_one(self, filter, **kwargs):
+        with self._transaction():
+            keys = [key for key, doc in self._find(filter, None, 0, 1)]
+            self._delete(keys)
+        return DeleteResult({'n': len(keys)}, True)
+
+    def delete_many(self, filter, **kwargs):
+        with self._transaction():
+            keys = [key for key, doc in self._find(filter, None, 0, 0)]
+            self._delete(keys)
+        return DeleteResult({'n': len(keys)}, True)
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, **kwargs):
+        with self._transaction():
+            found = next(iter(self._find(filter, _sort_spec(sort) if sort else None, 0, 1)), None)
+            if found is None:
+                if not upsert:
+                    return None
+                doc = self._upsert(filter, update)
+                return project(doc, projection, self.document_class) if return_document else None
+            key, doc = found
+            before = BSON.encode(doc).decode(CodecOptions(document_class=SON)) if not return_document else None
+            self.__modify(key, doc, update)
+        return project(doc if return_document else before, projection, self.document_class)
+
+    def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs):
+        with self._transaction():
+            found = next(iter(self._find(filter, _sort_spec(sort) if sort else None, 0, 1)), None)
+            if found is None:
+                return None
+            self._delete([found[0]])
+        return project(found[1], projection, self.document_class)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        result = {'writeErrors': [], 'writeConcernErrors': [], 'nInserted': 0, 'nUpserted': 0, 'nMatched': 0,
+                  'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        with self._transaction():
+            for index, request in enumerate(requests):
+                try:
+                    self.__bulk_request(request, index, result)
+                except DuplicateKeyError as err:
+                    result['writeErrors'].append({'index': index, 'code': 11000, 'errmsg': str(err)})
+                    if ordered:
+                        break
+        if result['writeErrors']:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def __bulk_request(self, request, index, result):
+        # pymongo keeps request parameters in private attributes
+        if isinstance(request, InsertOne):
+            document = request._doc
+            if '_id' not in document:
+                document['_id'] = ObjectId()
+            self._insert(document)
+            result['nInserted'] += 1
+        elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+            raw = self._update(request._filter, request._doc, request._upsert,
+                               multi=isinstance(request, UpdateMany), sort=getattr(request, '_sort', None))
+            if 'upserted' in raw:
+                result['nUpserted'] += 1
+                result['upserted'].append({'index': index, '_id': raw['upserted']})
+            else:
+                result['nMatched'] += raw['n']
+                result['nModified'] += raw['nModified']
+        elif isinstance(request, (DeleteOne, DeleteMany)):
+            limit = 0 if isinstance(request, DeleteMany) else 1
+            keys = [key for key, doc in self._find(request._filter, None, 0, limit)]
+            self._delete(keys)
+            result['nRemoved'] += len(keys)
+        else:
+            raise TypeError('Unsupported bulk write request %r' % request)
+
+    def _update(self, query, update, upsert, multi, sort=None):
+        found = list(self._find(query, _sort_spec(sort) if sort else None, 0, 0 if multi else 1))
+        if not found:
+            if not upsert:
+                return {'n': 0, 'nModified': 0}
+            doc = self._upsert(query, update)
+            return {'n': 1, 'nModified': 0, 'upserted': doc['_id']}
+        modified = sum(1 for key, doc in found if self.__modify(key, doc, update))
+        return {'n': len(found), 'nModified': modified}
+
+    def __modify(self, key, doc, update):
+        if _is_update(update):
+            changed = apply_update(doc, update)
+        else:
+            replacement = SON((k, v) for k, v in update.items() if k != '_id')
+            replacement['_id'] = doc['_id']
+            changed = BSON.encode(replacement) != BSON.encode(doc)
+            doc.clear()
+            doc.update(replacement)
+        if changed:
+            self._replace(key, doc)
+        return changed
+
+    def _upsert(self, query, update):
+        if _is_update(update):
+            doc = _upsert_base(query)
+            apply_update(doc, update, inserting=True)
+        else:
+            doc = SON(update)
+            if '_id' not in doc and '_id' in query and not _is_operators(query['_id']):
+                doc['_id'] = query['_id']
+        if '_id' not in doc:
+            doc['_id'] = ObjectId()
+        self._insert(doc)
+        return doc
+
+    # Indexes
+
+    def create_index(self, keys, unique=False, name=None, **kwargs):
+        fields = [key for key, direction in _sort_spec(keys)]
+        name = name or '_'.join('%s_1' % field for field in fields)
+        self._create_index(name, fields, unique)
+        return name
+
+    def drop(self):
+        with self._transaction():
+            self._delete([key for key, doc in self._find({}, None, 0, 0)])
+
+
+def _copy(doc, document_class=SON):
+    # BSON round trip: independent copy with stored values (e.g. dates in milliseconds)
+    return BSON.encode(doc).decode(CodecOptions(document_class=document_class))
+
+
+def _hashable(value):
+    # Index key of scalar value, None for values which are not indexed
+    if isinstance(value, (dict, list)):
+        return None
+    return (_rank(value), value)
+
+
+def _index_key(doc, fields):
+    # Index keys of document fields values, None if some of them is missing, array or subdocument
+    values = []
+    for field in fields:
+        found = _values(doc, field)
+        value = _hashable(found[0]) if len(found) == 1 else None
+        if value is None:
+            return None
+        values.append(value)
+    return tuple(values)
+
+
+def _equality_keys(condition):
+    # Index keys of values matching query condition, None if it is not (hashable) equality
+    if _is_operators(condition):
+        if list(condition) == ['$in']:
+            values = condition['$in']
+        elif list(condition) == ['$eq']:
+            values = [condition['$eq']]
+        else:
+            return None
+    else:
+        values = [condition]
+    hashed = [_hashable(value) for value in values]
+    if None in hashed or any(value is None for value in values):
+        return None
+    return hashed
+
+
+class MemoryCollection(BaseCollection):
+    '''
+    Records in dict kept in insertion order; every index (and every prefix of compound one)
+    has hash index of its whole key.
+    '''
+
+    def __init__(self, name, lock, document_class=dict):
+        super().__init__(name, document_class)
+        self._lock = lock
+        self._records = {}
+        # Shared with views of other document class
+        self._keys = count()
+        # fields prefix -> {values key: set of record keys}; records with missing, array or subdocument values
+        # are kept aside
+        self._hashed = {('_id',): {}}
+        self._unhashed = {('_id',): set()}
+        # unique index name -> (fields, {values key: record key})
+        self._unique = {'_id_': (['_id'], {})}
+
+    def view(self, document_class):
+        view = MemoryCollection.__new__(MemoryCollection)
+        view.__dict__.update(self.__dict__)
+        view.document_class = document_class
+        return view
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            yield
+
+    def _candidates(self, query):
+        # Record keys narrowed by equality of the longest indexed fields prefix query gives,
+        # None if query gives nothing to narrow by
+        equal = {}
+        for field, condition in query.items():
+            hashed = _equality_keys(condition)
+            if hashed is not None:
+                equal[field] = hashed
+        fields = max((fields for fields in self._hashed if all(field in equal for field in fields)),
+                     key=len, default=None)
+        if fields is None:
+            return None
+        keys = set(self._unhashed[fields])
+        entries = self._hashed[fields]
+        for values in product(*(equal[field] for field in fields)):
+            keys.update(entries.get(values, ()))
+        return keys
+
+    def _find(self, query, sort, skip, limit):
+        query = query or {}
+        with self._lock:
+            keys = self._candidates(query)
+            if keys is None:
+                records = list(self._records.items())
+            else:
+                records = [(key, self._records[key]) for key in sorted(keys)]
+            found = [(key, doc) for key, doc in records if match(doc, query)]
+            if sort:
+                found.sort(key=lambda item: _sort_key(item[1], sort))
+            found = found[skip:skip + limit if limit else None]
+            return [(key, _copy(doc, self.document_class)) for key, doc in found]
+
+    def __unique_keys(self, doc):
+        for name, (fields, entries) in self._unique.items():
+            values = []
+            for field in fields:
+                found = _values(doc, field)
+                values.append(_hashable(found[0] if found else None))
+            yield name, entries, tuple(values)
+
+    def __check_unique(self, doc, key=None):
+        for name, entries, values in self.__unique_keys(doc):
+            if None not in values and entries.get(values, key) != key:
+                raise DuplicateKeyError('E11000 duplicate key error collection: %s index: %s dup key: %r'
+                                        % (self.name, name, values), 11000)
+
+    def __index(self, key, doc, add=True):
+        for fields, entries in self._hashed.items():
+            values = _index_key(doc, fields)
+            if values is None:
+                (self._unhashed[fields].add if add else self._unhashed[fields].discard)(key)
+            elif add:
+                entries.setdefault(values, set()).add(key)
+            else:
+                entries.get(values, set()).discard(key)
+        for name, entries, values in self.__unique_keys(doc):
+            if None in values:
+                continue
+            if add:
+                entries[values] = key
+            elif entries.get(values) == key:
+                del entries[values]
+
+    def _insert(self, doc):
+        with self._lock:
+            doc = _copy(doc)
+            self.__check_unique(doc)
+            key = next(self._keys)
+            self._records[key] = doc
+            self.__index(key, doc)
+
+    def _replace(self, key, doc):
+        with self._lock:
+            doc = _copy(doc)
+            self.__check_unique(doc, key)
+            self.__index(key, self._records[key], add=False)
+            self._records[key] = doc
+            self.__index(key, doc)
+
+    def _delete(self, keys):
+        with self._lock:
+            for key in keys:
+                doc = self._records.pop(key, None)
+                if doc is not None:
+                    self.__index(key, doc, add=False)
+
+    def _create_index(self, name, fields, unique):
+        with self._lock:
+            for size in range(1, len(fields) + 1):
+                prefix = tuple(fields[:size])
+                if prefix not in self._hashed:
+                    self._hashed[prefix] = hashed = {}
+                    self._unhashed[prefix] = unhashed = set()
+                    for key, doc in self._records.items():
+                        values = _index_key(doc, prefix)
+                        if values is None:
+                            unhashed.add(key)
+                        else:
+                            hashed.setdefault(values, set()).add(key)
+            if unique and name not in self._unique:
+                entries = {}
+                self._unique[name] = (fields, entries)
+                for key, doc in self._records.items():
+                    for index_name, index_entries, values in self.__unique_keys(doc):
+                        if index_name == name and None not in values:
+                            if values in entries:
+                                del self._unique[name]
+                                raise DuplicateKeyError('E11000 duplicate key error collection: %s index: %s'
+                                                        % (self.name, name), 11000)
+                            entries[values] = key
+
+
+class MemoryDatabase:
+
+    def __init__(self, name):
+        self.name = name
+        self.__collections = {}
+        self.__lock = RLock()
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def get_collection(self, name, codec_options=None, **kwargs):
+        with self.__lock:
+            collection = self.__collections.get(name)
+            if collection is None:
+                collection = self.__collections[name] = MemoryCollection(name, RLock())
+        if codec_options is not None:
+            return collection.view(codec_options.document_class)
+        return collection
+
+    def list_collection_names(self):
+        return [name for name, collection in self.__collections.items() if collection._records]
+
+
+class MemoryBackend:
+    '''
+    In-process databases, gone with the process
+    '''
+
+    def __init__(self):
+        self.__databases = {}
+
+    def __call__(self, db_name):
+        if db_name not in self.__databases:
+            self.__databases[db_name] = MemoryDatabase(db_name)
+        return self.__databases[db_name]
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def _column(field):
+    return _quote('k_' + field)
+
+
+def _sql_value(value):
+    # Column value keeping order of BSON values of the same type; array/subdocument can't be indexed
+    if value is None or isinstance(value, (str, float)):
+        return value
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return (value - datetime(1970, 1, 1)) // _MILLISECOND
+    if isinstance(value, ObjectId):
+        return value.binary
+    if isinstance(value, bytes):
+        return bytes(value)
+    raise ValueError('Value of type %s can\'t be indexed' % type(value).__name__)
+
+
+_MILLISECOND = datetime(1970, 1, 1, 0, 0, 0, 1000) - datetime(1970, 1, 1)
+
+
+class SQLiteCollection(BaseCollection):
+    '''
+    Table of records (BSON) with column per indexed field; index fields should hold scalar values
+    of one type (booleans aside), as SQLite compares values of different types its own way.
+    Query conditions on indexed fields are run by SQLite, the rest is checked on decoded records.
+    '''
+    BATCH = 256
+
+    def __init__(self, name, database, document_class=dict):
+        super().__init__(name, document_class)
+        self._database = database
+        self._table = _quote(name)
+        with database.lock:
+            database.connection.execute('CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY, doc BLOB NOT NULL, '
+                                        '%s UNIQUE)' % (self._table, _column('_id')))
+            self._fields = [row[1][2:] for row in database.connection.execute('PRAGMA table_info(%s)' % self._table)
+                            if row[1].startswith('k_')]
+
+    def view(self, document_class):
+        view = SQLiteCollection.__new__(SQLiteCollection)
+        view.__dict__.update(self.__dict__)
+        view.document_class = document_class
+        return view
+
+    def _transaction(self):
+        return self._database.transaction()
+
+    def __translate(self, query):
+        # (SQL condition, parameters, exact) of query; exact - SQL alone gives the same records
+        clauses, params, exact = [], [], True
+        for key, condition in query.items():
+            if key in ('$or', '$and'):
+                parts = [self.__translate(branch) for branch in condition]
+                if key == '$or' and any(not sql for sql, branch_params, branch_exact in parts):
+                    exact = False
+                    continue
+                parts = [part for part in parts if part[0]]
+                if parts:
+                    clauses.append('(%s)' % (' OR ' if key == '$or' else ' AND ').join(sql for sql, p, e in parts))
+                    params.extend(param for sql, part_params, e in parts for param in part_params)
+                exact = exact and all(part_exact for sql, p, part_exact in parts)
+                continue
+            if key not in self._fields:
+                exact = False
+                continue
+            operators = condition if _is_operators(condition) else {'$eq': condition}
+            for operator, operand in operators.items():
+                try:
+                    if operator == '$eq' and operand is not None and not isinstance(operand, (dict, list)):
+                        clauses.append('%s = ?' % _column(key))
+                        params.append(_sql_value(operand))
+                        exact = exact and not isinstance(operand, bool)
+                    elif operator == '$in' and operand and all(item is not None and not isinstance(item, (dict, list))
+                                                               for item in operand):
+                        clauses.append('%s IN (%s)' % (_column(key), ','.join('?' * len(operand))))
+                        params.extend(_sql_value(item) for item in operand)
+                    elif operator in RANGE_OPERATORS and operand is not None and not isinstance(operand, (dict, list)):
+                        sql_operator = {'$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}[operator]
+                        clauses.append('%s %s ?' % (_column(key), sql_operator))
+                        params.append(_sql_value(operand))
+                        exact = exact and not isinstance(operand, bool)
+                    else:
+                        exact = False
+                except ValueError:
+                    exact = False
+        return ' AND '.join(clauses), params, exact
+
+    def _find(self, query, sort, skip, limit):
+        query = query or {}
+        where, params, exact = self.__translate(query)
+        sql_sort = sort and all(field in self._fields for field, direction in sort)
+        order = ', '.join('%s %s' % (_column(field), 'ASC' if direction > 0 else 'DESC')
+                          for field, direction in sort) if sql_sort else ''
+        sql = 'SELECT id FROM %s%s ORDER BY %s' % (self._table, ' WHERE ' + where if where else '',
+                                                   order + ', id' if order else 'id')
+        if exact and (sql_sort or not sort) and (skip or limit):
+            sql += ' LIMIT %d OFFSET %d' % (limit or -1, skip)
+            skip = limit = 0
+        database = self._database
+        with database.lock:
+            ids = [row[0] for row in database.connection.execute(sql, params)]
+
+        if sort and not sql_sort:
+            found = [(key, doc) for key, doc in self.__load(ids) if exact or match(doc, query)]
+            found.sort(key=lambda item: _sort_key(item[1], sort))
+            yield from found[skip:skip + limit if limit else None]
+            return
+
+        count = 0
+        for key, doc in self.__load(ids):
+            if not exact and not match(doc, query):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            yield key, doc
+            count += 1
+            if limit and count >= limit:
+                return
+
+    def __load(self, ids):
+        # Records by ID in given order, read in batches; records deleted meanwhile are skipped
+        database = self._database
+        codec = CodecOptions(document_class=self.document_class)
+        for start in range(0, len(ids), self.BATCH):
+            batch = ids[start:start + self.BATCH]
+            with database.lock:
+                rows = dict(database.connection.execute('SELECT id, doc FROM %s WHERE id IN (%s)'
+                                                        % (self._table, ','.join('?' * len(batch))), batch))
+            for key in batch:
+                if key in rows:
+                    yield key, BSON(rows[key]).decode(codec)
+
+    def __row(self, doc):
+        values = []
+        for field in self._fields:
+            found = _values(doc, field)
+            if len(found) > 1 or (found and isinstance(found[0], (dict, list))):
+                raise ValueError('Indexed field %s of %s should hold single scalar value' % (field, self.name))
+            values.append(_sql_value(found[0]) if found else None)
+        return values
+
+    def __execute(self, sql, params):
+        try:
+            return self._database.connection.execute(sql, params)
+        except sqlite3.IntegrityError as err:
+            raise DuplicateKeyError('E11000 duplicate key error collection: %s (%s)' % (self.name, err), 11000)
+
+    def _insert(self, doc):
+        columns = [_column(field) for field in self._fields]
+        self.__execute('INSERT INTO %s (doc, %s) VALUES (?, %s)' % (self._table, ', '.join(columns),
+                                                                   ', '.join('?' * len(columns))),
+                       [BSON.encode(doc)] + self.__row(doc))
+
+    def _replace(self, key, doc):
+        assignments = ', '.join('%s = ?' % _column(field) for field in self._fields)
+        self.__execute('UPDATE %s SET doc = ?, %s WHERE id = ?' % (self._table, assignments),
+                       [BSON.encode(doc)] + self.__row(doc) + [key])
+
+    def _delete(self, keys):
+        for start in range(0, len(keys), self.BATCH):
+            batch = keys[start:start + self.BATCH]
+            self._database.connection.execute('DELETE FROM %s WHERE id IN (%s)'
+                                              % (self._table, ','.join('?' * len(batch))), batch)
+
+    def _create_index(self, name, fields, unique):
+        database = self._database
+        with database.transaction():
+            added = [field for field in fields if field not in self._fields]
+            for field in added:
+                database.connection.execute('ALTER TABLE %s ADD COLUMN %s' % (self._table, _column(field)))
+                self._fields.append(field)
+            if added:
+                for key, doc in self.__load([row[0] for row in database.connection.execute(
+                        'SELECT id FROM %s' % self._table)]):
+                    self._replace(key, doc)
+            self.__execute('CREATE %sINDEX IF NOT EXISTS %s ON %s (%s)'
+                           % ('UNIQUE ' if unique else '', _quote('%s.%s' % (self.name, name)), self._table,
+                              ', '.join(_column(field) for field in fields)), [])
+
+
+class SQLiteDatabase:
+
+    def __init__(self, connection, lock):
+        self.connection = connection
+        self.lock = lock
+        self.__collections = {}
+        self.__depth = 0
+
+    @contextmanager
+    def transaction(self):
+        # Nested transactions join the outer one; IMMEDIATE locks database for other processes at once
+        with self.lock:
+            if self.__depth == 0:
+                self.connection.execute('BEGIN IMMEDIATE')
+            self.__depth += 1
+            try:
+                yield
+            except BaseException:
+                self.__depth -= 1
+                if self.__depth == 0:
+                    self.connection.execute('ROLLBACK')
+                raise
+            self.__depth -= 1
+            if self.__depth == 0:
+                self.connection.execute('COMMIT')
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def get_collection(self, name, codec_options=None, **kwargs):
+        with self.lock:
+            collection = self.__collections.get(name)
+            if collection is None:
+                collection = self.__collections[name] = SQLiteCollection(name, self)
+        if codec_options is not None:
+            return collection.view(codec_options.document_class)
+        return collection
+
+    def list_collection_names(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+
+class SQLiteBackend:
+    '''
+    Databases in SQLite files: database "name" is file name.sqlite3 in given directory
+    (":memory:" - in-memory SQLite databases)
+    '''
+
+    def __init__(self, path='.', timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self.__databases = {}
+        self.__lock = RLock()
+
+    def __call__(self, db_name):
+        with self.__lock:
+            if db_name not in self.__databases:
+                if self.path == ':memory:':
+                    filename = ':memory:'
+                else:
+                    filename = os.path.join(self.path, db_name + '.sqlite3')
+                # Transactions are begun explicitly; connection is shared by threads under lock
+                connection = sqlite3.connect(filename, timeout=self.timeout, isolation_level=None,
+                                             check_same_thread=False)
+                if filename != ':memory:':
+                    connection.execute('PRAGMA journal_mode = WAL')
+                    connection.execute('PRAGMA synchronous = NORMAL')
+                self.__databases[db_name] = SQLiteDatabase(connection, RLock())
+            return self.__databases[db_name]
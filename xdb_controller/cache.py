@@ -0,0 +1,118 @@
+from collections import OrderedDict
+from hashlib import sha256
+import hmac
+import os
+from threading import Lock
+import time
+
+
+class LRUCache:
+    '''
+    Thread-safe LRU cache with optional time-to-live of entries.
+
+    Cache size is measured with `sizeof(value)` (every entry counts as 1 by default),
+    least recently used entries are evicted once size exceeds max_size.
+    Cache is per process: entries changed by other processes live until ttl expires.
+    '''
+
+    def __init__(self, max_size=1024, ttl=None, sizeof=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (expiration time, value size, value)
+        self.__data = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key, default=None):
+        with self.__lock:
+            entry = self.__data.get(key)
+            if entry is not None:
+                if entry[0] is None or entry[0] > time.monotonic():
+                    self.__data.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                self.__remove(key)
+            self.misses += 1
+        return default
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.sizeof else 1
+        # Value that can't fit into the cache at all is not stored
+        if size > self.max_size:
+            return False
+
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.__lock:
+            if key in self.__data:
+                self.__remove(key)
+            self.__data[key] = (expires, size, value)
+            self.size += size
+            while self.size > self.max_size:
+                self.__remove(next(iter(self.__data)))
+        return True
+
+    def discard(self, key):
+        with self.__lock:
+            if key in self.__data:
+                self.__remove(key)
+
+    def discard_where(self, predicate):
+        # Removes all entries which keys satisfy predicate(key)
+        with self.__lock:
+            for key in [key for key in self.__data if predicate(key)]:
+                self.__remove(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+            self.size = 0
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.__data),
+                'size': self.size}
+
+    def __remove(self, key):
+        entry = self.__data.pop(key)
+        self.size -= entry[1]
+
+    def __len__(self):
+        return len(self.__data)
+
+
+class AuthCache(LRUCache):
+    '''
+    Verified credentials and organization memberships; only positive answers are cached.
+    Only keyed digest of verified credentials is kept in memory, key is random per process.
+    '''
+
+    def __init__(self, max_size=4096, ttl=None):
+        super().__init__(max_size, ttl=ttl)
+        self.__key = os.urandom(32)
+
+    def password_valid(self, user):
+        cached = self.get(('password', user.login))
+        return cached is not None and hmac.compare_digest(cached, self.__digest(user))
+
+    def password_verified(self, user):
+        self.set(('password', user.login), self.__digest(user))
+
+    def is_member(self, login, org_id):
+        return bool(self.get(('member', login, org_id)))
+
+    def member_verified(self, login, org_id):
+        self.set(('member', login, org_id), True)
+
+    def forget_member(self, login, org_id):
+        self.discard(('member', login, org_id))
+
+    def forget_user(self, login):
+        self.discard(('password', login))
+        self.discard_where(lambda key: key[0] == 'member' and key[1] == login)
+
+    def __digest(self, user):
+        return hmac.new(self.__key, '{}:{}'.format(user.login, user.password).encode(), sha256).digest()
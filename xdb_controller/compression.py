@@ -0,0 +1,171 @@
+'''
+HTTP content codings: compression of responses and decompression of uploads.
+
+gzip is always available, zstd and br only with zstandard / brotli packages installed.
+Uploads are decompressed as stream, in bounded steps, so highly compressed body (decompression bomb)
+is stopped once its output goes over the limit, never expanded in memory as a whole.
+'''
+import zlib
+from .ingest import IngestLimitError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Response codings in order of preference
+ENCODINGS = tuple(coding for coding, module in (('zstd', zstandard), ('br', brotli), ('gzip', zlib)) if module)
+# Upload codings: those whose decompression step output can be bounded (brotli needs output_buffer_limit)
+DECODINGS = tuple(coding for coding, available in (('gzip', True), ('x-gzip', True), ('deflate', True),
+                                                   ('zstd', zstandard is not None),
+                                                   ('br', hasattr(brotli, 'Decompressor') and
+                                                    hasattr(brotli.Decompressor, 'can_accept_more_data')))
+                  if available)
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+BROTLI_QUALITY = 5
+
+
+class DecodingError(ValueError):
+    pass
+
+
+def _compressor(coding):
+    # Object with compress(data) and flush() methods
+    if coding == 'gzip':
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if coding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    if coding == 'br':
+        return _BrotliCompressor()
+    raise ValueError('Unsupported content coding "%s"' % coding)
+
+
+class _BrotliCompressor:
+
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+def compress(data, coding):
+    compressor = _compressor(coding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def iter_compress(chunks, coding):
+    '''
+    Compresses iterable of bytes chunks as one stream, yielding non-empty compressed chunks
+    '''
+    compressor = _compressor(coding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    data = compressor.flush()
+    if data:
+        yield data
+
+
+class _ZlibDecoder:
+
+    def __init__(self, wbits):
+        self.decompressor = zlib.decompressobj(wbits)
+
+    def needs_input(self):
+        return not self.decompressor.unconsumed_tail
+
+    def decompress(self, data, limit):
+        return self.decompressor.decompress(self.decompressor.unconsumed_tail or data, limit)
+
+    def flush(self):
+        return self.decompressor.flush()
+
+
+class _BrotliDecoder:
+
+    def __init__(self):
+        self.decompressor = brotli.Decompressor()
+
+    def needs_input(self):
+        return self.decompressor.can_accept_more_data()
+
+    def decompress(self, data, limit):
+        return self.decompressor.process(data, output_buffer_limit=limit)
+
+    def flush(self):
+        return b''
+
+
+class DecodedStream:
+    '''
+    File-like object reading decompressed content of compressed stream.
+    Raises IngestLimitError when more than max_size bytes come out, DecodingError on corrupted data.
+    '''
+
+    def __init__(self, stream, coding, max_size=None, chunk_size=64 * 1024):
+        if coding not in DECODINGS:
+            raise ValueError('Unsupported content coding "%s"' % coding)
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.__buffer = b''
+        self.__eof = False
+        self.__stream = stream
+        self.__reader = None
+        self.__decoder = None
+        if coding == 'zstd':
+            # Library reader never gives more than asked for
+            self.__reader = zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+        elif coding == 'br':
+            self.__decoder = _BrotliDecoder()
+        else:
+            # gzip, or zlib container for deflate
+            self.__decoder = _ZlibDecoder(zlib.MAX_WBITS | (32 if coding != 'deflate' else 0))
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = [self.__buffer]
+            self.__buffer = b''
+            while not self.__eof:
+                chunks.append(self.__next())
+            return b''.join(chunks)
+
+        while len(self.__buffer) < size and not self.__eof:
+            self.__buffer += self.__next()
+        data, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+        return data
+
+    def __next(self):
+        try:
+            if self.__reader is not None:
+                data = self.__reader.read(self.chunk_size)
+                self.__eof = not data
+            elif self.__decoder.needs_input():
+                chunk = self.__stream.read(self.chunk_size)
+                if chunk:
+                    data = self.__decoder.decompress(chunk, self.chunk_size)
+                else:
+                    data = self.__decoder.flush()
+                    self.__eof = True
+            else:
+                data = self.__decoder.decompress(b'', self.chunk_size)
+        except (zlib.error, getattr(zstandard, 'ZstdError', zlib.error), getattr(brotli, 'error', zlib.error)) as err:
+            raise DecodingError('Corrupted compressed data: %s' % err)
+
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise IngestLimitError('Decompressed data is larger than %d bytes' % self.max_size)
+        return data
+
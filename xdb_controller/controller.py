@@ -1,24 +1,118 @@
 from functools import wraps
-from pymongo import MongoClient
+import inspect
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReplaceOne, UpdateOne
 import pymongo.errors as db_errors
+from pymongo import monitoring
 from hashlib import sha256
-from datetime import datetime
-from xmljson import badgerfish as bf
+import heapq
+from operator import itemgetter
+import os
+import tarfile
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta
+import gzip
 from bson.son import SON
 from bson.json_util import dumps, loads
 from bson.objectid import ObjectId
+from bson.codec_options import CodecOptions
+from bson.binary import Binary
+from .allocator import DocIdAllocator
+from .cache import LRUCache, AuthCache
+from .ingest import StreamIngest, IngestLimitError
+from . import serializer
+from . import converter
+from . import workers
+from . import analytics
+from . import paths
+from . import textindex
+from . import delta
+from . import compression
+from . import metrics
+from . import profiling
+from . import storage
+from .segments import SegmentStore, SegmentsUnavailable
+from .workers import ConversionService, ServiceBusy, ConversionError
 
 try:
-    from lxml.etree import Element, fromstring, tostring, ParseError
+    from lxml.etree import Element, fromstring, tostring, ParseError, XMLParser
     import lxml.etree as ET
     from io import BytesIO
 except:
-    from xml.etree.ElementTree import Element, ElementTree, fromstring, tostring, ParseError
+    from xml.etree.ElementTree import Element, ElementTree, fromstring, tostring, ParseError, XMLParser
     from xml.dom import minidom
+    from io import BytesIO
 
 import uuid
 
-DEBUG = False
+DRIVER_CALL_SECONDS = metrics.Histogram('xdb_driver_call_seconds', 'Time of Driver method calls.', ['method'])
+DB_COMMAND_SECONDS = metrics.Histogram('xdb_db_command_seconds',
+                                       'MongoDB round trips (count) and their time per Driver method and command.',
+                                       ['method', 'command'])
+CONVERSION_SECONDS = metrics.Histogram('xdb_conversion_seconds', 'Time of XML/JSON documents conversion.',
+                                       ['direction'])
+CONVERSION_BYTES = metrics.Histogram('xdb_conversion_bytes', 'Size of converted XML documents.', ['direction'],
+                                     buckets=metrics.SIZE_BUCKETS)
+# Hit ratio is hits / (hits + misses)
+CACHE_HITS = metrics.Counter('xdb_cache_hits_total', 'Lookups found in Driver caches.', ['cache'])
+CACHE_MISSES = metrics.Counter('xdb_cache_misses_total', 'Lookups missed in Driver caches.', ['cache'])
+# Drivers of this process, caches stats are summed over those not garbage collected yet
+_drivers = weakref.WeakSet()
+
+
+def _collect_cache_stats():
+    for name in ('auth', 'rules', 'render', 'aggregate'):
+        caches = [getattr(driver, name + '_cache') for driver in list(_drivers)]
+        CACHE_HITS.labels(name).set(sum(cache.hits for cache in caches))
+        CACHE_MISSES.labels(name).set(sum(cache.misses for cache in caches))
+
+
+metrics.REGISTRY.add_collector(_collect_cache_stats)
+
+# Driver method run by current thread (innermost one), DB commands are counted against it
+_calls = threading.local()
+
+
+def tracked(func):
+    timer = DRIVER_CALL_SECONDS.labels(func.__name__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        outer = getattr(_calls, 'method', None)
+        _calls.method = func.__name__
+        error = None
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception as err:
+            error = err
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            timer.observe(elapsed)
+            _calls.method = outer
+            profile = profiling.current()
+            if profile is not None:
+                profile.add_call(func.__name__, elapsed, error)
+    return wrapper
+
+
+class CommandMetrics(monitoring.CommandListener):
+    # pymongo runs listener in thread which sent the command
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        method = getattr(_calls, 'method', None) or 'none'
+        DB_COMMAND_SECONDS.labels(method, event.command_name).observe(event.duration_micros / 1e6)
+        profile = profiling.current()
+        if profile is not None:
+            profile.add_command(method, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self.succeeded(event)
 
 def user_validate(func):
     @wraps(func)
@@ -34,62 +128,6 @@ def user_validate(func):
             return {'result': 0}
     return wrapper
 
-# Magic: getting arguments names of given function
-def __get_func_args_names(func):
-    # func_const_count - counts all function constants minus one (first always(?) none)
-    # func_default_args - get only function arguments not all function variables
-    func_const_count = len(func.__code__.co_consts)-1
-    func_default_args = func.__code__.co_varnames[:func_const_count+1]
-    return func_default_args
-
-def debug_handler(func):
-    @wraps(func)
-    def wrapper(inst, *args, **kwargs):
-        try:
-            result = func(inst, *args, **kwargs)
-        except db_errors.DuplicateKeyError as err:
-            func_default_args = __get_func_args_names(func)
-            error_msg = '\n[DEBUG_START]\n' \
-                        'Insert/update operation failed due to key error. ' \
-                        'Document with such _id already presence in DB.\n' \
-                        'Class name: {0}\n' \
-                        'Method name: {1}{2}\n' \
-                        'Args: {3}\n' \
-                        'Kwargs: {4}\n' \
-                        '[DEBUG_END]\n'.format(str(inst.__class__.__name__),
-                                                                          str(func.__name__),
-                                                                          func_default_args,
-                                                                          args,
-                                                                          kwargs)
-            if DEBUG:
-                print(error_msg)
-
-            prt = True
-            if prt:
-                raise err
-        except Exception as err:
-            func_default_args = __get_func_args_names(func)
-            error_msg = '\n[DEBUG_START]\n' \
-                        'Unknown exception.' \
-                        'Class name: {0}\n' \
-                        'Method name: {1}{2}\n' \
-                        'Args: {3}\n' \
-                        'Kwargs: {4}\n' \
-                        '[DEBUG_END]\n'.format(str(inst.__class__.__name__),
-                                                                          str(func.__name__),
-                                                                          func_default_args,
-                                                                          args,
-                                                                          kwargs)
-            if DEBUG:
-                print(error_msg)
-
-            prt = True
-            if prt:
-                raise err
-
-        return result
-    return wrapper
-
 class DBConnection:
     # Make sure we always have the only working connection at ones
     __connection = None
@@ -101,7 +139,7 @@ class DBConnection:
     @classmethod
     def __make_connection(cls, host):
         if not cls.__connection:
-            cls.__connection = MongoClient(host)
+            cls.__connection = MongoClient(host, event_listeners=[CommandMetrics()])
         return cls.__connection
 
     # returns db client object
@@ -109,21 +147,96 @@ class DBConnection:
         return self.mclient[db_name]
 
 
+def render_key(org_id, doc, method, prettify, streamed):
+    # Streamed and rendered at once output differs slightly (XML declaration)
+    return (org_id, doc['doc_id'], doc.get('last_modified'), doc.get('encoding') or 'utf-8',
+            method, prettify, streamed)
+
+def render_etag(key):
+    # Stored document never changes under the same last_modified, so render parameters
+    # together with modification time identify rendered bytes exactly
+    return sha256(repr(key).encode()).hexdigest()
+
+
 # DB model
 class Driver:
-
-    def __init__(self, db_name, collection_name, root_user, *args, **kwargs):
+    # Orders of documents listing and metadata fields it returns
+    LIST_ORDERS = ('doc_id', 'last_modified')
+    LIST_FIELDS = {'_id': 0, 'doc_id': 1, 'last_modified': 1, 'encoding': 1, 'size': 1, 'sha256': 1}
+    BATCH_FIELDS = storage.BATCH_FIELDS
+    PAYLOAD_FIELDS = storage.PAYLOAD_FIELDS
+    # Attributes of storage.step targets
+    STEP_TARGETS = {'docs': 'docs_coll', 'blobs': 'blobs_coll', 'blob_stats': 'blob_stats_coll',
+                    'versions': 'versions_coll', 'keys': 'keys_coll', 'terms': 'terms_coll', 'segments': 'segments'}
+
+    def __init__(self, db_name, collection_name, root_user, *args, docs_collection_name='documents',
+                 keys_collection_name='doc_keys', terms_collection_name='doc_terms', blobs_collection_name='blobs',
+                 versions_collection_name='doc_versions',
+                 doc_id_block_size=1, auth_cache_size=4096, auth_cache_ttl=300,
+                 render_cache_size=64 * 1024 * 1024, storage_format='json',
+                 max_doc_size=None, max_doc_depth=None, stream_threshold=1024 * 1024,
+                 conversion_workers=0, conversion_threshold=256 * 1024, conversion_queue=None,
+                 aggregate_cache_size=65536, text_index=False, dedup=False, version_snapshot_interval=10,
+                 backend=None, segments_path=None, segment_threshold=1024 * 1024, segment_size=256 * 1024 * 1024,
+                 **kwargs):
         self.db_name = db_name
         self.collection_name = collection_name
+        self.docs_collection_name = docs_collection_name
+        self.keys_collection_name = keys_collection_name
+        self.terms_collection_name = terms_collection_name
+        self.blobs_collection_name = blobs_collection_name
+        self.versions_collection_name = versions_collection_name
+        self.doc_id_block_size = doc_id_block_size
+        assert storage_format in DocumentModel.STORAGE_FORMATS, \
+            'storage_format should be one of %s' % str(DocumentModel.STORAGE_FORMATS)
+        self.storage_format = storage_format
+        # Limits for streamed uploads (None - unlimited)
+        self.max_doc_size = max_doc_size
+        self.max_doc_depth = max_doc_depth
+        # Documents of this size (bytes of uploaded XML) and above are sent as stream
+        self.stream_threshold = stream_threshold
+        # Large documents are converted in separate processes
+        self.conversions = ConversionService(conversion_workers, conversion_threshold, conversion_queue)
+        # Verified credentials and org memberships; only positive answers are cached
+        self.auth_cache = AuthCache(auth_cache_size, ttl=auth_cache_ttl)
+        # Parsed business keys extraction rules of organizations
+        self.rules_cache = LRUCache(auth_cache_size, ttl=auth_cache_ttl)
+        # Rendered XML documents, size is counted in bytes
+        self.render_cache = LRUCache(render_cache_size, sizeof=len)
+        # Full-text index is updated on every document creation/removal
+        self.text_index = text_index
+        # Identical payloads of new documents are stored once in blobs collection
+        self.dedup = dedup
+        # Every this version of document history is saved in full, not as delta
+        self.version_snapshot_interval = version_snapshot_interval
+        # Partial aggregation results per (document version, query)
+        self.aggregate_cache = LRUCache(aggregate_cache_size)
+        # Callable giving database by name (see backends module); MongoDB connection by default
+        self.backend = backend
+        # Raw payloads (compressed bytes) of this size and above go to segment files, if directory is given
+        self.segments = SegmentStore(segments_path, segment_size) if segments_path else None
+        self.segment_threshold = segment_threshold
         self.__args = args
         self.__kwargs = kwargs
+        _drivers.add(self)
 
         assert isinstance(root_user, UserModel), 'user should be created via UserModel instance'
         self.__root_user = root_user
 
     def connect(self):
-        conn = DBConnection(*self.__args, **self.__kwargs)
+        conn = self.backend or DBConnection(*self.__args, **self.__kwargs)
         self.db = conn(self.db_name)
+        self.doc_ids = DocIdAllocator(self.db[self.collection_name], self.doc_id_block_size)
+        # SON keeps stored documents keys order when decoding
+        self.docs_coll = self.db.get_collection(self.docs_collection_name,
+                                                codec_options=CodecOptions(document_class=SON))
+        self.keys_coll = self.db[self.keys_collection_name]
+        self.terms_coll = self.db[self.terms_collection_name]
+        self.blobs_coll = self.db.get_collection(self.blobs_collection_name,
+                                                 codec_options=CodecOptions(document_class=SON))
+        self.versions_coll = self.db[self.versions_collection_name]
+        self.blob_stats_coll = self.db[self.blobs_collection_name + '_stats']
+        self._init_docs_storage()
 
     def _init_users_storage(self):
         if not self.__collection_check_exists('users'):
@@ -135,6 +248,12 @@ class Driver:
             return {'result': 0}
         return {'result': 0}
 
+    def _init_docs_storage(self):
+        collections = {'docs': self.docs_coll, 'keys': self.keys_coll, 'terms': self.terms_coll,
+                       'versions': self.versions_coll}
+        for name, keys, unique in storage.INDEXES:
+            collections[name].create_index(keys, unique=unique)
+
     def db_user_add(self, user):
         if isinstance(user, (tuple, list)):
             assert len(user) == 2, '"user" should be tuple that contains exact two strings' \
@@ -171,6 +290,8 @@ class Driver:
             coll = self.db['users']
             result = coll.delete_one({'login': user.login})
 
+            self.auth_cache.forget_user(user.login)
+
             if result.deleted_count > 0:
                 return {'result': 1, 'login': user.login}
             return {'result': 0}
@@ -185,13 +306,16 @@ class Driver:
         if not isinstance(user, UserModel):
             raise TypeError
 
-        if self.db_user_check_exists(user):
-            coll = self.db['users']
-            cur = coll.find_one({'login': {'$eq': user.login}, 'password': {'$eq': user.password}},
-                                {'password': 0,
-                                 '_id': 0})
-            if cur:
-                return user
+        if self.auth_cache.password_valid(user):
+            return user
+
+        coll = self.db['users']
+        cur = coll.find_one({'login': {'$eq': user.login}, 'password': {'$eq': user.password}},
+                            {'login': 1,
+                             '_id': 0})
+        if cur:
+            self.auth_cache.password_verified(user)
+            return user
         return False
 
     def db_user_check_exists(self, user):
@@ -210,7 +334,6 @@ class Driver:
             return True
         return False
 
-    @debug_handler
     def org_create_one(self, *args, **kwargs):
         org = OrganizationModel(*args, **kwargs)
         # Set default root user for organization
@@ -223,7 +346,6 @@ class Driver:
             return {'result': 1, org.org_name: org.org_id}
         return {'result': 0}
 
-    @debug_handler
     def org_create_many(self, org_list, *args, **kwargs):
         assert isinstance(org_list, (list, dict,)), \
             'org_list should be of list or dict type. Given type %s' % str(type(org_list))
@@ -295,6 +417,7 @@ class Driver:
         if not self.org_check_user(org_id, user):
             coll = self.db[self.collection_name]
             result = coll.update_one({'org_id': org_id}, {'$push': {'users': user.login}})
+            self.auth_cache.forget_member(user.login, org_id)
 
             if result.modified_count == 0:
                 return {'result': 0}
@@ -316,6 +439,7 @@ class Driver:
         if self.org_check_user(org_id, user):
             coll = self.db[self.collection_name]
             result = coll.update_one({'org_id': org_id}, {'$pull': {'users': user.login}})
+            self.auth_cache.forget_member(user.login, org_id)
 
             if result.modified_count == 0:
                 return {'result': 0}
@@ -327,13 +451,54 @@ class Driver:
             assert len(user) == 2, '"user" should be tuple that contains exact two strings' \
                                    ' - login and password. This contains %d elements' % len(user)
 
+            user = UserModel(*user)
+
+        # user could be given either as login string or as UserModel instance
+        login = str(user)
+        if self.auth_cache.is_member(login, org_id):
+            return True
+
         coll = self.db[self.collection_name]
-        cur = coll.find_one({'org_id': org_id, 'users': user}, {'users': 1, '_id': 0})
+        cur = coll.find_one({'org_id': org_id, 'users': login}, {'_id': 1})
 
         if cur:
+            self.auth_cache.member_verified(login, org_id)
             return True
         return False
 
+    def org_set_key_rules(self, org_id, rules):
+        '''
+        Sets business keys extraction rules of organization: list of {'name': ..., 'path': ...}
+        (path syntax as in paths module). Rules apply to documents created afterwards.
+        '''
+        try:
+            for rule in rules:
+                assert isinstance(rule.get('name'), str) and rule['name'], 'rule name should be non-empty string'
+                paths.parse_path(rule['path'])
+        except (AssertionError, AttributeError, KeyError, TypeError, ValueError) as err:
+            return {'result': 0, 'error': 'Wrong rule: %s' % err}
+
+        rules = [{'name': rule['name'], 'path': rule['path']} for rule in rules]
+        result = self.db[self.collection_name].update_one({'org_id': org_id}, {'$set': {'key_rules': rules}})
+        self.rules_cache.discard(org_id)
+        if result.matched_count:
+            return {'result': 1}
+        return {'result': 0}
+
+    def org_key_rules(self, org_id):
+        # Returns list of (name, parsed path) pairs, empty if organization has no rules
+        rules = self.rules_cache.get(org_id)
+        if rules is None:
+            org = self.db[self.collection_name].find_one({'org_id': org_id}, {'key_rules': 1, '_id': 0})
+            rules = [(rule['name'], paths.parse_path(rule['path'])) for rule in (org or {}).get('key_rules', [])]
+            self.rules_cache.set(org_id, rules)
+        return rules
+
+    def cache_stats(self):
+        return {'auth': self.auth_cache.stats(),
+                'render': self.render_cache.stats(),
+                'aggregate': self.aggregate_cache.stats()}
+
     def org_get_info(self, org_id, exclude_fields={}):
         exclude_fields['users'] = 0
         exclude_fields['docs'] = 0
@@ -345,81 +510,856 @@ class Driver:
 
     @user_validate
     def doc_create_one(self, user, org_id, data, encoding='utf-8'):
-        doc_id = self.org_get_info(org_id)['doc_count'] + 1
+        try:
+            with CONVERSION_SECONDS.labels('xml_to_json').time():
+                doc = self.conversions.run(len(data), workers.build_document, data, encoding, self.storage_format,
+                                           self.org_key_rules(org_id), self.text_index)
+            CONVERSION_BYTES.labels('xml_to_json').observe(len(data))
+        except (ParseError, ConversionError) as err:
+            return {'result': 0, 'error': 'Document data corrupted. Unable to parse.'}
+
+        return self.__doc_insert_one(org_id, doc)
 
-        doc = DocumentModel(doc_id)
+    @user_validate
+    def doc_create_stream(self, user, org_id, stream, encoding='utf-8', size=None):
+        '''
+        Same as doc_create_one, but reads XML from file-like stream incrementally.
+        size - expected stream length if known; large streams are spooled to temporary file
+        and parsed in conversion process.
+        Raises IngestLimitError if document exceeds configured size or depth limits,
+        ServiceBusy if conversion processes are overloaded.
+        '''
         try:
-            doc.data = data
-        except ParseError as err:
+            doc = self.__doc_parse_stream(org_id, stream, encoding, size)
+        except (ParseError, ConversionError) as err:
             return {'result': 0, 'error': 'Document data corrupted. Unable to parse.'}
-        doc.encoding = encoding
 
-        coll = self.db[self.collection_name]
-        result = coll.update_one({'org_id': org_id},
-                                                  {'$inc': {'doc_count': 1},
-                                                   '$push': {'docs': doc.to_dict()}})
-        if result.matched_count == 0:
+        return self.__doc_insert_one(org_id, doc)
+
+    def __doc_parse_stream(self, org_id, stream, encoding, size, keep_tree=False):
+        key_rules = self.org_key_rules(org_id)
+        with CONVERSION_SECONDS.labels('xml_to_json').time():
+            if self.conversions.offloaded(size):
+                path = workers.spool(stream, self.max_doc_size)
+                try:
+                    doc = self.conversions.run(size, workers.ingest_file, path, encoding, self.storage_format,
+                                               self.max_doc_size, self.max_doc_depth, key_rules, self.text_index,
+                                               keep_tree)
+                finally:
+                    os.remove(path)
+            else:
+                doc = DocumentModel.from_stream(stream, encoding, self.storage_format,
+                                                max_size=self.max_doc_size, max_depth=self.max_doc_depth,
+                                                key_rules=key_rules, text_index=self.text_index, keep_tree=keep_tree)
+        CONVERSION_BYTES.labels('xml_to_json').observe(doc.size)
+        return doc
+
+    @user_validate
+    def doc_update_stream(self, user, org_id, doc_id, stream, encoding='utf-8', size=None):
+        '''
+        Replaces document content with XML read from stream, keeping previous version in history
+        as reverse delta against the new tree (in full every version_snapshot_interval versions).
+        Returns result 0 with "conflict" if document was changed meanwhile.
+        Raises same exceptions as doc_create_stream.
+        '''
+        current = self.doc_find_one(user, org_id, doc_id)
+        if not current:
+            return {'result': 0, 'error': 'No document with ID %s found.' % doc_id}
+        try:
+            doc = self.__doc_parse_stream(org_id, stream, encoding, size, keep_tree=True)
+        except (ParseError, ConversionError) as err:
+            return {'result': 0, 'error': 'Document data corrupted. Unable to parse.'}
+
+        version = current.get('version', 1)
+        history = storage.history_record(org_id, current, self.doc_tree(org_id, current), doc.tree,
+                                         self.version_snapshot_interval)
+        doc.doc_id = doc_id
+        record = doc.to_dict()
+        record['version'] = version + 1
+        if not self.__steps(storage.doc_replace(org_id, current, record, history, self.dedup, self.segments,
+                                                self.segment_threshold)):
+            return {'result': 0, 'error': 'Document was changed meanwhile.', 'conflict': True}
+
+        self.render_cache.discard_where(lambda key: key[0] == org_id and key[1] == doc_id)
+        self.aggregate_cache.discard_where(lambda key: key[0] == org_id and key[1] == doc_id)
+        self.__index_insert(org_id, [doc])
+        return {'result': 1, 'doc_id': doc_id, 'version': version + 1}
+
+    @user_validate
+    def doc_version_tree(self, user, org_id, doc_id, version, doc=None):
+        '''
+        Returns badgerfish tree of given document version, None if there is no such version.
+        Rebuild starts from the closest full version above: nearest snapshot or current document.
+        '''
+        if doc is None:
+            doc = self.doc_find_one(user, org_id, doc_id, with_data=False)
+            if not doc:
+                return None
+        current = doc.get('version', 1)
+        if version == current:
+            return self.doc_tree(org_id, self.doc_find_one(user, org_id, doc_id))
+        if version < 1 or version > current:
+            return None
+
+        coll = self.versions_coll
+        query = {'org_id': org_id, 'doc_id': doc_id, 'version': {'$gte': version, '$lt': current}}
+        snapshot = coll.find_one(dict(query, snapshot={'$exists': True}), {'version': 1, 'snapshot': 1},
+                                 sort=[('version', ASCENDING)])
+        if snapshot:
+            tree = loads(snapshot['snapshot'], object_pairs_hook=SON)
+            top = snapshot['version']
+        else:
+            full = self.doc_find_one(user, org_id, doc_id)
+            if not full or full.get('version', 1) != current:
+                return None
+            tree = self.doc_tree(org_id, full)
+            top = current
+
+        query['version'] = {'$gte': version, '$lt': top}
+        deltas = list(coll.find(query, {'version': 1, 'delta': 1}).sort('version', DESCENDING))
+        if len(deltas) != top - version:
+            return None
+        for record in deltas:
+            tree = delta.apply(tree, loads(record['delta'], object_pairs_hook=SON))
+        return tree
+
+    @user_validate
+    def doc_render_version(self, user, org_id, doc_id, version, prettify=True, doc=None):
+        '''
+        Returns given document version as XML encoded with document encoding, None if there is no such version.
+        Previous versions of raw documents are rendered from tree, not served as uploaded.
+        '''
+        if doc is None:
+            doc = self.doc_find_one(user, org_id, doc_id, with_data=False)
+            if not doc:
+                return None
+        tree = self.doc_version_tree(user, org_id, doc_id, version, doc=doc)
+        if tree is None:
+            return None
+        encoding = doc.get('encoding') or 'utf-8'
+        with CONVERSION_SECONDS.labels('json_to_xml').time():
+            rendered = DocumentModel.json_to_xml(tree, encoding=encoding, prettify=prettify).encode(encoding)
+        CONVERSION_BYTES.labels('json_to_xml').observe(len(rendered))
+        return rendered
+
+    def doc_version_etag(self, org_id, doc, version, prettify=True, coding=None):
+        # Content of previous version never changes
+        return render_etag((org_id, doc['doc_id'], 'version', version, doc.get('encoding') or 'utf-8', prettify,
+                            coding))
+
+    def __doc_insert_one(self, org_id, doc):
+        doc_id = self.doc_ids.allocate(org_id)
+        if doc_id is None:
             return {'result': 0}
-        if result.modified_count != 0:
+        doc.doc_id = doc_id
+
+        record = doc.to_dict()
+        record['org_id'] = org_id
+        self.__steps(storage.payload_store(org_id, [record], self.dedup, self.segments, self.segment_threshold))
+        try:
+            result = self.docs_coll.insert_one(record)
+        except db_errors.WriteError:
+            self.__steps(storage.blobs_unref(org_id, [record]))
+            raise
+        if result.inserted_id:
+            self.__index_insert(org_id, [doc])
             return {'result': 1, 'doc_id': doc_id}
+        self.__steps(storage.blobs_unref(org_id, [record]))
         return {'result': 0}
 
-    @debug_handler
     def doc_create_many(self, org_id, data_list, encoding='utf-8'):
-        result = None
-        start_id = self.org_get_info(org_id)['doc_count']
-        doc_id = start_id + 1
+        docs = []
 
         if all(isinstance(doc, DocumentModel) for doc in data_list):
             if all([doc.data for doc in data_list]):
-                bulk = self.db[self.collection_name].initialize_ordered_bulk_op()
-                organization = bulk.find({'org_id': org_id})
-                for doc in data_list:
-                    doc.doc_id = doc_id
-                    doc.encoding = encoding
-                    organization.update({'$inc': {'doc_count': 1},
-                                        '$push': {'docs': doc.to_dict()}})
-                    doc_id += 1
-                result = bulk.execute()
+                docs.extend(data_list)
 
         elif all(isinstance(doc, dict) for doc in data_list):
-            bulk = self.db[self.collection_name].initialize_ordered_bulk_op()
-            organization = bulk.find({'org_id': org_id})
             for doc in data_list:
                 # the reason of using DocModel instance instead give dictionary - validation in DocModel
-                doc = DocumentModel.from_dict(doc)
-                doc.doc_id = doc_id
-                doc.encoding = encoding
-                organization.update({'$inc': {'doc_count': 1},
-                                        '$push': {'docs': doc.to_dict()}})
-                doc_id += 1
-            result = bulk.execute()
+                if isinstance(doc.get('data'), (str, bytes)):
+                    docs.append(self.conversions.run(len(doc['data']), workers.build_document,
+                                                     doc['data'], encoding, self.storage_format,
+                                                     self.org_key_rules(org_id), self.text_index))
+                else:
+                    docs.append(DocumentModel.from_dict(doc, self.storage_format))
         else:
             pass
-        if not result:
+        if not docs:
             return {'result': 0}
-        if result['nModified'] != len(data_list):
+
+        for doc in docs:
+            doc.encoding = encoding
+        start_id = self.__doc_insert_many(org_id, docs)
+        if start_id is None:
             return {'result': 0}
         else:
-            return {'result': 1, 'doc_first_id': start_id+1, 'doc_last_id': doc_id-1}
+            return {'result': 1, 'doc_first_id': start_id, 'doc_last_id': start_id + len(docs) - 1}
 
     @user_validate
-    def doc_find_one(self, user, org_id, doc_id):
-        coll = self.db[self.collection_name]
-        cur = coll.find({'org_id': org_id, 'docs.doc_id': doc_id}, {'docs': 1, '_id': 0})
+    def doc_create_batch(self, user, org_id, items, encoding='utf-8', chunk_size=100):
+        '''
+        Creates documents from iterable of (name, file-like stream) pairs.
+        Every stream is parsed incrementally; parsed documents are written with one bulk insert
+        per chunk_size documents. Documents which fail to parse are reported and skipped.
+        '''
+        output = {'result': 0, 'docs': [], 'errors': []}
+        chunk = []
+        key_rules = self.org_key_rules(org_id)
+
+        def flush():
+            try:
+                start_id = self.__doc_insert_many(org_id, [doc for index, name, doc in chunk])
+                saved = len(chunk) if start_id is not None else 0
+            except db_errors.BulkWriteError as err:
+                # Documents before the failed one are saved
+                start_id, saved = chunk[0][2].doc_id, err.details.get('nInserted', 0)
+            for offset, (index, name, doc) in enumerate(chunk):
+                if offset >= saved:
+                    output['errors'].append({'index': index, 'name': name, 'error': 'Unable to save document.'})
+                else:
+                    output['docs'].append({'index': index, 'name': name, 'doc_id': start_id + offset})
+            del chunk[:]
+
+        taken = 0
+        try:
+            for index, (name, stream) in enumerate(items):
+                taken = index + 1
+                try:
+                    with CONVERSION_SECONDS.labels('xml_to_json').time():
+                        doc = DocumentModel.from_stream(stream, encoding, self.storage_format,
+                                                        max_size=self.max_doc_size, max_depth=self.max_doc_depth,
+                                                        key_rules=key_rules, text_index=self.text_index)
+                    CONVERSION_BYTES.labels('xml_to_json').observe(doc.size)
+                except ParseError as err:
+                    output['errors'].append({'index': index, 'name': name,
+                                             'error': 'Document data corrupted. Unable to parse.'})
+                    continue
+                except IngestLimitError as err:
+                    output['errors'].append({'index': index, 'name': name, 'error': str(err)})
+                    continue
+                except tarfile.TarError as err:
+                    # Archive is truncated inside the document, nothing follows it
+                    output['errors'].append({'index': index, 'name': name,
+                                             'error': 'Archive data corrupted. Unable to read.'})
+                    break
+
+                chunk.append((index, name, doc))
+                if len(chunk) >= chunk_size:
+                    flush()
+        except tarfile.TarError as err:
+            # Truncated or malformed archive: documents read before the damage are still saved
+            output['errors'].append({'index': taken, 'name': None,
+                                     'error': 'Archive data corrupted. Unable to read.'})
+        if chunk:
+            flush()
+
+        if output['docs']:
+            doc_ids = [doc['doc_id'] for doc in output['docs']]
+            output.update({'result': 1, 'doc_first_id': min(doc_ids), 'doc_last_id': max(doc_ids)})
+        return output
+
+    def __doc_insert_many(self, org_id, docs):
+        # Returns ID of the first document; whole list gets contiguous range of IDs in one round trip
+        start_id = self.doc_ids.allocate(org_id, len(docs))
+        if start_id is None:
+            return None
+
+        records = []
+        for doc_id, doc in enumerate(docs, start_id):
+            doc.doc_id = doc_id
+            record = doc.to_dict()
+            record['org_id'] = org_id
+            records.append(record)
+
+        self.__steps(storage.payload_store(org_id, records, self.dedup, self.segments, self.segment_threshold))
+        try:
+            result = self.docs_coll.insert_many(records)
+        except db_errors.BulkWriteError as err:
+            # Ordered insert stops at the first failed record, those before it are saved and indexed
+            inserted = err.details.get('nInserted', 0)
+            self.__steps(storage.blobs_unref(org_id, records[inserted:]))
+            self.__index_insert(org_id, docs[:inserted])
+            raise
+        if len(result.inserted_ids) != len(records):
+            self.__steps(storage.blobs_unref(org_id, records[len(result.inserted_ids):]))
+            return None
+        self.__index_insert(org_id, docs)
+        return start_id
+
+    def __steps(self, steps):
+        # Makes calls of storage operation with collections of this driver, returns its result
+        result, error = None, None
+        while True:
+            try:
+                call = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                target = getattr(self, self.STEP_TARGETS[call.target])
+                result = getattr(target, call.method)(*call.args, **call.kwargs)
+                if call.method == 'find':
+                    result = list(result)
+            except Exception as err:
+                error = err
+
+    def __attach_blobs(self, docs, fields=storage.PAYLOAD_FIELDS):
+        # Puts shared payloads (only given fields of them) into fetched documents stored by blob reference,
+        # payloads in segment files are mapped as memoryview
+        blob_ids = {doc['blob'] for doc in docs if storage.needs_blob(doc)}
+        blobs = {}
+        if blob_ids:
+            fields = dict.fromkeys(fields, 1)
+            blobs = {blob['_id']: blob for blob in self.blobs_coll.find({'_id': {'$in': list(blob_ids)}}, fields)}
+        for doc in docs:
+            storage.attach_payload(doc, blobs.get(doc.get('blob')), self.segments)
+        return docs
+
+    def __iter_attach_blobs(self, cursor, batch_size=50, fields=storage.PAYLOAD_FIELDS):
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                for doc in self.__attach_blobs(batch, fields):
+                    yield doc
+                batch = []
+        for doc in self.__attach_blobs(batch, fields):
+            yield doc
+
+    def dedup_stats(self, org_id=None):
+        '''
+        Dedup counters of organization (content is shared within one only), of all of them if org_id is None
+        '''
+        query = {} if org_id is None else {'_id': storage.dedup_stats_id(org_id)}
+        output = {'hits': 0, 'saved': 0, 'blobs': 0, 'stored': 0}
+        for stats in self.blob_stats_coll.find(query, {'_id': 0}):
+            for name, value in stats.items():
+                output[name] = output.get(name, 0) + value
+        return output
+
+    def user_is_root(self, user):
+        return str(user) == str(self.__root_user)
+
+    def __index_insert(self, org_id, docs):
+        # Saves business keys and full-text postings of created documents
+        key_rules = self.org_key_rules(org_id)
+        if not key_rules and not self.text_index:
+            return
+        keys, terms = [], []
+        for doc in docs:
+            # Documents built without indexing (e.g. from dict) are looked through now
+            if (key_rules and doc.keys is None) or (self.text_index and doc.terms is None):
+                doc.key_rules, doc.text_index = key_rules, self.text_index
+                doc.index_tree(DocumentModel.raw_to_tree(doc.raw, doc.encoding) if doc.raw is not None
+                               else DocumentModel.load_data(doc.data, doc.storage_format))
+            if key_rules:
+                keys.extend(storage.key_records(org_id, doc.doc_id, doc.keys))
+            if self.text_index:
+                terms.extend(storage.term_records(org_id, doc.doc_id, doc.terms))
+        if keys:
+            self.keys_coll.insert_many(keys, ordered=False)
+        if terms:
+            self.terms_coll.insert_many(terms, ordered=False)
+
+    @user_validate
+    def doc_search(self, user, org_id, query, limit=100):
+        '''
+        Returns IDs of organization documents matching full-text query (see textindex module).
+        Only postings of query terms are read.
+        '''
+        if not self.text_index:
+            return {'result': 0, 'error': 'Full-text index is disabled.'}
+        try:
+            clauses = textindex.parse_query(query)
+        except ValueError as err:
+            return {'result': 0, 'error': str(err)}
+
+        found = set()
+        for clause in clauses:
+            matched = None
+            # Single terms go first, phrases are checked against documents left
+            for phrase in sorted(clause, key=len):
+                docs = self.__phrase_docs(org_id, phrase, matched)
+                matched = docs if matched is None else matched & docs
+                if not matched:
+                    break
+            found |= matched
+        return {'result': 1, 'doc_ids': sorted(found)[:limit], 'total': len(found)}
+
+    def __phrase_docs(self, org_id, phrase, candidates=None, max_candidates=1000):
+        # Returns set of IDs of documents containing phrase, checked among candidates if given
+        positions = {}
+        for term in phrase:
+            query = {'org_id': org_id, 'term': term}
+            if candidates is not None and len(candidates) <= max_candidates:
+                query['doc_id'] = {'$in': list(candidates)}
+            fields = {'doc_id': 1, '_id': 0}
+            if len(phrase) > 1:
+                fields['pos'] = 1
+            postings = {posting['doc_id']: posting.get('pos') for posting in self.terms_coll.find(query, fields)}
+            candidates = set(postings) if candidates is None else candidates & set(postings)
+            for doc_id, data in postings.items():
+                if doc_id in candidates:
+                    positions.setdefault(doc_id, {})[term] = data
+            if not candidates:
+                return candidates
+
+        if len(phrase) == 1:
+            return candidates
+        return {doc_id for doc_id in candidates
+                if textindex.phrase_matches([textindex.decode(positions[doc_id][term]) for term in phrase])}
+
+    @user_validate
+    def doc_lookup(self, user, org_id, name, value, limit=1000):
+        '''
+        Returns IDs of documents having business key name with given value (index seek, no documents read)
+        '''
+        cursor = self.keys_coll.find({'org_id': org_id, 'name': name, 'value': value},
+                                     {'doc_id': 1, '_id': 0}).sort('doc_id', ASCENDING).limit(limit)
+        return {'result': 1, 'doc_ids': [key['doc_id'] for key in cursor]}
+
+    @user_validate
+    def doc_find_one(self, user, org_id, doc_id, with_data=True, with_tree=True):
+        '''
+        with_tree - fetch stored tree as well; not needed to serve raw document as uploaded
+        '''
+        specified_fields = {'_id': 0, 'org_id': 0}
+        if not with_data:
+            specified_fields['raw'] = 0
+        if not with_data or not with_tree:
+            specified_fields['data'] = 0
+
+        coll = self.docs_coll
+        doc = coll.find_one({'org_id': org_id, 'doc_id': doc_id}, specified_fields)
+        if doc and with_data:
+            self.__attach_blobs([doc], self.PAYLOAD_FIELDS if with_tree else storage.RAW_PAYLOAD_FIELDS)
+        return doc
+
+    @user_validate
+    def doc_find_many(self, user, org_id, doc_ids, batch_size=50):
+        '''
+        Returns cursor of documents with given IDs ordered by doc_id, all found with one query.
+        Cursor fetches batch_size documents per round trip, so whole set is never held in memory.
+        '''
+        coll = self.docs_coll
+        query = {'org_id': org_id, 'doc_id': {'$in': list(doc_ids)}}
+        # Raw documents are fetched without trees, both sets come ordered by doc_id and are merged
+        raw = coll.find(dict(query, format='raw'),
+                        storage.RAW_BATCH_FIELDS).sort('doc_id', ASCENDING).batch_size(batch_size)
+        other = coll.find(dict(query, format={'$ne': 'raw'}),
+                          self.BATCH_FIELDS).sort('doc_id', ASCENDING).batch_size(batch_size)
+        return heapq.merge(self.__iter_attach_blobs(raw, batch_size, storage.RAW_PAYLOAD_FIELDS),
+                           self.__iter_attach_blobs(other, batch_size), key=itemgetter('doc_id'))
+
+    def doc_iter_many(self, user, org_id, doc_ids, prettify=True, chunk_size=64 * 1024):
+        '''
+        Returns generator of (document metadata, XML chunks) pairs for found documents,
+        None if user can't access organization documents.
+        '''
+        cursor = self.doc_find_many(user, org_id, doc_ids)
+        if isinstance(cursor, dict):
+            return None
+        return ((doc, self.__doc_chunks(user, org_id, doc, prettify, chunk_size)) for doc in cursor)
+
+    def __doc_chunks(self, user, org_id, doc, prettify, chunk_size):
+        if self.doc_is_streamed(doc):
+            return self.doc_iter_one(user, org_id, doc['doc_id'], prettify=prettify, doc=doc, chunk_size=chunk_size)
+        return iter((self.doc_render_one(user, org_id, doc['doc_id'], prettify=prettify, doc=doc),))
+
+    @user_validate
+    def doc_aggregate(self, user, org_id, path, aggregate='sum', group_by=None, batch_size=100):
+        '''
+        Aggregates numeric values found by path (see analytics module) across all organization documents.
+        Partial result of every document version is cached, so only new or changed documents are read.
+        '''
+        if analytics.np is None:
+            return {'result': 0, 'error': 'Aggregation requires NumPy.'}
+        try:
+            query = analytics.Aggregation(org_id, path, aggregate, group_by, self.aggregate_cache)
+        except ValueError as err:
+            return {'result': 0, 'error': str(err)}
+
+        coll = self.docs_coll
+        # Covered by (org_id, last_modified, doc_id) index, no documents are read
+        for doc in coll.find({'org_id': org_id}, {'_id': 0, 'doc_id': 1, 'last_modified': 1}):
+            query.take_cached(doc)
+
+        doc_ids = list(query.missing)
+        for start in range(0, len(doc_ids), batch_size):
+            for doc in self.__attach_blobs(list(coll.find({'org_id': org_id,
+                                                           'doc_id': {'$in': doc_ids[start:start + batch_size]}},
+                                                          self.BATCH_FIELDS))):
+                query.add(doc['doc_id'], self.doc_tree(org_id, doc))
+        return query.result()
+
+    @user_validate
+    def doc_list(self, user, org_id, order_by='doc_id', after=None, limit=100, descending=False):
+        '''
+        Returns page of documents metadata (no data) ordered by doc_id or last_modified.
+        after - "next" value of previous page. Pages are found by index seek from the key
+        of the last listed document, so any page costs the same as the first.
+        '''
+        assert order_by in self.LIST_ORDERS, 'order_by should be one of %s' % str(self.LIST_ORDERS)
+        query = {'org_id': org_id}
+        direction = DESCENDING if descending else ASCENDING
+        op = '$lt' if descending else '$gt'
+
+        if after is not None:
+            try:
+                last_modified, doc_id = self.__list_cursor_decode(order_by, after)
+            except ValueError:
+                return {'result': 0, 'error': 'Wrong "after" value.'}
+            if order_by == 'doc_id':
+                query['doc_id'] = {op: doc_id}
+            else:
+                query['$or'] = [{'last_modified': {op: last_modified}},
+                                {'last_modified': last_modified, 'doc_id': {op: doc_id}}]
+
+        sort = [('doc_id', direction)]
+        if order_by == 'last_modified':
+            sort.insert(0, ('last_modified', direction))
+
+        # One extra document tells whether there is next page
+        cursor = self.docs_coll.find(query, self.LIST_FIELDS).sort(sort).limit(limit + 1)
+        docs = list(cursor)
+        next_key = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_key = self.__list_cursor_encode(order_by, docs[-1])
+        return {'result': 1, 'docs': docs, 'next': next_key}
+
+    def doc_etag(self, org_id, doc, method='xml', prettify=True, coding=None):
+        return render_etag(self.__render_key(org_id, doc, method, prettify, coding))
+
+    @user_validate
+    def doc_render_one(self, user, org_id, doc_id, method='xml', prettify=True, doc=None, coding=None):
+        '''
+        Returns document converted to XML and encoded with document encoding.
+        doc - already fetched document (could be metadata only) to avoid repeated lookup.
+        coding - content coding (see compression module) to compress rendered document with.
+        '''
+        if doc is None:
+            doc = self.doc_find_one(user, org_id, doc_id)
+        elif doc.get('format') == 'raw' and method == 'xml' and 'raw' not in doc:
+            doc = self.doc_find_one(user, org_id, doc_id, with_tree=False)
+        if not doc:
+            return None
+
+        # Original bytes are served as they were uploaded, stored gzip container goes as is
+        if doc.get('format') == 'raw' and method == 'xml':
+            if coding == 'gzip':
+                return bytes(doc['raw'])
+            if coding is None:
+                return gzip.decompress(doc['raw'])
+
+        key = self.__render_key(org_id, doc, method, prettify, coding)
+        rendered = self.render_cache.get(key)
+        if rendered is not None:
+            return rendered
+
+        if coding is not None:
+            rendered = compression.compress(self.doc_render_one(user, org_id, doc_id, method=method,
+                                                                prettify=prettify, doc=doc), coding)
+            self.render_cache.set(key, rendered)
+            return rendered
+
+        if 'data' not in doc and 'raw' not in doc:
+            doc = self.doc_find_one(user, org_id, doc_id)
+            if not doc:
+                return None
+
+        encoding = key[3]
+        if 'data' in doc:
+            size = doc.get('size') or len(doc['data'])
+            with CONVERSION_SECONDS.labels('json_to_xml').time():
+                rendered = self.conversions.run(size, workers.render_document, doc['data'],
+                                                doc.get('format', 'json'), method, encoding, prettify)
+        else:
+            tree = self.doc_tree(org_id, doc)
+            with CONVERSION_SECONDS.labels('json_to_xml').time():
+                rendered = DocumentModel.json_to_xml(tree, method=method, encoding=encoding,
+                                                     prettify=prettify).encode(encoding)
+        CONVERSION_BYTES.labels('json_to_xml').observe(len(rendered))
+        self.render_cache.set(key, rendered)
+        return rendered
+
+    def doc_is_streamed(self, doc, method='xml'):
+        # Size is known only for documents uploaded as XML
+        if method != 'xml' or self.stream_threshold is None or not doc.get('size'):
+            return False
+        if doc.get('format') != 'raw' and serializer.xmlfile is None:
+            return False
+        return doc['size'] >= self.stream_threshold
 
-        for element in cur:
-            for doc in element['docs']:
-                if doc['doc_id'] == doc_id:
-                    return doc
+    @user_validate
+    def doc_iter_one(self, user, org_id, doc_id, prettify=True, doc=None, chunk_size=64 * 1024, coding=None):
+        '''
+        Returns generator of XML document chunks encoded with document encoding
+        (and compressed with content coding if given).
+        Document is fetched right away, so None is returned if there is no such document.
+        '''
+        if doc is None or ('data' not in doc and 'raw' not in doc):
+            doc = self.doc_find_one(user, org_id, doc_id, with_tree=doc is None or doc.get('format') != 'raw')
+            if not doc:
+                return None
+
+        if doc.get('format') == 'raw':
+            if coding == 'gzip':
+                return serializer.iter_slices(doc['raw'], chunk_size)
+            chunks = serializer.iter_gunzip(doc['raw'], chunk_size)
+        else:
+            if 'data' in doc:
+                tree, escaped = DocumentModel.stored_tree(doc['data'], doc.get('format', 'json'))
+            else:
+                tree, escaped = self.doc_tree(org_id, doc), False
+            chunks = serializer.iter_xml(tree, encoding=doc.get('encoding') or 'utf-8', prettify=prettify,
+                                         chunk_size=chunk_size, escaped=escaped)
+            chunks = metrics.iter_timed(chunks, CONVERSION_SECONDS.labels('json_to_xml'),
+                                        CONVERSION_BYTES.labels('json_to_xml'))
+        if coding is not None:
+            return compression.iter_compress(chunks, coding)
+        return chunks
+
+    def doc_tree(self, org_id, doc):
+        '''
+        Returns badgerfish tree of fetched document.
+        Tree of raw document is built on first demand and saved next to original bytes.
+        '''
+        if 'data' in doc:
+            return DocumentModel.load_data(doc['data'], doc.get('format', 'json'))
+
+        with CONVERSION_SECONDS.labels('xml_to_json').time():
+            tree = DocumentModel.raw_to_tree(doc['raw'], doc.get('encoding'))
+        if doc.get('size'):
+            CONVERSION_BYTES.labels('xml_to_json').observe(doc['size'])
+        # Blob content never changes, document one could have been replaced since it was fetched
+        if 'blob' in doc:
+            self.blobs_coll.update_one({'_id': doc['blob']}, {'$set': {'data': DocumentModel.escape_keys(tree)}})
+        else:
+            self.docs_coll.update_one(storage.version_filter(org_id, doc),
+                                      {'$set': {'data': DocumentModel.escape_keys(tree)}})
+        return tree
 
     def doc_remove_one(self, org_id, doc_id):
-        coll = self.db[self.collection_name]
-        result = coll.update_one({'org_id': org_id}, {'$pull': {'docs': {'doc_id': doc_id}}})
-        if result.modified_count > 0:
+        removed = self.__steps(storage.doc_remove(org_id, doc_id))
+        self.render_cache.discard_where(lambda key: key[0] == org_id and key[1] == doc_id)
+        self.aggregate_cache.discard_where(lambda key: key[0] == org_id and key[1] == doc_id)
+        if removed:
             return {'result': 1, 'doc_id': doc_id}
         return {'result': 0}
 
+    def docs_migrate(self, batch_size=500):
+        '''
+        Moves documents embedded into organization records ("docs" array) into documents collection.
+        Every batch is copied first and only then pulled from organization, so migration
+        could be safely interrupted and started again.
+        '''
+        orgs = self.db[self.collection_name]
+        docs = self.docs_coll
+        moved = 0
+
+        for org in orgs.find({'docs.0': {'$exists': True}}, {'org_id': 1, '_id': 0}):
+            org_id = org['org_id']
+            while True:
+                cur = orgs.find_one({'org_id': org_id}, {'docs': {'$slice': batch_size}, 'users': 0, '_id': 0})
+                batch = cur.get('docs') if cur else None
+                if not batch:
+                    break
+
+                requests = []
+                for doc in batch:
+                    doc['org_id'] = org_id
+                    requests.append(ReplaceOne({'org_id': org_id, 'doc_id': doc['doc_id']}, doc, upsert=True))
+                docs.bulk_write(requests, ordered=False)
+
+                doc_ids = [doc['doc_id'] for doc in batch]
+                orgs.update_one({'org_id': org_id}, {'$pull': {'docs': {'doc_id': {'$in': doc_ids}}}})
+                moved += len(batch)
+
+        return {'result': 1, 'moved': moved}
+
+    def docs_convert_format(self, storage_format='bson', batch_size=500):
+        '''
+        Rewrites stored documents into given storage format in batches.
+        Documents are read in both formats meanwhile, so conversion could run on a live DB.
+        Deduplicated documents (shared blobs) are left as they are.
+        '''
+        assert storage_format in ('json', 'bson'), 'storage_format should be json or bson'
+
+        coll = self.docs_coll
+        # Records without "format" field are JSON strings; raw documents are never rewritten
+        if storage_format == 'json':
+            query = {'format': 'bson', 'data': {'$exists': True}}
+        else:
+            query = {'format': {'$nin': ['bson', 'raw']}, 'data': {'$exists': True}}
+
+        converted = 0
+        last_id = None
+        while True:
+            if last_id:
+                query['_id'] = {'$gt': last_id}
+            batch = list(coll.find(query, {'data': 1, 'format': 1}).sort('_id', ASCENDING).limit(batch_size))
+            if not batch:
+                break
+
+            requests = []
+            for record in batch:
+                doc = DocumentModel(storage_format=storage_format)
+                doc.data = DocumentModel.load_data(record['data'], record.get('format', 'json'))
+                requests.append(UpdateOne({'_id': record['_id']},
+                                          {'$set': {'data': doc.data, 'format': storage_format}}))
+            coll.bulk_write(requests, ordered=False)
+
+            converted += len(batch)
+            last_id = batch[-1]['_id']
+
+        return {'result': 1, 'converted': converted}
+
+    def docs_extract_keys(self, batch_size=100):
+        '''
+        Rebuilds business keys of all documents of organizations having extraction rules
+        (e.g. after rules were changed). Returns number of processed documents.
+        '''
+        processed = 0
+        for org in self.db[self.collection_name].find({'key_rules': {'$exists': True}}, {'org_id': 1, '_id': 0}):
+            org_id = org['org_id']
+            self.rules_cache.discard(org_id)
+            key_rules = self.org_key_rules(org_id)
+            self.keys_coll.delete_many({'org_id': org_id})
+            records = []
+            for doc in self.__iter_attach_blobs(self.docs_coll.find({'org_id': org_id}, self.BATCH_FIELDS)):
+                if 'data' in doc:
+                    tree = DocumentModel.load_data(doc['data'], doc.get('format', 'json'))
+                else:
+                    tree = DocumentModel.raw_to_tree(doc['raw'], doc.get('encoding'))
+                records.extend(storage.key_records(org_id, doc['doc_id'], DocumentModel.extract_keys(tree, key_rules)))
+                processed += 1
+                if len(records) >= batch_size:
+                    self.keys_coll.insert_many(records, ordered=False)
+                    records = []
+            if records:
+                self.keys_coll.insert_many(records, ordered=False)
+        return {'result': 1, 'processed': processed}
+
+    def docs_index_text(self, batch_size=100):
+        '''
+        Rebuilds full-text index of all documents. Returns number of processed documents.
+        '''
+        self.terms_coll.delete_many({})
+        processed = 0
+        records = []
+        for doc in self.__iter_attach_blobs(self.docs_coll.find({}, dict(self.BATCH_FIELDS, org_id=1))):
+            if 'data' in doc:
+                tree = DocumentModel.load_data(doc['data'], doc.get('format', 'json'))
+            else:
+                tree = DocumentModel.raw_to_tree(doc['raw'], doc.get('encoding'))
+            records.extend(storage.term_records(doc['org_id'], doc['doc_id'], textindex.postings(tree)))
+            processed += 1
+            if processed % batch_size == 0:
+                self.terms_coll.insert_many(records, ordered=False)
+                records = []
+        if records:
+            self.terms_coll.insert_many(records, ordered=False)
+        return {'result': 1, 'processed': processed}
+
+    def docs_materialize(self, batch_size=100):
+        '''
+        Builds badgerfish trees of raw documents which have none yet.
+        Could be run as background job to keep structure-dependent features fast.
+        '''
+        materialized = 0
+        # Raw payloads are kept in documents or (deduplicated) in blobs, large ones in segment files
+        for coll in (self.docs_coll, self.blobs_coll):
+            query = {'format': 'raw', '$or': [{'raw': {'$exists': True}}, {'extent': {'$exists': True}}],
+                     'data': {'$exists': False}}
+            while True:
+                batch = self.__attach_blobs(list(coll.find(query, {'raw': 1, 'extent': 1, 'encoding': 1})
+                                                 .limit(batch_size)))
+                if not batch:
+                    break
+
+                requests = []
+                for record in batch:
+                    tree = DocumentModel.raw_to_tree(record['raw'], record.get('encoding'))
+                    requests.append(UpdateOne({'_id': record['_id']},
+                                              {'$set': {'data': DocumentModel.escape_keys(tree)}}))
+                coll.bulk_write(requests, ordered=False)
+                materialized += len(batch)
+
+        return {'result': 1, 'materialized': materialized}
+
+    def segments_compact(self, min_garbage=0.5, grace=600):
+        '''
+        Reclaims space of removed payloads: live payloads of segments with min_garbage share (or more)
+        of unused bytes are copied to the active segment, then those segments are deleted.
+        Active segment is never compacted, nor any segment appended to within grace seconds:
+        payload written there may still wait for its record to be saved.
+        '''
+        if self.segments is None:
+            return {'result': 0, 'error': 'Segment files are not used.'}
+        sizes = self.segments.segments()
+        if not sizes:
+            return {'result': 1, 'segments': 0, 'moved': 0, 'reclaimed': 0}
+        active = max(sizes)
+
+        # segment -> [(collection, record ID, extent)]
+        live = {}
+        for coll in (self.docs_coll, self.blobs_coll):
+            for record in coll.find({'extent': {'$exists': True}}, {'extent': 1}):
+                live.setdefault(record['extent'][0], []).append((coll, record['_id'], record['extent']))
+
+        compacted = moved = reclaimed = 0
+        for segment, size in sorted(sizes.items()):
+            used = sum(extent[2] for coll, record_id, extent in live.get(segment, ()))
+            if segment == active or size - used < size * min_garbage:
+                continue
+            if time.time() - self.segments.modified(segment) < grace:
+                continue
+            for coll, record_id, extent in live.get(segment, ()):
+                new_extent = self.segments.append(self.segments.read(extent))
+                # Record removed meanwhile just leaves garbage in the new segment
+                coll.update_one({'_id': record_id, 'extent': extent}, {'$set': {'extent': new_extent}})
+                moved += 1
+            self.segments.remove(segment)
+            compacted += 1
+            reclaimed += size - used
+        return {'result': 1, 'segments': compacted, 'moved': moved, 'reclaimed': reclaimed}
+
+    def doc_payload_file(self, org_id, doc):
+        '''
+        Returns file-like object of stored (gzip compressed) payload of raw document kept in segment files,
+        None if document payload is kept in database. doc - document metadata.
+        '''
+        if self.segments is None or doc.get('format') != 'raw':
+            return None
+        extent = doc.get('extent')
+        if extent is None and 'blob' in doc:
+            blob = self.blobs_coll.find_one({'_id': doc['blob']}, {'extent': 1})
+            extent = blob and blob.get('extent')
+        if extent is None:
+            return None
+        return self.segments.open(extent)
+
+    def __render_key(self, org_id, doc, method, prettify, coding=None):
+        key = render_key(org_id, doc, method, prettify, self.doc_is_streamed(doc, method))
+        return key + (coding,) if coding else key
+
+    @staticmethod
+    def __list_cursor_encode(order_by, doc):
+        if order_by == 'doc_id':
+            return str(doc['doc_id'])
+        # Milliseconds since epoch - precision of BSON dates
+        delta = doc['last_modified'] - datetime(1970, 1, 1)
+        return '{}.{}'.format(delta // timedelta(milliseconds=1), doc['doc_id'])
+
+    @staticmethod
+    def __list_cursor_decode(order_by, value):
+        if order_by == 'doc_id':
+            return None, int(value)
+        millis, doc_id = value.split('.')
+        return datetime(1970, 1, 1) + timedelta(milliseconds=int(millis)), int(doc_id)
+
     def __collection_check_exists(self, coll_name):
         coll = self.db[coll_name]
         if coll.count() == 0: # -> collection is empty_so_doesnt_exists
@@ -449,6 +1389,12 @@ class Driver:
         return output
 
 
+# Every public Driver method is timed
+for name, func in list(vars(Driver).items()):
+    if not name.startswith('_') and inspect.isfunction(func):
+        setattr(Driver, name, tracked(func))
+
+
 # Organization model
 class OrganizationModel:
 
@@ -508,33 +1454,70 @@ class OrganizationModel:
 # Document model
 class DocumentModel:
 
-    def __init__(self, doc_id=0, encoding='utf-8', *args, **kwargs):
+    # json - badgerfish tree serialized to JSON string
+    # bson - badgerfish tree stored as subdocument (with keys escaped for MongoDB)
+    # raw - original XML bytes compressed with gzip; tree (as in bson) is built on demand
+    STORAGE_FORMATS = ('json', 'bson', 'raw')
+
+    # MongoDB field names can't start with '$' or contain '.',
+    # both are common in badgerfish keys ("$" text key, "CatalogObject.Name" tags)
+    KEY_ESCAPES = converter.KEY_ESCAPES
+
+    def __init__(self, doc_id=0, encoding='utf-8', storage_format='json', *args, key_rules=None, text_index=False,
+                 **kwargs):
+        assert storage_format in self.STORAGE_FORMATS, \
+            'storage_format should be one of %s' % str(self.STORAGE_FORMATS)
         self._data = None
+        # Business keys extraction rules ((name, parsed path) pairs) and keys found while parsing
+        self.key_rules = key_rules
+        self.keys = None
+        # Full-text postings ({term: positions}) built while parsing if text_index
+        self.text_index = text_index
+        self.terms = None
+        # Parsed tree, kept only if asked for (e.g. to compare with previous version)
+        self.tree = None
+        # gzip compressed original XML (raw storage format only)
+        self.raw = None
+        self.size = None
+        self.sha256 = None
         self.doc_id = doc_id
         self.encoding = encoding
+        self.storage_format = storage_format
         self.timestamp = datetime.now()
 
     def to_dict(self):
-        assert self.data, 'need to load data first before forming dict'
+        assert self.data or self.raw, 'need to load data first before forming dict'
 
         document = {
                 'doc_id': self.doc_id,
                 'last_modified': self.timestamp,
-                'encoding': self.encoding,
-                'data': self.data
+                'encoding': self.encoding
         }
+        if self.raw is not None:
+            document['raw'] = Binary(self.raw)
+        else:
+            document['data'] = self.data
+        if self.storage_format != 'json':
+            document['format'] = self.storage_format
+        if self.sha256:
+            document['size'] = self.size
+            document['sha256'] = self.sha256
         return document
 
     def to_xml(self):
-        return self.json_to_xml(self._data)
+        if self.raw is not None:
+            return gzip.decompress(self.raw).decode(self.encoding)
+        tree, escaped = self.stored_tree(self._data, self.storage_format)
+        return self.json_to_xml(tree, escaped=escaped)
 
     @classmethod
-    def from_dict(cls, dic):
+    def from_dict(cls, dic, storage_format='json'):
         assert isinstance(dic, dict), 'should be of dict type, not %s' % type(dic)
 
         if 'data' in dic.keys():
-            document = cls()
-            document.data = dic['data']
+            document = cls(storage_format=storage_format)
+            document.data = cls.load_data(dic['data'], dic.get('format', 'json')) \
+                if isinstance(dic['data'], dict) else dic['data']
             if 'encoding' in dic.keys():
                 document.encoding = dic['encoding']
         else:
@@ -549,7 +1532,7 @@ class DocumentModel:
         '''
         try:
             tree = fromstring(doc)
-            data = dumps(bf.data(tree))
+            data = dumps(converter.data(tree))
         except TypeError as err:
             print('ERROR: doc should be of string type, not %s' % type(doc))
             raise
@@ -562,7 +1545,113 @@ class DocumentModel:
         return data
 
     @classmethod
-    def json_to_xml(cls, doc, default_root_name='root', method='xml', encoding='utf-8', prettify=True):
+    def from_stream(cls, stream, encoding='utf-8', storage_format='json', max_size=None, max_depth=None,
+                    key_rules=None, text_index=False, keep_tree=False):
+        '''
+        Builds document reading XML from file-like stream with bounded memory
+        '''
+        document = cls(encoding=encoding, storage_format=storage_format, key_rules=key_rules, text_index=text_index)
+        document.take_ingest(document.stream_ingest(max_size, max_depth, keep_tree).read(stream), keep_tree)
+        return document
+
+    def stream_ingest(self, max_size=None, max_depth=None, keep_tree=False):
+        '''
+        Returns StreamIngest building what this document needs; XML is fed to it by caller
+        '''
+        raw = self.storage_format == 'raw'
+        # Raw documents get tree only to index or keep it
+        return StreamIngest(self.encoding, max_size=max_size, max_depth=max_depth,
+                            build_tree=not raw or self.indexed or keep_tree, keep_raw=raw)
+
+    def take_ingest(self, ingest, keep_tree=False):
+        # Sets content, keys and postings of finished ingest
+        if keep_tree:
+            self.tree = ingest.tree
+        if self.indexed:
+            self.index_tree(ingest.tree)
+        if self.storage_format == 'raw':
+            self.raw = ingest.raw
+        else:
+            self.data = ingest.tree
+        self.size = ingest.size
+        self.sha256 = ingest.sha256
+
+    @property
+    def indexed(self):
+        return bool(self.key_rules or self.text_index)
+
+    def index_tree(self, tree):
+        # Business keys and text postings are taken while tree is at hand
+        if self.key_rules:
+            self.keys = self.extract_keys(tree, self.key_rules)
+        if self.text_index:
+            self.terms = textindex.postings(tree)
+
+    @classmethod
+    def extract_keys(cls, tree, key_rules):
+        '''
+        Returns list of [name, value] business keys found in badgerfish tree by rules
+        '''
+        return [[name, value] for name, path in key_rules for value in paths.values(tree, path)]
+
+    @classmethod
+    def parse(cls, doc, encoding=None):
+        '''
+        Parses XML given as bytes (or str) trusting given encoding over XML declaration
+        '''
+        if isinstance(doc, str):
+            doc = doc.encode(encoding or 'utf-8')
+        if encoding:
+            return fromstring(doc, XMLParser(encoding=encoding))
+        return fromstring(doc)
+
+    @classmethod
+    def raw_to_tree(cls, raw, encoding=None):
+        '''
+        Converts stored (compressed) raw XML to badgerfish tree
+        '''
+        return converter.data(cls.parse(gzip.decompress(raw), encoding))
+
+    @classmethod
+    def load_data(cls, data, storage_format='json'):
+        '''
+        Returns badgerfish tree (SON) of stored document data
+        '''
+        if storage_format in ('bson', 'raw'):
+            return cls.escape_keys(data, reverse=True)
+        return loads(data, object_pairs_hook=SON)
+
+    @classmethod
+    def stored_tree(cls, data, storage_format='json'):
+        '''
+        Returns (badgerfish tree, escaped) of stored document data to render: tree stored as BSON
+        is taken as decoded, with escaped keys, instead of being copied by load_data
+        '''
+        if storage_format in ('bson', 'raw'):
+            return data, True
+        return loads(data, object_pairs_hook=SON), False
+
+    @classmethod
+    def escape_keys(cls, tree, reverse=False):
+        '''
+        Copies badgerfish tree replacing characters MongoDB doesn't allow in field names
+        (or restoring them if reverse)
+        '''
+        if isinstance(tree, dict):
+            output = SON()
+            for key, value in tree.items():
+                if reverse:
+                    key = key.replace(cls.KEY_ESCAPES[0][1], '$').replace(cls.KEY_ESCAPES[1][1], '.')
+                else:
+                    key = key.replace('$', cls.KEY_ESCAPES[0][1]).replace('.', cls.KEY_ESCAPES[1][1])
+                output[key] = cls.escape_keys(value, reverse)
+            return output
+        elif isinstance(tree, list):
+            return [cls.escape_keys(value, reverse) for value in tree]
+        return tree
+
+    @classmethod
+    def json_to_xml(cls, doc, default_root_name='root', method='xml', encoding='utf-8', prettify=True, escaped=False):
         assert any([True if f in method else False for f in ['html', 'xml', 'text', 'c14n']]), \
             'format argument should be one of html/xml/text only!'
 
@@ -574,53 +1663,10 @@ class DocumentModel:
             elif isinstance(doc, (dict, SON)):
                 json_dict = doc
 
-            # Forming root element with namespace(s) if present;
-            # Cleaning JSON document before creating XML
-            if len(json_dict.keys()) == 1:
-                for root_element in json_dict.keys():
-                    continue
+            # Namespaces are declared where tree declares them ("@xmlns" at any level)
+            xml_tree = converter.etree(json_dict, default_root_name, escaped)
 
-                attribs = []
-                text = None
-                uri = None
-
-                for key in json_dict[root_element].keys():
-                    if '@' in key:
-                        if key == '@xmlns':
-                            ns_counter = 0
-                            NS_MAP = dict()
-                            for prefix in json_dict[root_element][key].keys():
-                                if prefix != '$':
-                                    uri = json_dict[root_element][key][prefix]
-                                else:
-                                    uri = json_dict[root_element][key][prefix]
-                                    prefix = 'ns%d' % ns_counter
-                                    ns_counter += 1
-                                NS_MAP[prefix] = uri
-                        else:
-                            attribs.append((key, json_dict[root_element][key]))
-                    elif '$' in key:
-                        text = json_dict[root_element][key]
-
-                if uri:
-                    root = Element('{0}{1}'.format('{' + uri + '}', root_element), nsmap=NS_MAP)
-                else:
-                    root = Element(root_element)
-
-                for attr in attribs:
-                    root.set(str(attr[0].lstrip('@')), str(attr[1]))
-                    del json_dict[root_element][attr[0]]
-                root.text = text
-                if text: del json_dict[root_element]['$']
-
-                # Remove root key from JSON. Its value would become subelement(s) of created XML
-                body = json_dict.pop(root_element)
-            else:
-                root = Element(default_root_name)
-
-            xml_tree = bf.etree(body, root=root)
-
-            if isinstance(root, ET._Element):
+            if converter.LXML:
                 tree = xml_tree.getroottree()
                 file_object = BytesIO()
 
@@ -661,10 +1707,46 @@ class DocumentModel:
 
     @data.setter
     def data(self, data):
-        if not self.__json_validator(data):
-            self._data = self.xml_to_json(data)
+        if isinstance(data, dict):
+            # already converted badgerfish tree
+            tree = data
+        elif self.__json_validator(data):
+            if self.storage_format == 'json' and not self.indexed:
+                self._data = data
+                return
+            tree = loads(data, object_pairs_hook=SON)
+            if self.storage_format == 'json':
+                self.index_tree(tree)
+                self._data = data
+                return
+        else:
+            source = data if isinstance(data, bytes) else data.encode(self.encoding)
+            self.size = len(source)
+            self.sha256 = sha256(source).hexdigest()
+
+            if self.storage_format == 'raw':
+                # Well-formedness check only, conversion is postponed until needed
+                root = self.parse(source, self.encoding)
+                if self.indexed:
+                    self.index_tree(converter.data(root))
+                self.raw = gzip.compress(source, compresslevel=6)
+                self._data = None
+                return
+            if self.storage_format == 'json' and not self.indexed:
+                self._data = self.xml_to_json(data)
+                return
+            tree = converter.data(fromstring(data))
+
+        if self.indexed:
+            self.index_tree(tree)
+
+        if self.storage_format == 'raw':
+            # There are no original bytes to keep for already converted document
+            self.storage_format = 'bson'
+        if self.storage_format == 'bson':
+            self._data = self.escape_keys(tree)
         else:
-            self._data = data
+            self._data = dumps(tree)
 
     def __json_validator(self, doc):
       try:
@@ -674,7 +1756,7 @@ class DocumentModel:
       return True
 
     def __str__(self):
-        return self.json_to_xml(self._data)
+        return self.to_xml()
 
 # User model
 class UserModel:
@@ -0,0 +1,231 @@
+'''
+XML <-> badgerfish conversion.
+
+Element "<v8msg:Header xmlns:v8msg="http://v8.1c.ru/messages" a="1">text<b/></v8msg:Header>" becomes
+{'v8msg:Header': {'@xmlns': {'v8msg': 'http://v8.1c.ru/messages'}, '@a': '1', '$': 'text', 'b': {}}}
+    - tags keep their prefixes, namespaces are declared with '@xmlns' where XML declares them
+      ('$' is default namespace), so documents are restored with the same prefixes
+    - text and attribute values are kept as strings, so '000001' stays '000001'
+    - repeated elements become list
+Trees are walked without recursion and built of plain dicts (ordered in Python 3.7+).
+Trees with tags in Clark notation ("{uri}tag"), as xmljson makes them, are understood as well.
+'''
+import sys
+
+try:
+    from lxml.etree import Element, SubElement
+    LXML = True
+except ImportError:
+    from xml.etree.ElementTree import Element, SubElement
+    LXML = False
+
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+# Characters MongoDB doesn't allow in field names and their replacements in trees stored as BSON
+KEY_ESCAPES = (('$', '\uff04'), ('.', '\uff0e'))
+
+
+def tostring(value):
+    # Scalars as xmljson badgerfish writes them
+    if value is True:
+        return 'true'
+    elif value is False:
+        return 'false'
+    elif value is None:
+        return ''
+    return str(value)
+
+
+def text_value(text):
+    # Whitespace-only text is formatting, any other text is kept as is
+    if text and not text.isspace():
+        return text
+    return None
+
+
+def name(clark, prefix, names):
+    '''
+    Returns badgerfish key of parsed (Clark notation) name.
+    Keys are interned and memoized in names, as the same tags repeat all over the document.
+    '''
+    key = names.get((clark, prefix))
+    if key is None:
+        local = clark.rsplit('}', 1)[-1] if clark[0] == '{' else clark
+        key = sys.intern(prefix + ':' + local if prefix else local)
+        names[(clark, prefix)] = key
+    return key
+
+
+def start_value(elem, parent_nsmap, names, dict_type=dict):
+    '''
+    Returns (key, value, nsmap) of element with attributes and namespaces declared by element,
+    but without text and children.
+    '''
+    value = dict_type()
+    if not LXML:
+        # xml.etree drops prefixes, names stay in Clark notation
+        for attr, attr_value in elem.attrib.items():
+            value['@' + sys.intern(attr)] = attr_value
+        return name(elem.tag, None, names), value, parent_nsmap
+
+    nsmap = elem.nsmap
+    if nsmap != parent_nsmap:
+        declared = dict_type()
+        for prefix, uri in nsmap.items():
+            if parent_nsmap.get(prefix) != uri:
+                declared['$' if prefix is None else prefix] = uri
+        if declared:
+            value['@xmlns'] = declared
+
+    if elem.attrib:
+        prefixes = None
+        for attr, attr_value in elem.attrib.items():
+            prefix = None
+            if attr[0] == '{':
+                if prefixes is None:
+                    prefixes = {uri: prefix for prefix, uri in nsmap.items() if prefix}
+                    prefixes[XML_NAMESPACE] = 'xml'
+                prefix = prefixes.get(attr[1:].split('}', 1)[0])
+            value['@' + name(attr, prefix, names)] = attr_value
+    return name(elem.tag, elem.prefix, names), value, nsmap
+
+
+def attach(parent, key, value):
+    # Second element with the same tag turns parent entry into list
+    if key not in parent:
+        parent[key] = value
+    elif isinstance(parent[key], list):
+        parent[key].append(value)
+    else:
+        parent[key] = [parent[key], value]
+
+
+def data(root, dict_type=dict):
+    '''
+    Converts element (lxml or xml.etree) into badgerfish tree
+    '''
+    names = {}
+    result = dict_type()
+    # (element, container to attach to, parent namespaces)
+    stack = [(root, result, {})]
+    while stack:
+        elem, parent, parent_nsmap = stack.pop()
+        key, value, nsmap = start_value(elem, parent_nsmap, names, dict_type)
+        text = text_value(elem.text)
+        if text is not None:
+            value['$'] = text
+        attach(parent, key, value)
+
+        children = [child for child in elem if isinstance(child.tag, str)]
+        for child in reversed(children):
+            stack.append((child, value, nsmap))
+    return result
+
+
+def unescape(key, names=None):
+    '''
+    Returns key of tree stored as BSON as it was in badgerfish tree, memoized in names if given
+    '''
+    if names is not None:
+        name = names.get(key)
+        if name is None:
+            name = names[key] = unescape(key)
+        return name
+    for char, escaped in KEY_ESCAPES:
+        if escaped in key:
+            key = key.replace(escaped, char)
+    return key
+
+
+def split(value, escaped=False):
+    '''
+    Splits badgerfish element value into attributes, declared namespaces, text and children list.
+    escaped - keys are escaped as in trees stored as BSON (children keys are left escaped).
+    '''
+    attrib = []
+    nsmap = None
+    text = None
+    children = []
+    if not isinstance(value, dict):
+        return attrib, nsmap, tostring(value), children
+
+    for key, item in value.items():
+        if escaped and key[0] != '@':
+            if key == KEY_ESCAPES[0][1]:
+                text = tostring(item)
+            elif isinstance(item, list):
+                for element in item:
+                    children.append((key, element))
+            else:
+                children.append((key, item))
+            continue
+        if escaped:
+            key = unescape(key)
+        if key == '$':
+            text = tostring(item)
+        elif key == '@xmlns' and isinstance(item, dict):
+            nsmap = {}
+            for prefix, uri in item.items():
+                prefix = unescape(prefix) if escaped else prefix
+                nsmap[None if prefix == '$' else prefix] = uri
+        elif key[0] == '@':
+            attrib.append((key[1:], tostring(item)))
+        elif isinstance(item, list):
+            for element in item:
+                children.append((key, element))
+        else:
+            children.append((key, item))
+    return attrib, nsmap, text, children
+
+
+def resolve(key, scope, attribute=False):
+    '''
+    Returns Clark notation name of badgerfish key using namespaces in scope (prefix -> uri)
+    '''
+    if key[0] == '{':
+        return key
+    prefix, sep, local = key.rpartition(':')
+    if sep:
+        uri = XML_NAMESPACE if prefix == 'xml' else scope.get(prefix)
+        if uri is None:
+            raise ValueError('Namespace prefix "%s" is not declared' % prefix)
+        return '{%s}%s' % (uri, local)
+    if not attribute and scope.get(None):
+        return '{%s}%s' % (scope[None], local)
+    return local
+
+
+def etree(tree, default_root_name='root', escaped=False):
+    '''
+    Converts badgerfish tree into element; escaped - tree is stored as BSON, with escaped keys
+    '''
+    if isinstance(tree, dict) and len(tree) == 1:
+        key, value = next(iter(tree.items()))
+    else:
+        key, value = default_root_name, tree
+
+    root = None
+    names = {} if escaped else None
+    # (parent element, key, value, namespaces in scope)
+    stack = [(None, key, value, {})]
+    while stack:
+        parent, key, value, scope = stack.pop()
+        attrib, nsmap, text, children = split(value, escaped)
+        if nsmap:
+            scope = dict(scope)
+            scope.update(nsmap)
+
+        tag = resolve(unescape(key, names) if escaped else key, scope)
+        if LXML:
+            elem = Element(tag, nsmap=nsmap) if parent is None else SubElement(parent, tag, nsmap=nsmap)
+        else:
+            elem = Element(tag) if parent is None else SubElement(parent, tag)
+        for attr, attr_value in attrib:
+            elem.set(resolve(attr, scope, attribute=True), attr_value)
+        if text:
+            elem.text = text
+
+        if root is None:
+            root = elem
+        for child_key, child_value in reversed(children):
+            stack.append((elem, child_key, child_value, scope))
+    return root
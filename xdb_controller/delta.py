@@ -0,0 +1,104 @@
+'''
+Structural deltas between badgerfish trees.
+
+Delta turns one tree into another and holds only what differs:
+    None                    - no changes
+    ['r', value]            - replace with value
+    ['d', {key: op}, order] - dict: op is delta of the key value or ['x'] for removed key;
+                              order - list of resulting keys if it differs from the natural one
+                              (kept keys in old order, then added keys)
+    ['i', [[index, delta]]] - list of the same length with changed items
+    ['s', start, end, items]- list with old[start:end] replaced by items
+'''
+
+
+def same(old, new):
+    # Equality which takes dict keys order into account (it's elements order of XML)
+    if isinstance(old, dict) and isinstance(new, dict):
+        return list(old) == list(new) and all(same(value, new[key]) for key, value in old.items())
+    if isinstance(old, list) and isinstance(new, list):
+        return len(old) == len(new) and all(same(value, new[index]) for index, value in enumerate(old))
+    return old == new
+
+
+def diff(old, new):
+    '''
+    Returns delta turning old tree into new one
+    '''
+    if same(old, new):
+        return None
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = {}
+        for key, value in new.items():
+            if key not in old:
+                ops[key] = ['r', value]
+            else:
+                delta = diff(old[key], value)
+                if delta is not None:
+                    ops[key] = delta
+        for key in old:
+            if key not in new:
+                ops[key] = ['x']
+        natural = [key for key in old if key in new] + [key for key in new if key not in old]
+        order = list(new) if natural != list(new) else None
+        return ['d', ops, order]
+
+    if isinstance(old, list) and isinstance(new, list):
+        # Repeated elements: unchanged head and tail are skipped
+        start = 0
+        limit = min(len(old), len(new))
+        while start < limit and same(old[start], new[start]):
+            start += 1
+        tail = 0
+        while tail < limit - start and same(old[-1 - tail], new[-1 - tail]):
+            tail += 1
+
+        if len(old) == len(new):
+            return ['i', [[index, diff(old[index], new[index])] for index in range(start, len(old) - tail)
+                          if not same(old[index], new[index])]]
+        return ['s', start, len(old) - tail, new[start:len(new) - tail]]
+
+    return ['r', new]
+
+
+def apply(tree, delta):
+    '''
+    Returns new tree built from tree and delta; tree itself is not changed
+    '''
+    if delta is None:
+        return tree
+
+    kind = delta[0]
+    if kind == 'r':
+        return delta[1]
+
+    if kind == 'd':
+        ops, order = delta[1], delta[2]
+        output = type(tree)()
+        for key, value in tree.items():
+            op = ops.get(key)
+            if op is None:
+                output[key] = value
+            elif op[0] != 'x':
+                output[key] = apply(value, op)
+        for key, op in ops.items():
+            if key not in tree:
+                output[key] = op[1]
+        if order:
+            reordered = type(tree)()
+            for key in order:
+                reordered[key] = output[key]
+            output = reordered
+        return output
+
+    if kind == 'i':
+        output = list(tree)
+        for index, item_delta in delta[1]:
+            output[index] = apply(output[index], item_delta)
+        return output
+
+    if kind == 's':
+        return tree[:delta[1]] + list(delta[3]) + tree[delta[2]:]
+
+    raise ValueError('Unknown delta operation "%s"' % kind)
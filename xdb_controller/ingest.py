@@ -0,0 +1,153 @@
+from hashlib import sha256
+import tarfile
+import zlib
+from .converter import start_value, text_value, attach
+
+try:
+    from lxml.etree import XMLPullParser, XMLSyntaxError
+    # libxml2 refuses documents nested deeper than 256 levels unless huge_tree is on
+    PARSER_OPTIONS = {'huge_tree': True}
+except ImportError:
+    from xml.etree.ElementTree import XMLPullParser, ParseError as XMLSyntaxError
+    PARSER_OPTIONS = {}
+
+
+class IngestLimitError(Exception):
+    pass
+
+
+class StreamIngest:
+    '''
+    Incremental XML ingest with bounded memory.
+
+    Reads XML from file-like stream chunk by chunk, checks well-formedness and limits
+    (total size in bytes and nesting depth) while parsing. Parsed elements are dropped
+    as soon as they are processed, so only the stored representation is kept:
+        build_tree=True - badgerfish tree (same as converter.data gives)
+        keep_raw=True - gzip compressed original bytes
+    '''
+
+    def __init__(self, encoding=None, max_size=None, max_depth=None, build_tree=True,
+                 keep_raw=False, chunk_size=64 * 1024):
+        self.encoding = encoding
+        self.max_size = max_size
+        self.max_depth = max_depth
+        self.build_tree = build_tree
+        self.keep_raw = keep_raw
+        self.chunk_size = chunk_size
+
+        self.size = 0
+        self.tree = None
+        self.raw = None
+        self.__hash = sha256()
+        self.__raw_chunks = []
+        # gzip container, same as gzip.compress gives
+        self.__compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if keep_raw else None
+        # Depth limit is checked here, parser's own one is lifted only when there is one to check
+        options = PARSER_OPTIONS if max_depth else {}
+        if encoding:
+            try:
+                self.__parser = XMLPullParser(events=('start', 'end'), encoding=encoding, **options)
+            except TypeError:
+                # xml.etree parser has no encoding override
+                self.__parser = XMLPullParser(events=('start', 'end'))
+        else:
+            self.__parser = XMLPullParser(events=('start', 'end'), **options)
+        # [element, badgerfish key, badgerfish value, namespaces, text taken]
+        self.__stack = []
+        self.__names = {}
+
+    @property
+    def sha256(self):
+        return self.__hash.hexdigest()
+
+    def read(self, stream):
+        while True:
+            chunk = stream.read(self.chunk_size)
+            if not chunk:
+                break
+            self.feed(chunk)
+        return self.close()
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if self.max_size and self.size > self.max_size:
+            raise IngestLimitError('Document exceeds size limit of %d bytes' % self.max_size)
+
+        self.__hash.update(chunk)
+        if self.__compressor:
+            self.__raw_chunks.append(self.__compressor.compress(chunk))
+
+        try:
+            self.__parser.feed(chunk)
+        except XMLSyntaxError as err:
+            self.__check_parser_limit(err)
+        self.__process_events()
+
+    def close(self):
+        try:
+            self.__parser.close()
+        except XMLSyntaxError as err:
+            self.__check_parser_limit(err)
+        self.__process_events()
+        if self.__compressor:
+            self.__raw_chunks.append(self.__compressor.flush())
+            self.raw = b''.join(self.__raw_chunks)
+            self.__raw_chunks = []
+        return self
+
+    def __process_events(self):
+        stack = self.__stack
+        for event, elem in self.__parser.read_events():
+            if event == 'start':
+                if self.max_depth and len(stack) >= self.max_depth:
+                    raise IngestLimitError('Document exceeds nesting depth limit of %d' % self.max_depth)
+                if not self.build_tree:
+                    stack.append([elem, None, None, None, True])
+                    continue
+
+                parent_nsmap = {}
+                if stack:
+                    self.__take_text(stack[-1])
+                    parent_nsmap = stack[-1][3]
+                key, value, nsmap = start_value(elem, parent_nsmap, self.__names)
+                stack.append([elem, key, value, nsmap, False])
+            else:
+                entry = stack.pop()
+                if self.build_tree:
+                    self.__take_text(entry)
+                    if stack:
+                        attach(stack[-1][2], entry[1], entry[2])
+                    else:
+                        self.tree = {entry[1]: entry[2]}
+
+                # Processed element is not needed anymore
+                elem.clear()
+                if stack:
+                    stack[-1][0].remove(elem)
+
+    def __check_parser_limit(self, err):
+        # Nesting limit of parser itself is the same "too large" case as ours, anything else is corrupted data
+        if 'Excessive depth' in str(err):
+            raise IngestLimitError('Document exceeds nesting depth limit of %d' % (self.max_depth or 256))
+        raise err
+
+    def __take_text(self, entry):
+        # Text goes before children, as converter.data puts it
+        if entry[4]:
+            return
+        entry[4] = True
+        text = text_value(entry[0].text)
+        if text is not None:
+            entry[2]['$'] = text
+
+
+def iter_tar(stream):
+    '''
+    Yields (name, file-like) of regular files of (optionally compressed) tar archive read as stream.
+    Every file object is valid only until the next one is taken.
+    '''
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for member in archive:
+            if member.isfile():
+                yield member.name, archive.extractfile(member)
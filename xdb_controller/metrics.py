@@ -0,0 +1,303 @@
+'''
+Counters, gauges and histograms exposed in Prometheus text format.
+
+Metric is updated in memory under its own lock, so hot paths pay a dict lookup and a few additions.
+Servers running several worker processes set shared directory (Registry.set_directory): every process
+writes snapshot of its metrics there (Registry.flush, at most every flush_interval seconds and at exit),
+scrape of any worker merges snapshots of all of them. Counters and histograms are summed over all
+snapshots, gauges only over snapshots of processes still running. Directory should be emptied
+when server starts.
+'''
+import atexit
+from bisect import bisect_left
+import json
+import math
+import os
+from threading import Lock
+import time
+
+# Seconds, from 1 ms to 1 min
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+# Bytes, 1 KB to 1 GB, powers of 4
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(11))
+
+SNAPSHOT_SUFFIX = '.metrics.json'
+
+
+class _Child:
+    # Value of one labels combination
+
+    def __init__(self, metric):
+        self._lock = metric.lock
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def dump(self):
+        return self.value
+
+
+class _HistogramChild:
+
+    def __init__(self, metric):
+        self._lock = metric.lock
+        self._buckets = metric.buckets
+        # Observations per bucket (not cumulative), last one is +Inf
+        self.counts = [0] * (len(metric.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def dump(self):
+        return self.counts + [self.sum]
+
+
+class _Timer:
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = Lock()
+        # labels values -> child
+        self.children = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values):
+        # values - strings, one per label name
+        child = self.children.get(values)
+        if child is None:
+            assert len(values) == len(self.labelnames), '%s needs labels %s' % (self.name, self.labelnames)
+            with self.lock:
+                child = self.children.setdefault(values, self._child())
+        return child
+
+    def _child(self):
+        return _Child(self)
+
+    def dump(self):
+        with self.lock:
+            return [[list(values), child.dump()] for values, child in self.children.items()]
+
+    def samples(self, values):
+        # (name suffix, [(label, value)], value) tuples of dumped values
+        for labels, value in values:
+            yield '', list(zip(self.labelnames, labels)), value
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _child(self):
+        return _HistogramChild(self)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self, values):
+        bounds = [_format_value(bound) for bound in self.buckets] + ['+Inf']
+        for labels, value in values:
+            total = 0
+            labels = list(zip(self.labelnames, labels))
+            for bound, count in zip(bounds, value):
+                total += count
+                yield '_bucket', labels + [('le', bound)], total
+            yield '_sum', labels, value[-1]
+            yield '_count', labels, total
+
+
+class Registry:
+
+    def __init__(self, flush_interval=1.0):
+        self.metrics = {}
+        # Callables run before metrics are read, e.g. to copy counters kept elsewhere
+        self.collectors = []
+        self.directory = None
+        self.flush_interval = flush_interval
+        self.__flushed = 0.0
+
+    def register(self, metric):
+        assert metric.name not in self.metrics, 'Metric %s is already registered' % metric.name
+        self.metrics[metric.name] = metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def set_directory(self, path):
+        '''
+        Shares metrics of this process with others using the same directory
+        '''
+        os.makedirs(path, exist_ok=True)
+        if self.directory is None:
+            atexit.register(self.flush)
+        self.directory = path
+
+    def dump(self):
+        # {metric name: [[labels values, value]]} of this process
+        for collector in self.collectors:
+            collector()
+        return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def flush(self):
+        # Writes snapshot of this process metrics into shared directory
+        if self.directory is None:
+            return
+        self.__flushed = time.monotonic()
+        path = os.path.join(self.directory, '%d%s' % (os.getpid(), SNAPSHOT_SUFFIX))
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.dump(), file)
+        os.replace(path + '.tmp', path)
+
+    def maybe_flush(self):
+        # Cheap enough to call after every request
+        if self.directory is not None and time.monotonic() - self.__flushed >= self.flush_interval:
+            self.flush()
+
+    def collect(self):
+        '''
+        Returns {metric name: [[labels values, value]]} of all processes
+        '''
+        if self.directory is None:
+            return self.dump()
+
+        self.flush()
+        merged = {name: {} for name in self.metrics}
+        for name in os.listdir(self.directory):
+            if not name.endswith(SNAPSHOT_SUFFIX):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            alive = _process_alive(int(name[:-len(SNAPSHOT_SUFFIX)]))
+            for metric_name, values in snapshot.items():
+                metric = self.metrics.get(metric_name)
+                if metric is None or (metric.TYPE == 'gauge' and not alive):
+                    continue
+                output = merged[metric_name]
+                for labels, value in values:
+                    key = tuple(labels)
+                    if key not in output:
+                        output[key] = value
+                    elif isinstance(value, list):
+                        output[key] = [total + item for total, item in zip(output[key], value)]
+                    else:
+                        output[key] += value
+        return {name: [[list(labels), value] for labels, value in values.items()]
+                for name, values in merged.items()}
+
+    def exposition(self):
+        '''
+        Returns metrics of all processes in Prometheus text format
+        '''
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append('# HELP %s %s' % (name, metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (name, metric.TYPE))
+            for suffix, labels, value in metric.samples(sorted(values)):
+                text = ','.join('%s="%s"' % (label, _escape(value)) for label, value in labels)
+                lines.append('%s%s%s %s' % (name, suffix, '{%s}' % text if text else '', _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if value.is_integer():
+            return str(int(value))
+    return repr(value)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def iter_timed(chunks, seconds, size):
+    '''
+    Passes chunks through, observing time spent producing them (not consuming) and their total bytes
+    '''
+    total = elapsed = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        elapsed += time.perf_counter() - start
+        total += len(chunk)
+        yield chunk
+        start = time.perf_counter()
+    seconds.observe(elapsed + time.perf_counter() - start)
+    size.observe(total)
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
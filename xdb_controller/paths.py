@@ -0,0 +1,77 @@
+'''
+Path expressions selecting values of badgerfish document trees.
+
+Path is "/" separated list of element local names (namespace prefixes are ignored) starting from root element,
+e.g. Message/Body/DocumentObject.ПоступлениеТоваров/Товары/Row/Сумма; "*" matches any element,
+leading "//" lets path start at any depth and last step "@name" selects attribute instead of element text.
+'''
+
+
+def parse_path(path, relative=False):
+    '''
+    Returns (anywhere, steps) of path expression, raises ValueError if path is malformed
+    '''
+    anywhere = not relative and path.startswith('//')
+    steps = path.strip('/').split('/')
+    if not path.strip('/') or not all(steps):
+        raise ValueError('Empty path step in "%s"' % path)
+    if any(step.startswith('@') for step in steps[:-1]):
+        raise ValueError('Attribute should be the last step of "%s"' % path)
+    # Prefixes given in path are ignored as well
+    steps = ['@' + local_name(step[1:]) if step.startswith('@') else local_name(step) for step in steps]
+    return anywhere, steps
+
+
+def local_name(key):
+    return key.rpartition('}')[2].rpartition(':')[2]
+
+
+def children(node, name):
+    for key, value in node.items():
+        if key[0] in '@$' or (name != '*' and local_name(key) != name):
+            continue
+        if isinstance(value, list):
+            for item in value:
+                yield item
+        else:
+            yield value
+
+
+def descendants(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(children(node, '*'))
+
+
+def select(node, path):
+    '''
+    Returns list of (value text or None, containing element) of values found by parsed path
+    '''
+    anywhere, steps = path
+    nodes = list(descendants(node)) if anywhere else [node]
+    for step in steps[:-1]:
+        nodes = [child for node in nodes for child in children(node, step)]
+
+    last = steps[-1]
+    if last.startswith('@'):
+        found = []
+        for node in nodes:
+            for key, value in node.items():
+                if key[0] == '@' and key != '@xmlns' and local_name(key[1:]) == last[1:]:
+                    found.append((value, node))
+        return found
+    return [(child.get('$'), node) for node in nodes for child in children(node, last)]
+
+
+def values(tree, path):
+    '''
+    Returns distinct non-empty values found by parsed path, in document order
+    '''
+    found, seen = [], set()
+    for value, node in select(tree, path):
+        if value and value not in seen:
+            seen.add(value)
+            found.append(value)
+    return found
@@ -0,0 +1,134 @@
+'''
+Profiling of single requests.
+
+Profile is started for request thread and collects timings of Driver calls and DB commands they sent
+(Driver reports them while profile is active), errors raised from Driver calls and either:
+    sample   - stacks of request thread taken every interval by sampler thread, saved in collapsed
+               format ("frame;frame;frame count" lines) for flame graph tools (flamegraph.pl, speedscope)
+    cprofile - cProfile function statistics, saved as pstats file (snakeviz, python -m pstats)
+Nothing is collected in threads without active profile.
+'''
+from collections import Counter
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+
+MODES = ('sample', 'cprofile')
+
+_active = threading.local()
+
+
+def current():
+    # Profile of current thread, None if it isn't profiled
+    return getattr(_active, 'profile', None)
+
+
+class StackSampler:
+    '''
+    Takes stacks of one thread from another one (sys._current_frames)
+    '''
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        # collapsed stack -> samples
+        self.stacks = Counter()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='xdb-stack-sampler', daemon=True)
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        self.__thread.join()
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join('%s %d\n' % (stack, count) for stack, count in self.stacks.most_common())
+
+
+class Profile:
+
+    def __init__(self, mode='sample', interval=0.001):
+        assert mode in MODES, 'mode should be one of %s' % str(MODES)
+        self.mode = mode
+        self.interval = interval
+        # Driver method -> [calls, seconds, DB commands, DB seconds]; nested calls counted in outer ones too
+        self.calls = {}
+        self.errors = []
+        self.elapsed = None
+        self.__profiler = None
+        self.__sampler = None
+
+    def start(self):
+        _active.profile = self
+        self.__started = time.perf_counter()
+        if self.mode == 'cprofile':
+            self.__profiler = cProfile.Profile()
+            self.__profiler.enable()
+        else:
+            self.__sampler = StackSampler(threading.get_ident(), self.interval)
+            self.__sampler.start()
+
+    def stop(self):
+        if self.__profiler is not None:
+            self.__profiler.disable()
+        if self.__sampler is not None:
+            self.__sampler.stop()
+        self.elapsed = time.perf_counter() - self.__started
+        _active.profile = None
+
+    def add_call(self, method, seconds, error=None):
+        entry = self.calls.setdefault(method, [0, 0.0, 0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        if error is not None:
+            self.errors.append({'method': method, 'error': '%s: %s' % (type(error).__name__, error)})
+
+    def add_command(self, method, seconds):
+        entry = self.calls.setdefault(method, [0, 0.0, 0, 0.0])
+        entry[2] += 1
+        entry[3] += seconds
+
+    def server_timing(self):
+        '''
+        Returns Server-Timing header value: total time, then Driver methods slowest first
+        '''
+        items = ['total;dur=%.2f' % (self.elapsed * 1000)]
+        for method, (calls, seconds, commands, db_seconds) in sorted(self.calls.items(), key=lambda item: -item[1][1]):
+            description = '%d calls, %d DB commands %.2f ms' % (calls, commands, db_seconds * 1000)
+            items.append('%s;dur=%.2f;desc="%s"' % (method, seconds * 1000, description))
+        return ', '.join(items)
+
+    def save(self, directory, name):
+        '''
+        Writes stacks (.collapsed) or statistics (.prof) and timings (.json) files, returns path without extension
+        '''
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        if self.__profiler is not None:
+            self.__profiler.dump_stats(path + '.prof')
+        if self.__sampler is not None:
+            with open(path + '.collapsed', 'w') as file:
+                file.write(self.__sampler.collapsed())
+        with open(path + '.json', 'w') as file:
+            json.dump({'mode': self.mode,
+                       'elapsed': self.elapsed,
+                       'calls': {method: dict(zip(('calls', 'seconds', 'db_commands', 'db_seconds'), entry))
+                                 for method, entry in self.calls.items()},
+                       'errors': self.errors}, file, indent=2)
+        return path
@@ -0,0 +1,146 @@
+'''
+Append-only segment files for large document payloads.
+
+Payload is appended to the active (last) segment and addressed by extent [segment, offset, length]
+kept in document record. Segment is never changed once written, so readers map it with mmap and take
+payloads as memoryview slices without copying, or send them with sendfile (see ExtentFile).
+When active segment grows over segment_size the next one is started. Space of removed payloads
+is reclaimed by compaction: live payloads of sparse segments are copied to the active one,
+records are pointed to new extents and old segments are deleted.
+
+Appends of several processes sharing directory are serialized with lock file (flock).
+'''
+import mmap
+import os
+import re
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SEGMENT_NAME = re.compile(r'^seg-(\d{6,})\.dat$')
+
+
+class SegmentsUnavailable(Exception):
+    # Record points to payload in segment files, but no segment store is configured
+    pass
+
+
+class ExtentFile:
+    '''
+    Read-only file-like object of one payload. fileno() and position of the underlying file
+    let WSGI servers supporting wsgi.file_wrapper (e.g. gunicorn) send it with sendfile.
+    '''
+
+    def __init__(self, path, offset, length):
+        self.length = length
+        self.__end = offset + length
+        self.__file = open(path, 'rb', buffering=0)
+        self.__file.seek(offset)
+
+    def read(self, size=-1):
+        left = self.__end - self.__file.tell()
+        if size is None or size < 0 or size > left:
+            size = left
+        return self.__file.read(size) if size > 0 else b''
+
+    def fileno(self):
+        return self.__file.fileno()
+
+    def tell(self):
+        return self.__file.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.__file.seek(offset, whence)
+
+    def close(self):
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SegmentStore:
+
+    def __init__(self, path, segment_size=256 * 1024 * 1024, fsync=True):
+        self.path = path
+        self.segment_size = segment_size
+        # Payload is on disk before record referring to it is saved
+        self.fsync = fsync
+        os.makedirs(path, exist_ok=True)
+        self.__lock = Lock()
+        # segment -> mmap of its (growing) file, remapped when asked for beyond mapped end
+        self.__maps = {}
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, 'seg-%06d.dat' % segment)
+
+    def segments(self):
+        '''
+        Returns {segment: size in bytes} of all segment files
+        '''
+        output = {}
+        for name in os.listdir(self.path):
+            found = SEGMENT_NAME.match(name)
+            if found:
+                output[int(found.group(1))] = os.path.getsize(os.path.join(self.path, name))
+        return output
+
+    def modified(self, segment):
+        # Time of the last append to segment
+        return os.path.getmtime(self.segment_path(segment))
+
+    def append(self, data):
+        '''
+        Writes payload to the active segment, returns its extent [segment, offset, length]
+        '''
+        with self.__lock, open(os.path.join(self.path, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            segments = self.segments()
+            segment = max(segments) if segments else 1
+            size = segments.get(segment, 0)
+            if size and size + len(data) > self.segment_size:
+                segment += 1
+            fd = os.open(self.segment_path(segment), os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+            try:
+                offset = os.lseek(fd, 0, os.SEEK_END)
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                if self.fsync:
+                    (getattr(os, 'fdatasync', None) or os.fsync)(fd)
+            finally:
+                os.close(fd)
+        return [segment, offset, len(data)]
+
+    def read(self, extent):
+        '''
+        Returns payload as memoryview of segment mapped into memory
+        '''
+        segment, offset, length = extent
+        mapped = self.__maps.get(segment)
+        if mapped is None or len(mapped) < offset + length:
+            with self.__lock:
+                mapped = self.__maps.get(segment)
+                if mapped is None or len(mapped) < offset + length:
+                    with open(self.segment_path(segment), 'rb') as file:
+                        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                    # Previous mapping stays valid for views taken from it
+                    self.__maps[segment] = mapped
+        return memoryview(mapped)[offset:offset + length]
+
+    def open(self, extent):
+        segment, offset, length = extent
+        return ExtentFile(self.segment_path(segment), offset, length)
+
+    def remove(self, segment):
+        # Mapped or opened payloads stay readable until released (POSIX)
+        with self.__lock:
+            self.__maps.pop(segment, None)
+        os.remove(self.segment_path(segment))
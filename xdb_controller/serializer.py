@@ -0,0 +1,124 @@
+import zlib
+from .converter import split, resolve, unescape
+
+try:
+    from lxml.etree import xmlfile, Element
+except ImportError:
+    xmlfile = None
+
+
+class _Sink:
+    # File-like object collecting serialized bytes until they are taken away
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def iter_xml(tree, encoding='utf-8', prettify=True, chunk_size=64 * 1024, default_root_name='root', indent='  ',
+             escaped=False):
+    '''
+    Serializes badgerfish tree into XML incrementally, yielding encoded chunks of about chunk_size bytes.
+    Tree is walked without recursion and without building XML tree, so memory used
+    besides the tree itself doesn't depend on document size. escaped - tree is stored as BSON, with escaped keys.
+    '''
+    assert xmlfile is not None, 'streaming serialization requires lxml'
+
+    if isinstance(tree, dict) and len(tree) == 1:
+        root = next(iter(tree.items()))
+    else:
+        root = (default_root_name, tree)
+
+    names = {} if escaped else None
+    sink = _Sink()
+    with xmlfile(sink, encoding=encoding, buffered=False) as xf:
+        xf.write_declaration()
+
+        # [element context, children iterator, depth, has children, namespaces in scope]
+        stack = [[None, iter([root]), 0, False, {}]]
+        while stack:
+            entry = stack[-1]
+            for key, value in entry[1]:
+                attrib, nsmap, text, children = split(value, escaped)
+                scope = entry[4]
+                if nsmap:
+                    scope = dict(scope)
+                    scope.update(nsmap)
+                tag = resolve(unescape(key, names) if escaped else key, scope)
+                # xmlfile declares own prefix for xml namespace given in Clark notation
+                attrib = dict((attr if attr.startswith('xml:') else resolve(attr, scope, attribute=True), attr_value)
+                              for attr, attr_value in attrib)
+
+                if prettify and entry[0] is not None:
+                    xf.write('\n' + indent * entry[2])
+                entry[3] = True
+
+                if not children and not text and not nsmap and tag[0] != '{':
+                    # Empty element written as a whole gets short form <tag/>
+                    xf.write(Element(tag, attrib))
+                    break
+
+                context = xf.element(tag, attrib, nsmap=nsmap)
+                context.__enter__()
+                if text:
+                    xf.write(text)
+                stack.append([context, iter(children), entry[2] + 1, False, scope])
+                break
+            else:
+                stack.pop()
+                if entry[0] is not None:
+                    if prettify and entry[3]:
+                        xf.write('\n' + indent * (entry[2] - 1))
+                    entry[0].__exit__(None, None, None)
+
+            if sink.size >= chunk_size:
+                yield sink.take()
+
+    data = sink.take()
+    if data:
+        yield data
+
+
+def iter_gunzip(data, chunk_size=64 * 1024):
+    '''
+    Decompresses gzip data yielding chunks of at most chunk_size bytes
+    '''
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while data:
+        chunk = decompressor.decompress(data, chunk_size)
+        data = decompressor.unconsumed_tail
+        if chunk:
+            yield chunk
+    chunk = decompressor.flush()
+    if chunk:
+        yield chunk
+
+
+def iter_slices(data, chunk_size=64 * 1024):
+    # Stored bytes (or memoryview of segment file) sent as they are, chunk by chunk
+    for start in range(0, len(data), chunk_size):
+        yield bytes(data[start:start + chunk_size])
+
+
+def iter_multipart(parts, boundary):
+    '''
+    Yields multipart body of parts given as (headers, chunks) pairs;
+    headers - list of (name, value), chunks - iterable of bytes
+    '''
+    for headers, chunks in parts:
+        head = ''.join('{}: {}\r\n'.format(name, value) for name, value in headers)
+        yield '--{}\r\n{}\r\n'.format(boundary, head).encode('ascii')
+        for chunk in chunks:
+            yield chunk
+        yield b'\r\n'
+    yield '--{}--\r\n'.format(boundary).encode('ascii')
@@ -0,0 +1,281 @@
+'''
+Database records and updates shared by Driver and AsyncDriver.
+
+Nothing here does I/O: drivers send what these functions build with their own (blocking or asyncio)
+collections, so documents, blobs, indexes and history are kept in one format whichever driver wrote them.
+Operations of several calls are generators of steps (see step), drivers make the calls and send results back.
+'''
+from collections import namedtuple
+from hashlib import sha256
+import gzip
+
+from bson import BSON
+from bson.binary import Binary
+from bson.json_util import dumps
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from . import delta
+from . import textindex
+from .segments import SegmentsUnavailable
+
+# Document fields moved to shared blob when deduplicated; extent - raw payload kept in segment files
+PAYLOAD_FIELDS = ('data', 'raw', 'extent')
+# Content fields of document record, those new content has not are removed on update
+CONTENT_FIELDS = PAYLOAD_FIELDS + ('blob', 'format', 'size', 'sha256')
+# Fields needed to render document of batch read; version - to save tree built from raw bytes
+BATCH_FIELDS = {'_id': 0, 'doc_id': 1, 'last_modified': 1, 'encoding': 1, 'size': 1, 'format': 1, 'version': 1,
+                'data': 1, 'raw': 1, 'blob': 1, 'extent': 1}
+# Raw documents are served as uploaded, so their trees are not fetched to be sent
+RAW_BATCH_FIELDS = {field: value for field, value in BATCH_FIELDS.items() if field != 'data'}
+RAW_PAYLOAD_FIELDS = ('raw', 'extent')
+DEDUP_STATS_ID = 'dedup'
+BLOB_RELEASE = {'$inc': {'refs': -1}}
+
+# (collection, index keys, unique) of documents storage
+INDEXES = (
+    # Documents are stored one per record; every lookup goes by (org_id, doc_id)
+    ('docs', [('org_id', ASCENDING), ('doc_id', ASCENDING)], True),
+    # Listing ordered by modification time
+    ('docs', [('org_id', ASCENDING), ('last_modified', ASCENDING), ('doc_id', ASCENDING)], False),
+    # Business keys: lookup by value and cleanup by document
+    ('keys', [('org_id', ASCENDING), ('name', ASCENDING), ('value', ASCENDING), ('doc_id', ASCENDING)], True),
+    ('keys', [('org_id', ASCENDING), ('doc_id', ASCENDING)], False),
+    # Full-text postings: query by term and cleanup by document
+    ('terms', [('org_id', ASCENDING), ('term', ASCENDING), ('doc_id', ASCENDING)], True),
+    ('terms', [('org_id', ASCENDING), ('doc_id', ASCENDING)], False),
+    # Previous versions of documents; unique index stops concurrent update of the same version
+    ('versions', [('org_id', ASCENDING), ('doc_id', ASCENDING), ('version', ASCENDING)], True),
+)
+
+
+def doc_filter(org_id, doc_id):
+    return {'org_id': org_id, 'doc_id': doc_id}
+
+
+def key_records(org_id, doc_id, keys):
+    return [{'org_id': org_id, 'doc_id': doc_id, 'name': name, 'value': value} for name, value in keys]
+
+
+def term_records(org_id, doc_id, terms):
+    return [{'org_id': org_id, 'term': term, 'doc_id': doc_id, 'pos': Binary(textindex.encode(positions))}
+            for term, positions in terms.items()]
+
+
+Step = namedtuple('Step', 'target method args kwargs')
+
+
+def step(target, method, *args, **kwargs):
+    '''
+    Call of operation generator: method of collection ("docs", "blobs", "blob_stats", "versions", "keys",
+    "terms") or of segment files ("segments"). Driver sends back the result (found documents as list)
+    or throws in the error of the call.
+    '''
+    return Step(target, method, args, kwargs)
+
+
+def offload_payload(record, segments, threshold):
+    # Moves large raw payload of record (document or blob) to segment files, if they are used
+    if segments is not None and 'raw' in record and len(record['raw']) >= threshold:
+        record['extent'] = yield step('segments', 'append', record.pop('raw'))
+
+
+def payload_store(org_id, records, dedup, segments, threshold):
+    # Puts payloads of new document records into shared blobs or, large raw ones, into segment files
+    if dedup:
+        yield from blobs_store(org_id, records, segments, threshold)
+    else:
+        for record in records:
+            yield from offload_payload(record, segments, threshold)
+
+
+def needs_blob(doc):
+    # Fetched document stored by blob reference has no payload of its own
+    return 'blob' in doc and not any(field in doc for field in PAYLOAD_FIELDS)
+
+
+def attach_payload(doc, blob, segments):
+    '''
+    Puts payload of shared blob (if given) into fetched document,
+    payload kept in segment files is mapped as memoryview
+    '''
+    for field in PAYLOAD_FIELDS:
+        if field in (blob or ()):
+            doc[field] = blob[field]
+    if 'extent' in doc and 'raw' not in doc:
+        if segments is None:
+            raise SegmentsUnavailable('Payload of document %s is kept in segment files, '
+                                      'but segments_path is not set.' % doc.get('doc_id'))
+        doc['raw'] = segments.read(doc['extent'])
+
+
+def blob_payload(org_id, record):
+    '''
+    Moves payload fields of document record into returned blob payload, record gets blob reference
+    '''
+    payload = {field: record.pop(field) for field in PAYLOAD_FIELDS if field in record}
+    payload['format'] = record.get('format', 'json')
+    if 'raw' in payload:
+        # Raw bytes are decoded with encoding given on upload
+        payload['encoding'] = record.get('encoding')
+    payload['size'] = len(BSON.encode(payload))
+    record['blob'] = blob_id(org_id, payload, record.get('sha256'))
+    return payload
+
+
+def blob_id(org_id, payload, source_sha256=None):
+    # Hash of canonical content: parsed tree (whitespace, quoting, encoding and declaration
+    # differences are gone) as stored; raw documents keep original bytes, so those are hashed.
+    # Content is shared within organization only: other one can't learn it has the same by timing or stats
+    if 'raw' in payload:
+        digest = '{}:{}'.format(payload['encoding'],
+                                source_sha256 or sha256(gzip.decompress(payload['raw'])).hexdigest())
+    elif payload['format'] == 'json':
+        digest = sha256(payload['data'].encode()).hexdigest()
+    else:
+        digest = sha256(dumps(payload['data']).encode()).hexdigest()
+    return '{}:{}:{}'.format(org_id, payload['format'], digest)
+
+
+def blobs_store(org_id, records, segments, threshold):
+    '''
+    Moves payloads of document records into blobs keyed by content hash, so identical content
+    is stored once; records get blob reference. Existing blob just gets one more reference.
+    References of records which fail to save are dropped with blobs_unref.
+    '''
+    payloads = [blob_payload(org_id, record) for record in records]
+    sizes = [payload['size'] for payload in payloads]
+
+    if segments is not None:
+        # Only content not stored yet is written to segments
+        new = {record['blob']: payload for record, payload in zip(records, payloads)}
+        for blob in (yield step('blobs', 'find', {'_id': {'$in': list(new)}}, {'_id': 1})):
+            del new[blob['_id']]
+        for payload in new.values():
+            yield from offload_payload(payload, segments, threshold)
+        payloads = [new.get(record['blob'], payload) for record, payload in zip(records, payloads)]
+
+    # Ordered, so copies within one batch are counted as hits as well
+    result = yield step('blobs', 'bulk_write', [blob_store_request(record, payload)
+                                                for record, payload in zip(records, payloads)])
+    yield step('blob_stats', 'update_one', {'_id': dedup_stats_id(org_id)},
+               blob_store_stats(sizes, list(result.upserted_ids)), upsert=True)
+
+
+def blob_release(org_id, blob_id):
+    # Drops one reference of organization blob, blob goes with its last reference
+    blob = yield step('blobs', 'find_one_and_update', {'_id': blob_id}, BLOB_RELEASE,
+                      projection={'refs': 1, 'size': 1}, return_document=ReturnDocument.AFTER)
+    if not blob:
+        return
+    if blob['refs'] > 0:
+        yield step('blob_stats', 'update_one', {'_id': dedup_stats_id(org_id)}, blob_release_stats(blob),
+                   upsert=True)
+    elif (yield step('blobs', 'delete_one', blob_unused(blob_id))).deleted_count:
+        yield step('blob_stats', 'update_one', {'_id': dedup_stats_id(org_id)},
+                   blob_release_stats(blob, deleted=True), upsert=True)
+
+
+def blobs_unref(org_id, records):
+    # Drops blob references taken for records which were not saved
+    for record in records:
+        if 'blob' in record:
+            yield from blob_release(org_id, record['blob'])
+
+
+def dedup_stats_id(org_id):
+    # Dedup counters are kept per organization
+    return '{}:{}'.format(DEDUP_STATS_ID, org_id)
+
+
+def blob_store_request(record, payload):
+    # New blob gets payload, existing one just one more reference
+    return UpdateOne({'_id': record['blob']}, {'$setOnInsert': payload, '$inc': {'refs': 1}}, upsert=True)
+
+
+def blob_store_stats(sizes, upserted):
+    '''
+    Update of dedup stats after blobs of given payload sizes were stored;
+    upserted - indexes of payloads which made new blobs
+    '''
+    stored = sum(sizes[index] for index in upserted)
+    return {'$inc': {'hits': len(sizes) - len(upserted), 'saved': sum(sizes) - stored,
+                     'blobs': len(upserted), 'stored': stored}}
+
+
+def blob_unused(blob_id):
+    # Condition keeps blob which got new reference meanwhile
+    return {'_id': blob_id, 'refs': {'$lte': 0}}
+
+
+def blob_release_stats(blob, deleted=False):
+    # Update of dedup stats after blob (as returned by BLOB_RELEASE) lost reference or was deleted
+    if deleted:
+        return {'$inc': {'blobs': -1, 'stored': -blob.get('size', 0)}}
+    # One copy less is saved
+    return {'$inc': {'saved': -blob.get('size', 0)}}
+
+
+def history_record(org_id, current, old_tree, new_tree, snapshot_interval):
+    '''
+    Record of current document version replaced by new content: in full every snapshot_interval
+    versions, otherwise as reverse delta against the new tree
+    '''
+    version = current.get('version', 1)
+    history = {'org_id': org_id, 'doc_id': current['doc_id'], 'version': version,
+               'last_modified': current.get('last_modified')}
+    if version % snapshot_interval == 0:
+        history['snapshot'] = dumps(old_tree)
+    else:
+        history['delta'] = dumps(delta.diff(new_tree, old_tree))
+    return history
+
+
+def version_filter(org_id, current):
+    # Matches document only while it is still of current version
+    return dict(doc_filter(org_id, current['doc_id']),
+                version=current['version'] if 'version' in current else {'$exists': False})
+
+
+def content_update(record):
+    # Replaces content fields of document with those of new record
+    update = {'$set': record}
+    unset = {field: '' for field in CONTENT_FIELDS if field not in record}
+    if unset:
+        update['$unset'] = unset
+    return update
+
+
+def doc_replace(org_id, current, record, history, dedup, segments, threshold):
+    '''
+    Saves new content record of current document along with history record of replaced version,
+    drops keys and postings of replaced content. Returns False (nothing saved) if document was changed meanwhile.
+    '''
+    # Unique (org_id, doc_id, version) index stops concurrent update of the same version
+    try:
+        yield step('versions', 'insert_one', history)
+    except DuplicateKeyError:
+        return False
+
+    yield from payload_store(org_id, [record], dedup, segments, threshold)
+    result = yield step('docs', 'update_one', version_filter(org_id, current), content_update(record))
+    if not result.matched_count:
+        yield step('versions', 'delete_one', dict(doc_filter(org_id, current['doc_id']), version=history['version']))
+        yield from blobs_unref(org_id, [record])
+        return False
+
+    if 'blob' in current:
+        yield from blob_release(org_id, current['blob'])
+    for target in ('keys', 'terms'):
+        yield step(target, 'delete_many', doc_filter(org_id, current['doc_id']))
+    return True
+
+
+def doc_remove(org_id, doc_id):
+    # Removes document with its blob reference, keys, postings and history; returns True if there was one
+    doc = yield step('docs', 'find_one_and_delete', doc_filter(org_id, doc_id), projection={'blob': 1})
+    if doc and 'blob' in doc:
+        yield from blob_release(org_id, doc['blob'])
+    for target in ('keys', 'terms', 'versions'):
+        yield step(target, 'delete_many', doc_filter(org_id, doc_id))
+    return doc is not None
@@ -0,0 +1,111 @@
+'''
+Full-text inverted index of document text (element texts and attribute values).
+
+Every (term, document) pair is one posting holding term positions in the document, positions are
+delta encoded as varints. Postings are kept in doc_terms collection indexed by (org_id, term, doc_id),
+so query reads only postings of its terms whatever the corpus size is.
+
+Query: words are ANDed, "quoted words" form phrase, OR (uppercase) separates alternatives, e.g.
+    Роздріб "цена закупки" OR Description
+'''
+import re
+
+# Unicode letters/digits; text is case folded, so Cyrillic and Latin terms match regardless of case
+TOKEN = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 64
+QUERY_ITEM = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(text.casefold()) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+def text_nodes(tree):
+    # Element texts and attribute values in document order
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        children = []
+        for key, value in node.items():
+            if key == '$':
+                if isinstance(value, str):
+                    yield value
+            elif key[0] == '@':
+                if key != '@xmlns' and isinstance(value, str):
+                    yield value
+            elif isinstance(value, list):
+                children.extend(value)
+            else:
+                children.append(value)
+        stack.extend(reversed(children))
+
+
+def postings(tree):
+    '''
+    Returns {term: [positions]} of badgerfish tree; phrases never span two text nodes
+    '''
+    terms = {}
+    position = 0
+    for text in text_nodes(tree):
+        for token in tokenize(text):
+            terms.setdefault(token, []).append(position)
+            position += 1
+        position += 1
+    return terms
+
+
+def encode(positions):
+    output = bytearray()
+    previous = 0
+    for position in positions:
+        delta = position - previous
+        previous = position
+        while delta >= 0x80:
+            output.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        output.append(delta)
+    return bytes(output)
+
+
+def decode(data):
+    positions = []
+    position = shift = delta = 0
+    for byte in data:
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            position += delta
+            positions.append(position)
+            shift = delta = 0
+    return positions
+
+
+def parse_query(query):
+    '''
+    Returns list of alternatives, each one list of phrases (lists of terms) all required to match.
+    Raises ValueError if query has no terms.
+    '''
+    clauses = [[]]
+    for phrase, word in QUERY_ITEM.findall(query):
+        if word == 'OR':
+            clauses.append([])
+            continue
+        terms = tokenize(phrase or word)
+        if terms:
+            clauses[-1].append(terms)
+    clauses = [clause for clause in clauses if clause]
+    if not clauses:
+        raise ValueError('Query has no terms to search')
+    return clauses
+
+
+def phrase_matches(positions):
+    '''
+    positions - positions lists of phrase terms in one document; True if terms follow one another
+    '''
+    following = [set(term_positions) for term_positions in positions[1:]]
+    for start in positions[0]:
+        if all(start + offset in term_positions for offset, term_positions in enumerate(following, 1)):
+            return True
+    return False
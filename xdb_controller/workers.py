@@ -0,0 +1,131 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+import os
+import shutil
+import tempfile
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+class ConversionError(Exception):
+    # Parser errors can't be pickled, pool processes report them with this one
+    pass
+
+
+class ConversionService:
+    '''
+    Runs CPU-bound XML conversions in a pool of processes, so they don't hold the GIL
+    of request threads. Conversions of data smaller than threshold (bytes) run inline,
+    as sending them to another process costs more than conversion itself.
+    At most max_pending conversions are queued, ServiceBusy is raised above that.
+    max_workers=0 disables the pool, everything runs inline.
+    Pool broken by died process (e.g. killed for memory) is replaced, and conversion is tried once more.
+    '''
+
+    def __init__(self, max_workers=0, threshold=1024 * 1024, max_pending=None):
+        self.max_workers = max_workers
+        self.threshold = threshold
+        self.max_pending = max_pending or max_workers * 2
+        self.__slots = BoundedSemaphore(self.max_pending) if max_workers else None
+        self.__executor = None
+        self.__lock = Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.max_workers)
+
+    def offloaded(self, size):
+        return self.enabled and size is not None and size >= self.threshold
+
+    def run(self, size, func, *args):
+        if not self.offloaded(size):
+            return func(*args)
+
+        if not self.__slots.acquire(blocking=False):
+            raise ServiceBusy('Too many documents are being converted, try again later.')
+        try:
+            executor = self.__get_executor()
+            try:
+                return executor.submit(func, *args).result()
+            except BrokenProcessPool:
+                return self.__get_executor(broken=executor).submit(func, *args).result()
+        finally:
+            self.__slots.release()
+
+    def shutdown(self):
+        with self.__lock:
+            if self.__executor:
+                self.__executor.shutdown()
+                self.__executor = None
+
+    def __get_executor(self, broken=None):
+        # Created on first use, so forking web server workers get their own pools.
+        # Broken pool is replaced once, however many conversions found it broken
+        with self.__lock:
+            if broken is not None and self.__executor is broken:
+                broken.shutdown(wait=False)
+                self.__executor = None
+            if self.__executor is None:
+                self.__executor = ProcessPoolExecutor(self.max_workers)
+            return self.__executor
+
+
+def spool(stream, max_size=None, chunk_size=64 * 1024):
+    '''
+    Copies stream into temporary file for conversion in another process. Returns file path.
+    '''
+    from .ingest import IngestLimitError
+
+    fd, path = tempfile.mkstemp(suffix='.xml')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            if max_size is None:
+                shutil.copyfileobj(stream, file, chunk_size)
+            else:
+                size = 0
+                for chunk in iter(lambda: stream.read(chunk_size), b''):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise IngestLimitError('Document exceeds size limit of %d bytes' % max_size)
+                    file.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+# Conversions below run in pool processes; arguments and results travel pickled
+
+def build_document(data, encoding, storage_format, key_rules=None, text_index=False):
+    from .controller import DocumentModel, ParseError
+
+    document = DocumentModel(encoding=encoding, storage_format=storage_format, key_rules=key_rules,
+                             text_index=text_index)
+    try:
+        document.data = data
+    except ParseError as err:
+        raise ConversionError(str(err))
+    return document
+
+
+def ingest_file(path, encoding, storage_format, max_size, max_depth, key_rules=None, text_index=False,
+                keep_tree=False):
+    from .controller import DocumentModel, ParseError
+
+    with open(path, 'rb') as file:
+        try:
+            return DocumentModel.from_stream(file, encoding, storage_format, max_size=max_size, max_depth=max_depth,
+                                             key_rules=key_rules, text_index=text_index, keep_tree=keep_tree)
+        except ParseError as err:
+            raise ConversionError(str(err))
+
+
+def render_document(data, storage_format, method, encoding, prettify):
+    from .controller import DocumentModel
+
+    tree, escaped = DocumentModel.stored_tree(data, storage_format)
+    return DocumentModel.json_to_xml(tree, method=method, encoding=encoding, prettify=prettify,
+                                     escaped=escaped).encode(encoding)